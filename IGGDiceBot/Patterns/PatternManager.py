@@ -2,56 +2,71 @@ import json
 from typing import List
 from Patterns.Pattern import Pattern
 from database import Database
+import dbtrace
+import tenants
+from metrics import PATTERN_SECONDS, instrument_methods
 
 
 class PatternManager:
+    """Паттерны альянса текущего апдейта; у каждого альянса свой активный паттерн"""
+
     def __init__(self, db: Database):
         self.db = db
     
     async def get_active_pattern(self) -> Pattern:
-        """Получить активный паттерн"""
-        response = self.db.client.table('table_patterns')\
-            .select('*')\
-            .eq('status', 'Active')\
-            .execute()
+        """Получить активный паттерн (кэшируется до изменения паттернов)"""
+        state = self.db._state()
+        rows = state.active_pattern
+        if rows is None:
+            version = state.roster_version
+            rows = await self.db._fetch(self.db._scoped(self.db.client.table('table_patterns')\
+                .select('*'))\
+                .eq('status', 'Active'))
+            # Паттерн могли поменять, пока шел запрос - тогда результат не кэшируем
+            if state.roster_version == version:
+                state.active_pattern = rows
         
-        if response.data:
-            return Pattern.from_db(response.data[0])
+        if rows:
+            return Pattern.from_db(rows[0])
         return None
     
     async def set_active_pattern(self, pattern_id: int):
         """Установить активный паттерн"""
         # Сначала сбрасываем все статусы
-        self.db.client.table('table_patterns')\
-            .update({'status': 'Disable'})\
-            .neq('status', 'Disable').execute()
+        await self.db._execute(self.db._scoped(self.db.client.table('table_patterns')\
+            .update({'status': 'Disable'}))\
+            .neq('status', 'Disable'))
 
         # Устанавливаем новый активный
-        self.db.client.table('table_patterns')\
-            .update({'status': 'Active', 'updated_at': 'now()'})\
-            .eq('id', pattern_id)\
-            .execute()
+        await self.db._execute(self.db._scoped(self.db.client.table('table_patterns')\
+            .update({'status': 'Active', 'updated_at': 'now()'}))\
+            .eq('id', pattern_id))
+        self.db.patterns_changed()
     
     async def create_pattern(self, pattern_name: str, pattern_elements: List[str], pattern_mas_elements: List[List[str]]):
         """Создать новый паттерн"""
         pattern_data = {
+            'alliance_id': tenants.current_id(),
             'pattern_name': pattern_name,
             'pattern_elements': ','.join(pattern_elements),
             'pattern_mas_elements': json.dumps(pattern_mas_elements),
             'status': 'Disable'
         }
         
-        response = self.db.client.table('table_patterns')\
-            .insert(pattern_data)\
-            .execute()
+        rows = await self.db._fetch(self.db.client.table('table_patterns')\
+            .insert(pattern_data))
+        self.db.patterns_changed()
         
-        return response.data[0] if response.data else None
+        return rows[0] if rows else None
     
     async def get_all_patterns(self):
         """Получить все паттерны"""
-        response = self.db.client.table('table_patterns')\
-            .select('*')\
-            .order('created_at')\
-            .execute()
+        rows = await self.db._fetch(self.db._scoped(self.db.client.table('table_patterns')\
+            .select('*'))\
+            .order('created_at'))
         
-        return [Pattern.from_db(pattern) for pattern in response.data]
\ No newline at end of file
+        return [Pattern.from_db(pattern) for pattern in rows]
+
+
+dbtrace.label_methods(PatternManager)
+instrument_methods(PatternManager, PATTERN_SECONDS)
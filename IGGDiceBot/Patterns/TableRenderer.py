@@ -1,12 +1,15 @@
 # WeasyPrintRenderer.py
-from weasyprint import HTML, CSS
-from weasyprint.text.fonts import FontConfiguration
+# WeasyPrint и Pillow тяжелые: импортируются при первом рендере или в warm_up
 from io import BytesIO
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Set
 from Patterns.Pattern import Pattern
+from metrics import RENDER_SECONDS
+from logs import get_logger
 import tempfile
 import os
 
+log = get_logger("renderer")
+
 class TableRenderer:
     def __init__(self):
         self.colors = {
@@ -19,17 +22,55 @@ class TableRenderer:
         }
     
     def create_table_image(self, pattern: Pattern, grouped_players: Dict[str, List[str]], 
-                          leaders: List[str], soldiers: List[str], updated_players: List[str]) -> BytesIO:
-        """Создание таблицы через WeasyPrint"""
-        
+                          leaders: Set[str], soldiers: Set[str], updated_players: Set[str]) -> Optional[BytesIO]:
+        """Создание таблицы через WeasyPrint; None, если картинку построить нечем"""
+        
+        columns = self.table_columns(pattern, grouped_players)
+        
+        def cell_color(column, player_name):
+            if player_name in leaders:
+                return self.colors['leader']
+            if player_name in soldiers:
+                return self.colors['soldier']
+            if player_name in updated_players:
+                return self.colors['updated']
+            return self.colors['default']
+        
+        with RENDER_SECONDS.time(phase="html"):
+            html_content = self._create_html_table(columns, grouped_players, cell_color)
+        return self._render_png(html_content, columns, grouped_players)
+    
+    @staticmethod
+    def table_columns(pattern: Pattern, grouped_players: Dict[str, List[str]]) -> List[str]:
         if 'NOPATTERN' in grouped_players and grouped_players['NOPATTERN']:
-            columns = pattern.pattern_elements + ['NOPATTERN']
-        else:
-            columns = pattern.pattern_elements
-        
-        html_content = self._create_html_table(columns, grouped_players, leaders, soldiers, updated_players)
-        
+            return pattern.pattern_elements + ['NOPATTERN']
+        return pattern.pattern_elements
+    
+    @staticmethod
+    def create_text_table(columns: List[str], grouped_players: Dict[str, List[str]]) -> str:
+        """Таблица текстом, когда картинку построить нечем: по блоку на столбец"""
+        blocks = []
+        for column in columns:
+            players = grouped_players.get(column, [])
+            blocks.append(f"{column} ({len(players)}):\n" + ("\n".join(players) if players else "—"))
+        return "\n\n".join(blocks)
+    
+    def create_diff_image(self, columns: Dict[str, List[str]], column_colors: Dict[str, str]) -> Optional[BytesIO]:
+        """Таблица изменений ростера: столбец на каждый вид изменения,
+        ячейки окрашены цветом столбца (ключ из self.colors); None, если
+        картинку построить нечем"""
+        with RENDER_SECONDS.time(phase="html"):
+            html_content = self._create_html_table(
+                list(columns), columns,
+                lambda column, player_name: self.colors[column_colors.get(column, 'default')]
+            )
+        return self._render_png(html_content, list(columns), columns)
+    
+    def _render_png(self, html_content: str, columns, grouped_players) -> Optional[BytesIO]:
         try:
+            from weasyprint import HTML, CSS
+            from weasyprint.text.fonts import FontConfiguration
+            
             font_config = FontConfiguration()
             css = CSS(string='''
                 @font-face {
@@ -46,15 +87,16 @@ class TableRenderer:
             html = HTML(string=html_content)
             buf = BytesIO()
             
-            html.write_png(buf, stylesheets=[css], font_config=font_config)
+            with RENDER_SECONDS.time(phase="png"):
+                html.write_png(buf, stylesheets=[css], font_config=font_config)
             buf.seek(0)
             return buf
             
         except Exception as e:
-            print(f"Ошибка WeasyPrint: {e}")
+            log.error("Ошибка WeasyPrint: %s", e)
             return self._create_fallback_image(columns, grouped_players)
     
-    def _create_html_table(self, columns, grouped_players, leaders, soldiers, updated_players):
+    def _create_html_table(self, columns, grouped_players, cell_color: Callable[[str, str], str]):
         max_rows = max(len(players) for players in grouped_players.values()) if grouped_players else 0
         
         html = f'''<!DOCTYPE html>
@@ -125,17 +167,7 @@ class TableRenderer:
                 players = grouped_players.get(column, [])
                 player_name = players[i] if i < len(players) else ''
                 
-                if player_name:
-                    if player_name in leaders:
-                        bg_color = self.colors['leader']
-                    elif player_name in soldiers:
-                        bg_color = self.colors['soldier']
-                    elif player_name in updated_players:
-                        bg_color = self.colors['updated']
-                    else:
-                        bg_color = self.colors['default']
-                else:
-                    bg_color = self.colors['default']
+                bg_color = cell_color(column, player_name) if player_name else self.colors['default']
                 
                 html += f'<td style="background-color: {bg_color};">{self._escape_html(player_name)}</td>'
             
@@ -158,8 +190,13 @@ class TableRenderer:
                   .replace('>', '&gt;')
                   .replace('"', '&quot;'))
     
-    def _create_fallback_image(self, columns, grouped_players):
-        from PIL import Image, ImageDraw
+    def _create_fallback_image(self, columns, grouped_players) -> Optional[BytesIO]:
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError as e:
+            # Без Pillow картинки не будет - вызывающий код отправит таблицу текстом
+            log.error("Pillow недоступен: %s", e)
+            return None
         
         img = Image.new('RGB', (800, 600), 'white')
         draw = ImageDraw.Draw(img)
@@ -180,6 +217,10 @@ class TableRenderer:
         return buf
     
     def group_players_by_pattern(self, players: List[Dict], pattern: Pattern) -> Dict[str, List[str]]:
+        with RENDER_SECONDS.time(phase="grouping"):
+            return self._group_players_by_pattern(players, pattern)
+    
+    def _group_players_by_pattern(self, players: List[Dict], pattern: Pattern) -> Dict[str, List[str]]:
         grouped = {element: [] for element in pattern.pattern_elements}
         grouped['NOPATTERN'] = []
         remaining_players = players.copy()
@@ -196,4 +237,11 @@ class TableRenderer:
             grouped[element] = matched_players
         
         grouped['NOPATTERN'] = [player.get('player_name', '') for player in remaining_players]
-        return grouped
\ No newline at end of file
+        return grouped
+
+    @staticmethod
+    def warm_up():
+        """Заранее загрузить WeasyPrint и Pillow, чтобы первый рендер не ждал импорта"""
+        import weasyprint
+        import weasyprint.text.fonts
+        import PIL.Image
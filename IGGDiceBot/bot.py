@@ -1,20 +1,89 @@
 import json
-from aiogram import Bot, Dispatcher, types, Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,BufferedInputFile
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
+import startup
+with startup.measure_import("aiogram"):
+    from aiogram import Bot, Dispatcher, types, Router, F
+    from aiogram.filters import Command, CommandObject
+    from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,BufferedInputFile
+    from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.state import State, StatesGroup
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
 from Patterns.PatternManager import PatternManager
 from Patterns.TableRenderer import TableRenderer
-from config import BOT_TOKEN, ADMIN_CHAT_ID, MY_TG_ID
+from config import BOT_TOKEN, WORKERS, TELEGRAM_API_URL
 from database import Database
+from middlewares import (
+    UserContextMiddleware, GroupChatPrefilter, HandlerMetricsMiddleware, TelegramApiMetricsMiddleware, DbTraceMiddleware,
+    LogContextMiddleware, ThrottlingMiddleware, CallbackRouteMiddleware, TenantMiddleware
+)
+from outbound import OutboundScheduler
+from fsm_storage import create_fsm_storage
+from singleflight import SingleFlight
+from paginator import ListPage, PagedKeyboard, PAGED_KEYBOARDS, nav_row
+from callbacks import (
+    callbacks, Route, ADMIN, OWNER, ApproveRegistration, RejectRegistration, SetRole, SetOwnRole, DeleteFakeName,
+    SelectPattern, NicksPage
+)
+import roster_io
+import tenants
+import snapshots
+from snapshots import SnapshotManager
+from name_index import fold
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
 import asyncio
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+)
+bot.session.middleware(TelegramApiMetricsMiddleware())
+# FSMContextMiddleware подключается ниже вручную, после фильтра групповых сообщений
+dp = Dispatcher(storage=create_fsm_storage(shared=WORKERS > 1), disable_fsm=True)
 router = Router()
 dp.include_router(router)
 db = Database()
+# Исходящие сообщения идут через очередь с учетом лимитов Telegram
+outbound = OutboundScheduler(bot, processes=WORKERS)
+
+# update_id, chat_id, хендлер и время обработки попадают в каждую запись лога
+dp.update.outer_middleware(LogContextMiddleware())
+
+# Запросы к базе за апдейт: счетчики и предупреждение о превышении бюджета
+dp.update.outer_middleware(DbTraceMiddleware())
+
+# Лишние сообщения групповых чатов отбрасываются до чтения состояния FSM и роутинга
+group_prefilter = GroupChatPrefilter(db, dp.fsm.storage)
+dp.update.outer_middleware(group_prefilter)
+dp.update.outer_middleware(dp.fsm)
+
+# Альянс апдейта определяется по чату или игроку; данные и кэши - только этого альянса
+dp.update.outer_middleware(TenantMiddleware(db))
+
+# Лимит частоты действий проверяется до загрузки пользователя
+throttling = ThrottlingMiddleware(processes=WORKERS)
+router.message.middleware(throttling)
+
+# Коллбэки разбираются один раз по таблице callbacks и передаются в dispatch_callback;
+# лимит для них проверяется по маршруту сразу после разбора
+router.callback_query.outer_middleware(CallbackRouteMiddleware(callbacks))
+router.callback_query.outer_middleware(throttling)
+
+# Пользователь и его права загружаются один раз за апдейт
+user_context = UserContextMiddleware(db)
+router.callback_query.outer_middleware(user_context)
+router.message.middleware(user_context)
+
+# Время и ошибки хендлеров для /metrics
+handler_metrics = HandlerMetricsMiddleware()
+router.message.middleware(handler_metrics)
+router.callback_query.middleware(handler_metrics)
+
+# Все коллбэки проходят через один хендлер, обработчик берется из таблицы callbacks
+@router.callback_query()
+async def dispatch_callback(callback: CallbackQuery, route: Route, **data):
+    return await route.call(callback, data)
 
 # States
 class RegistrationStates(StatesGroup):
@@ -26,25 +95,27 @@ class RegistrationStates(StatesGroup):
     waiting_for_user_to_rename = State()
     waiting_pattern_selection = State()
     waiting_pattern_add = State()
+    waiting_roster_import = State()
+    waiting_roster_import_confirm = State()
 
 # Inline keyboards
 def get_registration_keyboard(request_id: int):
     return InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"approve_{request_id}"),
-            InlineKeyboardButton(text="❌ Запретить", callback_data=f"reject_{request_id}")
+            InlineKeyboardButton(text="✅ Подтвердить", callback_data=ApproveRegistration(request_id).pack()),
+            InlineKeyboardButton(text="❌ Запретить", callback_data=RejectRegistration(request_id).pack())
         ]
     ])
 
 def get_role_keyboard(request_id: int):
     return InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="👑 Лидер", callback_data=f"role_leader_{request_id}"),
-            InlineKeyboardButton(text="⚔️ Солдат", callback_data=f"role_soldier_{request_id}")
+            InlineKeyboardButton(text="👑 Лидер", callback_data=SetRole("leader", request_id).pack()),
+            InlineKeyboardButton(text="⚔️ Солдат", callback_data=SetRole("soldier", request_id).pack())
         ],
         [
-            InlineKeyboardButton(text="👤 Участник", callback_data=f"role_member_{request_id}"),
-            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"role_reject_{request_id}")
+            InlineKeyboardButton(text="👤 Участник", callback_data=SetRole("member", request_id).pack()),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=SetRole("reject", request_id).pack())
         ]
     ])
 
@@ -80,31 +151,26 @@ def get_main_menu_keyboard(is_admin: bool = False, is_god: bool = False):
 def get_self_role_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="👑 Лидер", callback_data="self_role_leader"),
-            InlineKeyboardButton(text="⚔️ Солдат", callback_data="self_role_soldier")
+            InlineKeyboardButton(text="👑 Лидер", callback_data=SetOwnRole("leader").pack()),
+            InlineKeyboardButton(text="⚔️ Солдат", callback_data=SetOwnRole("soldier").pack())
         ],
         [
-            InlineKeyboardButton(text="👤 Участник", callback_data="self_role_member"),
+            InlineKeyboardButton(text="👤 Участник", callback_data=SetOwnRole("member").pack()),
             InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")
         ]
     ])
 
-async def get_user_with_admin_check(tg_id: int):
-    """Получить данные пользователя с проверкой админских прав"""
-    user = await db.get_user(tg_id)
-    is_admin = await db.is_admin(tg_id)
-    return user, is_admin
-
 # Start command
 @router.message(Command("start"))
-async def cmd_start(message: Message):
-    user, is_admin = await get_user_with_admin_check(message.from_user.id)
-    
+async def cmd_start(message: Message, user: dict, is_admin: bool, is_owner: bool):
     if not user:
         # New user - show registration
+        tenant = tenants.current()
+        register = "/register" if tenant.alliance_id == tenants.DEFAULT.alliance_id else f"/register {tenant.alliance_id}"
         await message.answer(
-            "Добро пожаловать! Для доступа к функционалу бота необходимо зарегистрироваться.\n"
-            "Используйте команду /register для подачи заявки."
+            f"Добро пожаловать{', ' + tenant.name if tenant.name else ''}! "
+            "Для доступа к функционалу бота необходимо зарегистрироваться.\n"
+            f"Используйте команду {register} для подачи заявки."
         )
     else:
         if user["status"] == "approved":
@@ -114,7 +180,7 @@ async def cmd_start(message: Message):
                 f"Ваш текущий ник: {user['player_name']}\n"
                 f"Ваша роль: {user['role']}\n"
                 f"{'👑 Вы администратор' if is_admin else ''}",
-                reply_markup=get_main_menu_keyboard(is_admin,message.from_user.id == int(MY_TG_ID))
+                reply_markup=get_main_menu_keyboard(is_admin, is_owner)
             )
         else:
             # Pending user
@@ -124,9 +190,7 @@ async def cmd_start(message: Message):
 
 # Help command
 @router.message(Command("help"))
-async def cmd_help(message: Message):
-    user, is_admin = await get_user_with_admin_check(message.from_user.id)
-    
+async def cmd_help(message: Message, user: dict, is_admin: bool, is_owner: bool):
     if user and user["status"] == "approved":
         help_text = (
             "📋 Доступные команды:\n\n"
@@ -143,8 +207,8 @@ async def cmd_help(message: Message):
                 "➖ Удалить фиктивное имя - удалить фиктивное имя\n"
                 "📊 Посмотреть таблицу - получить Excel таблицу\n"
             )
-        if message.from_user.id == int(MY_TG_ID):
-                        help_text += (
+        if is_owner:
+            help_text += (
                 "📄 Задать паттерн - задает паттерн строительства таблицы\n"
                 "📑 Поменять паттерн - выбирает паттерн среди существующих\n"
                 "Также доступны команды:\n"
@@ -153,22 +217,33 @@ async def cmd_help(message: Message):
                 "/remove_chat - команда для удаления системы NICK из текущего чата\n"
                 "/grant_admin <id> - выдает права администратора бота для пользователя с заданным id\n"
             )
+        if message.from_user.id == tenants.DEFAULT.owner_id:
+            help_text += (
+                "/alliances - альянсы, которые обслуживает бот\n"
+                "/new_alliance <id владельца> <название> - создать альянс, текущий чат станет его чатом админов\n"
+            )
+        if is_admin:
+            help_text += (
+                "/import - загрузить список игроков (CSV/TSV/JSON: player_name, role)\n"
+                "/export [csv|tsv|json] - выгрузить список игроков в том же формате\n"
+                "/snapshot - сохранить снимок ростера, /snapshots - список снимков\n"
+                "/roster_diff [7d|<id>] [<id>] [image] - кто пришел, ушел или сменил ник\n"
+            )
         
-        await message.answer(help_text, reply_markup=get_main_menu_keyboard(is_admin,message.from_user.id == int(MY_TG_ID)))
+        await message.answer(help_text, reply_markup=get_main_menu_keyboard(is_admin, is_owner))
     else:
         await message.answer("Для доступа к функциям бота необходимо зарегистрироваться. Используйте /register")
 
 # Register command
 @router.message(Command("register"))
-async def cmd_register(message: Message):
+async def cmd_register(message: Message, user: dict):
     user_id = message.from_user.id
     username = message.from_user.username or "Без имени"
     tag = f"@{username}" if username else f"id{user_id}"
     
     # Check if already registered
-    existing_user = await db.get_user(user_id)
-    if existing_user:
-        if existing_user["status"] == "pending":
+    if user:
+        if user["status"] == "pending":
             await message.answer("Ваша заявка уже находится на рассмотрении.")
         else:
             await message.answer("Вы уже зарегистрированы!")
@@ -185,8 +260,8 @@ async def cmd_register(message: Message):
             f"Запрашивает разрешение на запись в таблицу Dice."
         )
         
-        await bot.send_message(
-            ADMIN_CHAT_ID,
+        await outbound.send(
+            tenants.current().admin_chat_id,
             request_text,
             reply_markup=get_registration_keyboard(user_id)
         )
@@ -196,18 +271,14 @@ async def cmd_register(message: Message):
         await message.answer("❌ Произошла ошибка при отправке заявки. Попробуйте позже.")
 
 # Registration approval callbacks
-@router.callback_query(F.data.startswith("approve_"))
-async def approve_registration(callback: CallbackQuery):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
-    user_id = int(callback.data.split("_")[1])
+@callbacks.on(ApproveRegistration)
+async def approve_registration(callback: CallbackQuery, action: ApproveRegistration):
+    user_id = action.user_id
     
     # Update user status
     if await db.update_user_status(user_id, "approved"):
         # Notify user
-        await bot.send_message(user_id, "✅ Ваша заявка одобрена! Теперь у вас есть доступ к функции бота.")
+        outbound.notify(user_id, "✅ Ваша заявка одобрена! Теперь у вас есть доступ к функции бота.")
         
         # Update admin message
         await callback.message.edit_text(
@@ -218,18 +289,14 @@ async def approve_registration(callback: CallbackQuery):
     else:
         await callback.answer("Ошибка при одобрении заявки!", show_alert=True)
 
-@router.callback_query(F.data.startswith("reject_"))
-async def reject_registration(callback: CallbackQuery):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
-    user_id = int(callback.data.split("_")[1])
+@callbacks.on(RejectRegistration)
+async def reject_registration(callback: CallbackQuery, action: RejectRegistration):
+    user_id = action.user_id
     
     # Delete user
     if await db.delete_user(user_id):
         # Notify user
-        await bot.send_message(user_id, "❌ Ваша заявка отклонена администратором.")
+        outbound.notify(user_id, "❌ Ваша заявка отклонена администратором.")
         
         # Update admin message
         await callback.message.edit_text(
@@ -241,9 +308,8 @@ async def reject_registration(callback: CallbackQuery):
         await callback.answer("Ошибка при отклонении заявки!", show_alert=True)
 
 # Change name
-@router.callback_query(F.data == "change_name")
-async def change_name_start(callback: CallbackQuery, state: FSMContext):
-    user, is_admin = await get_user_with_admin_check(callback.from_user.id)
+@callbacks.on("change_name")
+async def change_name_start(callback: CallbackQuery, state: FSMContext, user: dict):
     if not user or user["status"] != "approved":
         await callback.answer("У вас нет доступа к этой функции!", show_alert=True)
         return
@@ -264,9 +330,8 @@ async def change_name_finish(message: Message, state: FSMContext):
     await state.clear()
 
 # Request promotion
-@router.callback_query(F.data == "request_promotion")
-async def request_promotion(callback: CallbackQuery):
-    user, is_admin = await get_user_with_admin_check(callback.from_user.id)
+@callbacks.on("request_promotion")
+async def request_promotion(callback: CallbackQuery, user: dict, is_admin: bool):
     if not user or user["status"] != "approved":
         await callback.answer("У вас нет доступа к этой функции!", show_alert=True)
         return
@@ -288,8 +353,8 @@ async def request_promotion(callback: CallbackQuery):
             f"Запрашивает изменение роли."
         )
         
-        await bot.send_message(
-            ADMIN_CHAT_ID,
+        await outbound.send(
+            tenants.current().admin_chat_id,
             request_text,
             reply_markup=get_role_keyboard(user['tg_id'])
         )
@@ -298,17 +363,11 @@ async def request_promotion(callback: CallbackQuery):
     await callback.answer()
 
 # Role change callbacks
-@router.callback_query(F.data.startswith("role_"))
-async def handle_role_change(callback: CallbackQuery):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
-    data_parts = callback.data.split("_")
-    action = data_parts[1]
-    user_id = int(data_parts[2])
+@callbacks.on(SetRole)
+async def handle_role_change(callback: CallbackQuery, action: SetRole):
+    user_id = action.user_id
     
-    if action == "reject":
+    if action.role == "reject":
         await callback.message.edit_text(
             f"❌ {callback.from_user.username} отклонил запрос на изменение роли",
             reply_markup=None
@@ -322,10 +381,10 @@ async def handle_role_change(callback: CallbackQuery):
         "member": "участник"
     }
     
-    new_role = role_map.get(action)
+    new_role = role_map.get(action.role)
     if new_role and await db.update_user_role(user_id, new_role):
         # Notify user
-        await bot.send_message(user_id, f"✅ Ваша роль изменена на: {new_role}")
+        outbound.notify(user_id, f"✅ Ваша роль изменена на: {new_role}")
         
         # Update admin message
         await callback.message.edit_text(
@@ -337,19 +396,15 @@ async def handle_role_change(callback: CallbackQuery):
         await callback.answer("Ошибка при изменении роли!", show_alert=True)
 
 # Self role change for admins
-@router.callback_query(F.data.startswith("self_role_"))
-async def handle_self_role_change(callback: CallbackQuery):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
+@callbacks.on(SetOwnRole)
+async def handle_self_role_change(callback: CallbackQuery, action: SetOwnRole):
     role_map = {
-        "self_role_leader": "лидер",
-        "self_role_soldier": "солдат", 
-        "self_role_member": "участник"
+        "leader": "лидер",
+        "soldier": "солдат", 
+        "member": "участник"
     }
     
-    new_role = role_map.get(callback.data)
+    new_role = role_map.get(action.role)
     if new_role and await db.update_user_role(callback.from_user.id, new_role):
         await callback.message.answer(f"✅ Ваша роль изменена на: {new_role}")
         await callback.answer()
@@ -357,9 +412,8 @@ async def handle_self_role_change(callback: CallbackQuery):
         await callback.answer("❌ Ошибка при изменении роли!", show_alert=True)
 
 # Leave alliance
-@router.callback_query(F.data == "leave")
-async def leave_alliance(callback: CallbackQuery):
-    user, is_admin = await get_user_with_admin_check(callback.from_user.id)
+@callbacks.on("leave")
+async def leave_alliance(callback: CallbackQuery, user: dict):
     if not user or user["status"] != "approved":
         await callback.answer("У вас нет доступа к этой функции!", show_alert=True)
         return
@@ -371,26 +425,39 @@ async def leave_alliance(callback: CallbackQuery):
         await callback.answer("❌ Произошла ошибка при выходе из альянса!", show_alert=True)
 
 # Admin commands
-@router.callback_query(F.data == "change_other_name")
+@callbacks.on("change_other_name", access=ADMIN)
 async def change_other_name_start(callback: CallbackQuery, state: FSMContext):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
-    await callback.message.answer("Введите TG ID пользователя и новый ник в формате:\n`123456789 НовыйНик`")
+    me = await bot.me()
+    await callback.message.answer(
+        "Введите TG ID пользователя и новый ник в формате:\n`123456789 НовыйНик`\n"
+        f"или выберите игрока поиском: @{me.username} часть ника"
+    )
     await state.set_state(RegistrationStates.waiting_for_user_to_rename)
     await callback.answer()
 
 @router.message(RegistrationStates.waiting_for_user_to_rename)
 async def change_other_name_finish(message: Message, state: FSMContext):
     try:
-        parts = message.text.strip().split(' ', 1)
-        if len(parts) != 2:
-            await message.answer("❌ Неверный формат. Используйте: `123456789 НовыйНик`")
+        text = (message.text or "").strip()
+        picked = picked_player_id(text)
+        if picked is not None:
+            # Игрок выбран инлайн-поиском - следующим сообщением придет новый ник
+            await state.update_data(rename_target=picked)
+            await message.answer("Введите новый ник для выбранного игрока:")
             return
         
-        user_id = int(parts[0])
-        new_name = parts[1]
+        parts = text.split(' ', 1)
+        data = await state.get_data()
+        if "rename_target" in data:
+            # Цель уже выбрана: все сообщение - новый ник, даже если он из цифр
+            user_id = data["rename_target"]
+            new_name = text
+        elif len(parts) != 2:
+            await message.answer("❌ Неверный формат. Используйте: `123456789 НовыйНик`")
+            return
+        else:
+            user_id = int(parts[0])
+            new_name = parts[1]
         
         # Check if target is admin
         if await db.is_admin(user_id):
@@ -400,7 +467,7 @@ async def change_other_name_finish(message: Message, state: FSMContext):
         if await db.update_user_name(user_id, new_name):
             await message.answer(f"✅ Ник пользователя {user_id} изменен на: {new_name}")
             # Notify user
-            await bot.send_message(user_id, f"✅ Администратор изменил ваш ник на: {new_name}")
+            outbound.notify(user_id, f"✅ Администратор изменил ваш ник на: {new_name}")
         else:
             await message.answer("❌ Пользователь не найден или произошла ошибка!")
     
@@ -409,24 +476,26 @@ async def change_other_name_finish(message: Message, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data == "remove_other")
+@callbacks.on("remove_other", access=ADMIN)
 async def remove_other_start(callback: CallbackQuery, state: FSMContext):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
-    await callback.message.answer("Введите игровое имя пользователя для удаления:")
+    me = await bot.me()
+    await callback.message.answer(
+        "Введите игровое имя пользователя для удаления\n"
+        f"или выберите игрока поиском: @{me.username} часть ника"
+    )
     await state.set_state(RegistrationStates.waiting_for_user_to_remove)
     await callback.answer()
 
 @router.message(RegistrationStates.waiting_for_user_to_remove)
 async def remove_other_finish(message: Message, state: FSMContext):
     try:
-        user_player_name = message.text.strip()
-        user_id = 0
-        user = await db.get_user_by_player_name(user_player_name)
-        if user:
-            user_id = user['tg_id']
+        user_player_name = (message.text or "").strip()
+        # TG ID из инлайн-поиска или игровое имя
+        user_id = picked_player_id(user_player_name) or 0
+        if not user_id:
+            user = await db.get_user_by_player_name(user_player_name)
+            if user:
+                user_id = user['tg_id']
 
         # Check if target is admin
         if await db.is_admin(user_id):
@@ -436,7 +505,7 @@ async def remove_other_finish(message: Message, state: FSMContext):
         if await db.delete_user(user_id):
             await message.answer(f"✅ Пользователь {user_id} удален из альянса.")
             # Notify user
-            await bot.send_message(user_id, "🚪 Администратор удалил вас из альянса.")
+            outbound.notify(user_id, "🚪 Администратор удалил вас из альянса.")
         else:
             await message.answer("❌ Пользователь не найден или произошла ошибка!")
     
@@ -446,12 +515,8 @@ async def remove_other_finish(message: Message, state: FSMContext):
     await state.clear()
 
 # В обработчике добавления фиктивного имени
-@router.callback_query(F.data == "add_fake_name")
+@callbacks.on("add_fake_name", access=ADMIN)
 async def add_fake_name_start(callback: CallbackQuery, state: FSMContext):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
     await callback.message.answer(
         "Введите фиктивное имя для добавления и роль через пробел:\n"
         "Например: `Игрок123 участник`\n"
@@ -488,43 +553,59 @@ async def add_fake_name_finish(message: Message, state: FSMContext):
     
     await state.clear()
 
-# В обработчике удаления фиктивного имени
-@router.callback_query(F.data == "delete_fake_name")
-async def delete_fake_name_start(callback: CallbackQuery, state: FSMContext):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
+# Списки выбора листаются постранично; кнопки кэшируются до изменения игроков или паттернов
+CANCEL_ROW = [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+
+async def load_fake_name_buttons():
+    fake_names = await db.get_all_fake_names()
+    return [
+        (f"🗑️ {fake['player_name']} ({fake['role']})", DeleteFakeName(fake['id']).pack())
+        for fake in sorted(fake_names, key=lambda fake: (fake['player_name'] or "").casefold())
+    ]
+
+async def load_pattern_buttons():
+    patterns = await PatternManager(db).get_all_patterns()
+    return [
+        (f"{'✅' if pattern.status == 'Active' else '❌'} {pattern.pattern_name} (ID: {pattern.id})", SelectPattern(pattern.id).pack())
+        for pattern in patterns
+    ]
+
+fake_names_keyboard = PagedKeyboard("fakes", load_fake_name_buttons, lambda: db.roster_version, footer=CANCEL_ROW,
+                                    access=ADMIN)
+patterns_keyboard = PagedKeyboard("patterns", load_pattern_buttons, lambda: db.roster_version, access=OWNER)
+
+@callbacks.on(ListPage)
+async def handle_list_page(callback: CallbackQuery, action: ListPage):
+    keyboard = PAGED_KEYBOARDS.get(action.name)
+    if keyboard is None:
+        await callback.answer()
         return
     
+    markup = await keyboard.markup(action.page)
+    current = callback.message.reply_markup
+    if markup is None:
+        await callback.message.edit_text("❌ Список пуст.")
+    # Повторное нажатие на текущую страницу не меняет сообщение
+    # (сравниваются данные: у полученной клавиатуры есть ссылка на бота)
+    elif current is None or markup.model_dump() != current.model_dump():
+        await callback.message.edit_reply_markup(reply_markup=markup)
+    await callback.answer()
+
+# В обработчике удаления фиктивного имени
+@callbacks.on("delete_fake_name", access=ADMIN)
+async def delete_fake_name_start(callback: CallbackQuery, state: FSMContext):
     # Показываем список фиктивных игроков для удаления
-    fake_names = await db.get_all_fake_names()
-    if not fake_names:
+    markup = await fake_names_keyboard.markup()
+    if markup is None:
         await callback.message.answer("❌ Нет фиктивных игроков для удаления!")
         return
     
-    keyboard = []
-    for fake in fake_names:
-        keyboard.append([
-            InlineKeyboardButton(
-                text=f"🗑️ {fake['player_name']} ({fake['role']})",
-                callback_data=f"delete_fake_{fake['id']}"
-            )
-        ])
-    
-    keyboard.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")])
-    
-    await callback.message.answer(
-        "Выберите фиктивного игрока для удаления:",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-    )
+    await callback.message.answer("Выберите фиктивного игрока для удаления:", reply_markup=markup)
     await callback.answer()
 
-@router.callback_query(F.data.startswith("delete_fake_"))
-async def delete_fake_name_handler(callback: CallbackQuery):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
-    
-    fake_id = int(callback.data.split("_")[2])
+@callbacks.on(DeleteFakeName)
+async def delete_fake_name_handler(callback: CallbackQuery, action: DeleteFakeName):
+    fake_id = action.fake_id
     
     if await db.delete_fake_name(fake_id):
         await callback.message.edit_text("✅ Фиктивный игрок удален!")
@@ -533,18 +614,37 @@ async def delete_fake_name_handler(callback: CallbackQuery):
         await callback.answer("❌ Ошибка при удалении игрока!", show_alert=True)
 
 # Обновляем обработчик просмотра таблицы
-@router.callback_query(F.data == "view_table")
-async def view_table(callback: CallbackQuery):
-    if not await db.is_admin(callback.from_user.id):
-        await callback.answer("У вас нет прав для этого действия!", show_alert=True)
-        return
+def updated_since(player: dict, since: datetime) -> bool:
+    """Менялся ли игрок после `since` (UTC) по полю updated_at"""
+    try:
+        updated_at = datetime.fromisoformat(player.get("updated_at") or "")
+    except ValueError:
+        return False
+    if updated_at.tzinfo is not None:
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return updated_at >= since
+
+def render_table(pattern, players, leaders, soldiers, updated_players) -> Union[bytes, str]:
+    """PNG таблицы игроков или, если рендер недоступен, таблица текстом"""
+    renderer = TableRenderer()
+    grouped_players = renderer.group_players_by_pattern(players, pattern)
+    image_buf = renderer.create_table_image(pattern, grouped_players, leaders, soldiers, updated_players)
+    if image_buf is None:
+        return renderer.create_text_table(renderer.table_columns(pattern, grouped_players), grouped_players)
+    return image_buf.getvalue()
+
+async def build_table_report():
+    """Сводка и картинка таблицы игроков; None, если нет активного паттерна"""
+    # Все списки выводятся из одной выборки игроков вместо отдельных запросов по ролям
+    all_players, pattern = await asyncio.gather(db.get_all_players(), PatternManager(db).get_active_pattern())
+    if not pattern:
+        return None
     
-    # Получаем все массивы игроков
-    all_players = await db.get_all_players()
-    recent_players = await db.get_recent_players()
-    leaders = await db.get_leaders()
-    soldiers = await db.get_soldiers()
-    regular_members = await db.get_regular_members()
+    leaders = [p for p in all_players if p['role'] == 'лидер']
+    soldiers = [p for p in all_players if p['role'] == 'солдат']
+    regular_members = [p for p in all_players if p['role'] == 'участник']
+    recent_since = datetime.utcnow() - timedelta(hours=24)
+    recent_players = [p for p in all_players if updated_since(p, recent_since)]
     
     # Формируем статистику
     summary = (
@@ -582,35 +682,79 @@ async def view_table(callback: CallbackQuery):
             role_emoji = "👑" if player['role'] == 'лидер' else "⚔️" if player['role'] == 'солдат' else "👤"
             summary += f"{emoji} {role_emoji} {player['player_name']}\n"
     
+    # Рендер занимает сотни миллисекунд - выполняем его вне event loop.
+    # Раскраска ячеек идет по именам игроков
+    table = await asyncio.to_thread(
+        render_table, pattern, all_players,
+        {p['player_name'] for p in leaders},
+        {p['player_name'] for p in soldiers},
+        {p['player_name'] for p in recent_players}
+    )
+    return summary, table
+
+# Одновременные запросы таблицы при неизменных данных ждут одну сборку
+table_builds = SingleFlight()
+
+@callbacks.on("view_table", access=ADMIN)
+async def view_table(callback: CallbackQuery):
+    report = await table_builds.do((tenants.current_id(), db.roster_version), build_table_report)
     
-    
-    pattern_manager = PatternManager(db)
-    pattern = await pattern_manager.get_active_pattern()
-    
-    if not pattern:
+    if not report:
         await callback.message.answer("Нет активного паттерна. Сначала создайте паттерн.")
         return
     
-    # Получаем данные игроков     
-    users_response = await db.get_all_players()
-    # Здесь нужно получить списки лидеров, солдат и обновивших
-    # (замените на вашу логику получения этих списков)
-    leaders = await db.get_leaders()  # Ваша логика для лидеров
-    soldiers = await db.get_soldiers()  # Ваша логика для солдат
-    updated_players = await db.get_recent_players()  # Игроки, обновившие имя за последние N дней
-    
-    renderer = TableRenderer()
-    grouped_players = renderer.group_players_by_pattern(users_response, pattern)
-    
-    # Создаем изображение
-    image_buf = renderer.create_table_image(pattern, grouped_players, leaders, soldiers, updated_players)
-    image_buf.seek(0)
-    photo_bytes = image_buf.getvalue()
-    
-    await callback.message.answer_photo(photo=BufferedInputFile(photo_bytes, filename='player_table.png'),caption=summary)
+    summary, table = report
+    if isinstance(table, str):
+        # Картинку построить нечем - таблица уходит текстом
+        await callback.message.answer(summary[:4096])
+        await callback.message.answer(table[:4096])
+    else:
+        await callback.message.answer_photo(photo=BufferedInputFile(table, filename='player_table.png'),caption=summary)
     await callback.answer("Статистика сформирована!")
+# Инлайн-поиск игроков: @бот <часть ника>
+INLINE_RESULTS_LIMIT = 20
+PICKER_STATES = {
+    RegistrationStates.waiting_for_user_to_rename.state,
+    RegistrationStates.waiting_for_user_to_remove.state
+}
+# Метка выбора игрока инлайн-поиском: без нее числовой ник не отличить от TG ID
+PICKED_PLAYER_MARK = "🎯"
+
+def picked_player_id(text: str) -> Optional[int]:
+    """TG ID игрока из сообщения, отправленного выбором в инлайн-поиске, иначе None"""
+    mark, _, player_id = text.partition(" ")
+    if mark == PICKED_PLAYER_MARK and player_id.isdigit():
+        return int(player_id)
+    return None
+
+@router.inline_query()
+async def inline_player_search(inline_query: InlineQuery, state: FSMContext):
+    index = await db.player_index()
+    # Искать могут только игроки альянса
+    if ("telegram", inline_query.from_user.id) not in index:
+        await inline_query.answer([], cache_time=60, is_personal=True)
+        return
+    
+    # В админских сценариях переименования и удаления поиск работает как выбор
+    # игрока: выбранный результат отправляет его TG ID с меткой PICKED_PLAYER_MARK
+    picking = await state.get_state() in PICKER_STATES
+    results = []
+    for kind, player_id in index.search(inline_query.query, INLINE_RESULTS_LIMIT, kind="telegram" if picking else None):
+        player_name = index.names[(kind, player_id)]
+        if picking:
+            text, description = f"{PICKED_PLAYER_MARK} {player_id}", f"TG ID {player_id}"
+        else:
+            text, description = player_name, "👤 Telegram" if kind == "telegram" else "🤖 Фиктивный игрок"
+        results.append(InlineQueryResultArticle(
+            id=f"{kind}:{player_id}",
+            title=player_name,
+            description=description,
+            input_message_content=InputTextMessageContent(message_text=text)
+        ))
+    await inline_query.answer(results, cache_time=0 if picking else 5, is_personal=True)
+
 # Cancel handler
-@router.callback_query(F.data == "cancel")
+@callbacks.on("cancel")
 async def cancel_handler(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.answer("Действие отменено.")
@@ -618,8 +762,8 @@ async def cancel_handler(callback: CallbackQuery, state: FSMContext):
 
 # Grant admin command (only for you)
 @router.message(Command("grant_admin"))
-async def cmd_grant_admin(message: Message):
-    if message.from_user.id != int(MY_TG_ID):
+async def cmd_grant_admin(message: Message, is_owner: bool):
+    if not is_owner:
         await message.answer("❌ У вас нет прав для этой команды!")
         return
     
@@ -630,7 +774,7 @@ async def cmd_grant_admin(message: Message):
         
         if await db.add_admin(target_id, target_user.username or "Без имени"):
             await message.answer(f"✅ Пользователь {target_user.username} назначен администратором!")
-            await bot.send_message(target_id, "🎉 Вы были назначены администратором бота! Теперь вы можете управлять своими данными напрямую.")
+            outbound.notify(target_id, "🎉 Вы были назначены администратором бота! Теперь вы можете управлять своими данными напрямую.")
         else:
             await message.answer("❌ Ошибка при назначении администратора!")
     
@@ -642,9 +786,9 @@ async def cmd_grant_admin(message: Message):
 
 # Команды управления разрешенными чатами (только для владельца)
 @router.message(Command("add_chat"))
-async def cmd_add_chat(message: Message):
+async def cmd_add_chat(message: Message, is_owner: bool):
     """Добавить текущий чат в разрешенные"""
-    if message.from_user.id != int(MY_TG_ID):
+    if not is_owner:
         await message.answer("❌ У вас нет прав для этой команды!")
         return
     
@@ -661,9 +805,9 @@ async def cmd_add_chat(message: Message):
         await message.answer("❌ Ошибка при добавлении чата!")
 
 @router.message(Command("remove_chat"))
-async def cmd_remove_chat(message: Message):
+async def cmd_remove_chat(message: Message, is_owner: bool):
     """Удалить текущий чат из разрешенных"""
-    if message.from_user.id != int(MY_TG_ID):
+    if not is_owner:
         await message.answer("❌ У вас нет прав для этой команды!")
         return
     
@@ -680,9 +824,9 @@ async def cmd_remove_chat(message: Message):
         await message.answer("❌ Ошибка при удалении чата!")
 
 @router.message(Command("list_chats"))
-async def cmd_list_chats(message: Message):
+async def cmd_list_chats(message: Message, is_owner: bool):
     """Показать список разрешенных чатов"""
-    if message.from_user.id != int(MY_TG_ID):
+    if not is_owner:
         await message.answer("❌ У вас нет прав для этой команды!")
         return
     
@@ -700,9 +844,251 @@ async def cmd_list_chats(message: Message):
     await message.answer(chat_list)
     
 
+# Альянсы (только для владельца альянса по умолчанию, т.е. всего бота)
+@router.message(Command("alliances"))
+async def cmd_list_alliances(message: Message):
+    if message.from_user.id != tenants.DEFAULT.owner_id:
+        await message.answer("❌ У вас нет прав для этой команды!")
+        return
+    
+    registry = await db.tenant_registry()
+    lines = [
+        f"• {tenant.alliance_id}: {tenant.name or 'по умолчанию'}\n"
+        f"  Чат админов: {tenant.admin_chat_id}, владелец: {tenant.owner_id}"
+        for tenant in sorted(registry.all(), key=lambda tenant: tenant.alliance_id)
+    ]
+    await message.answer("🏰 Альянсы:\n\n" + "\n".join(lines))
+
+@router.message(Command("new_alliance"))
+async def cmd_new_alliance(message: Message, command: CommandObject):
+    if message.from_user.id != tenants.DEFAULT.owner_id:
+        await message.answer("❌ У вас нет прав для этой команды!")
+        return
+    if message.chat.type == "private":
+        await message.answer("❌ Выполните команду в группе, которая станет чатом админов альянса.")
+        return
+    
+    try:
+        owner_text, name = (command.args or "").split(maxsplit=1)
+        owner_id = int(owner_text)
+    except ValueError:
+        await message.answer("❌ Используйте: /new_alliance <id владельца> <название>")
+        return
+    
+    registry = await db.tenant_registry()
+    if registry.for_chat(message.chat.id) is not None:
+        await message.answer("❌ Этот чат уже принадлежит альянсу!")
+        return
+    if registry.for_member(owner_id) is not None:
+        await message.answer("❌ Этот пользователь уже состоит в альянсе!")
+        return
+    
+    alliance_id = max(tenant.alliance_id for tenant in registry.all()) + 1
+    if not await db.add_alliance(alliance_id, name.strip(), message.chat.id, owner_id):
+        await message.answer("❌ Ошибка при создании альянса!")
+        return
+    
+    # Владелец нового альянса становится его админом
+    with tenants.scope(registry.get(alliance_id)):
+        owner_chat = await bot.get_chat(owner_id)
+        await db.add_admin(owner_id, owner_chat.username or "Владелец")
+    me = await bot.me()
+    await message.answer(
+        f"✅ Альянс '{name.strip()}' (ID: {alliance_id}) создан, этот чат - его чат админов.\n"
+        f"Ссылка для регистрации игроков: https://t.me/{me.username}?start={alliance_id}"
+    )
+
+# Массовая загрузка и выгрузка ростера: /import, /export
+MAX_IMPORT_FILE_SIZE = 1024 * 1024
+
+async def read_roster_document(message: Message, text: str):
+    """Текст документа и имя файла из вложения или из текста сообщения"""
+    if message.document is None:
+        return text, None
+    if (message.document.file_size or 0) > MAX_IMPORT_FILE_SIZE:
+        raise roster_io.RosterFormatError([f"файл больше {MAX_IMPORT_FILE_SIZE // 1024} КБ"])
+    content = await bot.download(message.document)
+    try:
+        return content.read().decode("utf-8-sig"), message.document.file_name
+    except UnicodeDecodeError:
+        raise roster_io.RosterFormatError(["файл должен быть в кодировке UTF-8"])
+
+async def load_roster_diff(rows):
+    users, fake_names = await asyncio.gather(db.get_all_users(), db.get_all_fake_names())
+    return roster_io.diff(rows, users, fake_names)
+
+async def preview_roster_import(message: Message, state: FSMContext, text: str):
+    try:
+        text, filename = await read_roster_document(message, text)
+        rows = roster_io.parse(text, filename=filename)
+    except roster_io.RosterFormatError as e:
+        errors = e.errors[:roster_io.MAX_LISTED]
+        more = f"\n... и еще {len(e.errors) - len(errors)}" if len(e.errors) > len(errors) else ""
+        await message.answer("❌ Документ не загружен:\n" + "\n".join(errors) + more)
+        await state.clear()
+        return
+    
+    roster_diff = await load_roster_diff(rows)
+    if not roster_diff.has_changes:
+        await message.answer("✅ Список совпадает с текущим, изменений нет.")
+        await state.clear()
+        return
+    
+    await state.update_data(roster_import=[list(row) for row in rows])
+    await state.set_state(RegistrationStates.waiting_roster_import_confirm)
+    await message.answer(
+        roster_io.format_diff(roster_diff, applied=False),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="✅ Применить", callback_data="roster_import_apply"),
+            InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")
+        ]])
+    )
+
+@router.message(Command("import"))
+async def cmd_import_roster(message: Message, command: CommandObject, state: FSMContext, is_admin: bool):
+    if not is_admin:
+        await message.answer("❌ У вас нет прав для этой команды!")
+        return
+    
+    if message.document is None and not command.args:
+        await message.answer(
+            "Отправьте файл CSV, TSV или JSON со столбцами player_name и role "
+            "(роль: лидер, солдат или участник) или вставьте список текстом."
+        )
+        await state.set_state(RegistrationStates.waiting_roster_import)
+        return
+    
+    await preview_roster_import(message, state, command.args or "")
+
+@router.message(RegistrationStates.waiting_roster_import)
+async def import_roster_document(message: Message, state: FSMContext):
+    await preview_roster_import(message, state, message.text or "")
+
+@callbacks.on("roster_import_apply", access=ADMIN, state=RegistrationStates.waiting_roster_import_confirm)
+async def apply_roster_import(callback: CallbackQuery, state: FSMContext):
+    rows = [roster_io.RosterRow(*row) for row in (await state.get_data()).get("roster_import", [])]
+    await state.clear()
+    
+    # Ростер мог измениться после предпросмотра - сравниваем заново
+    roster_diff = await load_roster_diff(rows)
+    changed_users, changed_fakes = [], []
+    for player, row in roster_diff.renamed + roster_diff.role_changed:
+        changed = {**player, "player_name": row.player_name, "role": row.role}
+        (changed_fakes if "tg_id" not in player else changed_users).append(changed)
+    
+    ok = await db.import_roster(
+        [row._asdict() for row in roster_diff.added],
+        changed_users,
+        changed_fakes,
+        [fake["id"] for fake in roster_diff.removed]
+    )
+    report = roster_io.format_diff(roster_diff, applied=True)
+    if not ok:
+        report = "⚠️ Часть изменений не записана, повторите /import.\n\n" + report
+    await callback.message.edit_text(report, reply_markup=None)
+    await callback.answer()
+
+@router.message(Command("export"))
+async def cmd_export_roster(message: Message, command: CommandObject, is_admin: bool):
+    if not is_admin:
+        await message.answer("❌ У вас нет прав для этой команды!")
+        return
+    
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in roster_io.FORMATS:
+        await message.answer("❌ Используйте: /export csv, /export tsv или /export json")
+        return
+    
+    # Повторы имен /import не примет - в выгрузку попадает первый игрок с таким именем
+    rows, seen = [], set()
+    for player in await db.get_all_players():
+        name = player["player_name"]
+        if player["status"] == "approved" and name and fold(name) not in seen:
+            seen.add(fold(name))
+            rows.append(roster_io.RosterRow(name, player["role"] or roster_io.DEFAULT_ROLE))
+    document = roster_io.dump(rows, fmt)
+    # BOM нужен Excel, чтобы открыть CSV в UTF-8; parse его пропускает
+    encoding = "utf-8" if fmt == "json" else "utf-8-sig"
+    await message.answer_document(
+        BufferedInputFile(document.encode(encoding), filename=f"roster.{fmt}"),
+        caption=f"📋 Игроков: {len(rows)}"
+    )
+
+# Снимки ростера и отчеты об изменениях
+@router.message(Command("snapshot"))
+async def cmd_take_snapshot(message: Message, is_admin: bool):
+    if not is_admin:
+        await message.answer("❌ У вас нет прав для этой команды!")
+        return
+    
+    snapshot = await SnapshotManager(db).take_snapshot()
+    if snapshot:
+        # Если ростер не менялся, новый снимок не сохраняется - возвращается последний
+        taken_at = snapshot['taken_at'][:16].replace('T', ' ')
+        await message.answer(f"✅ Снимок #{snapshot['id']} от {taken_at} UTC, игроков: {snapshot['players']}")
+    else:
+        await message.answer("❌ Ошибка при сохранении снимка!")
+
+@router.message(Command("snapshots"))
+async def cmd_list_snapshots(message: Message, is_admin: bool):
+    if not is_admin:
+        await message.answer("❌ У вас нет прав для этой команды!")
+        return
+    
+    rows = await SnapshotManager(db).get_snapshots()
+    if not rows:
+        await message.answer("📝 Снимков пока нет. Сохраните первый командой /snapshot")
+        return
+    
+    lines = [f"#{row['id']} - {row['taken_at'][:16].replace('T', ' ')} UTC, игроков: {row['players']}" for row in rows]
+    await message.answer("📝 Снимки ростера:\n\n" + "\n".join(lines))
+
+async def find_snapshot(manager: SnapshotManager, reference: str):
+    """Снимок по номеру ("12") или по давности ("7d" - последний снимок не позже 7 дней назад)"""
+    if reference.lower().endswith("d") and reference[:-1].isdigit():
+        return await manager.get_snapshot_before(datetime.now(timezone.utc) - timedelta(days=int(reference[:-1])))
+    if reference.isdigit():
+        return await manager.get_snapshot(int(reference))
+    raise ValueError(reference)
+
+@router.message(Command("roster_diff"))
+async def cmd_roster_diff(message: Message, command: CommandObject, is_admin: bool):
+    if not is_admin:
+        await message.answer("❌ У вас нет прав для этой команды!")
+        return
+    
+    args = (command.args or "").split()
+    as_image = any(arg.lower() in ("image", "картинка") for arg in args)
+    references = [arg for arg in args if arg.lower() not in ("image", "картинка")]
+    manager = SnapshotManager(db)
+    try:
+        if len(references) > 2:
+            raise ValueError(references)
+        if not references:
+            latest = await manager.get_snapshots(limit=1)
+            references = [str(latest[0]["id"])] if latest else []
+        found = [await find_snapshot(manager, reference) for reference in references]
+    except ValueError:
+        await message.answer("❌ Используйте: /roster_diff [7d|<id снимка>] [<id снимка>] [image]")
+        return
+    if not found or None in found:
+        await message.answer("❌ Снимок не найден. Список снимков: /snapshots")
+        return
+    
+    old = found[0]
+    new = found[1] if len(found) > 1 else await manager.current_snapshot()
+    roster_diff = snapshots.diff(old, new)
+    text = snapshots.format_diff(roster_diff, old, new)
+    # Без рендера (нет WeasyPrint и Pillow) отчет уходит текстом
+    photo = await asyncio.to_thread(snapshots.render_diff, roster_diff) if as_image and roster_diff.changes else None
+    if photo is not None:
+        await message.answer_photo(BufferedInputFile(photo, filename="roster_diff.png"), caption=text[:1024])
+    else:
+        await message.answer(text[:4096])
+
 # Хендлер для +NICK <Свое имя>
 @router.message(F.text.startswith("+NICK "))
-async def handle_plus_nick(message: Message):
+async def handle_plus_nick(message: Message, user: dict):
     # Проверяем, что это разрешенный чат
     if not await db.is_chat_allowed(message.chat.id):
         return
@@ -721,21 +1107,15 @@ async def handle_plus_nick(message: Message):
         await message.reply("❌ Неверный формат. Используйте: +NICK ВашеИмя")
         return
     
-    # Проверяем существующего пользователя
-    existing_user = await db.get_user(user_id)
-    
-    if existing_user:
+    if user:
         # Пользователь существует - обновляем имя
         if await db.update_user_name(user_id, player_name):
             await message.reply(f"✅ Ваш ник обновлен на: {player_name}")
             # Отправляем уведомление в личные сообщения
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"✅ Ваш ник успешно обновлен на: {player_name}\n"
-                )
-            except:
-                pass  # Если бот не может написать в ЛС
+            outbound.notify(
+                user_id,
+                f"✅ Ваш ник успешно обновлен на: {player_name}\n"
+            )
         else:
             await message.reply("❌ Ошибка при обновлении ника")
     else:
@@ -746,28 +1126,25 @@ async def handle_plus_nick(message: Message):
             
             await message.reply(f"✅ Вы зарегистрированы с ником: {player_name}")
             # Отправляем уведомление в личные сообщения
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"🎉 Добро пожаловать в альянс Dice!\n"
-                    f"✅ Вы успешно зарегистрированы с ником: {player_name}\n\n"
-                    f"Теперь вам доступен полный функционал бота!\n"
-                    f"Используйте команду /start для просмотра доступных функций."
-                )
-            except:
-                pass  # Если бот не может написать в ЛС
+            outbound.notify(
+                user_id,
+                f"🎉 Добро пожаловать в альянс Dice!\n"
+                f"✅ Вы успешно зарегистрированы с ником: {player_name}\n\n"
+                f"Теперь вам доступен полный функционал бота!\n"
+                f"Используйте команду /start для просмотра доступных функций."
+            )
         else:
             await message.reply("❌ Ошибка при регистрации")
 
 # Хендлер для !NICK <Его имя> (ответ на сообщение)
 @router.message(F.text.startswith("!NICK "))
-async def handle_exclamation_nick(message: Message):
+async def handle_exclamation_nick(message: Message, is_admin: bool):
     # Проверяем, что это разрешенный чат
     if not await db.is_chat_allowed(message.chat.id):
         return
     
     # Проверяем, что отправитель - админ
-    if not await db.is_admin(message.from_user.id):
+    if not is_admin:
         return
     
     # Проверяем, что это ответ на сообщение
@@ -798,13 +1175,10 @@ async def handle_exclamation_nick(message: Message):
         if await db.update_user_name(target_id, player_name):
             await message.reply(f"✅ Ник пользователя обновлен на: {player_name}")
             # Уведомляем пользователя
-            try:
-                await bot.send_message(
-                    target_id,
-                    f"✅ Администратор изменил ваш ник на: {player_name}"
-                )
-            except:
-                pass
+            outbound.notify(
+                target_id,
+                f"✅ Администратор изменил ваш ник на: {player_name}"
+            )
         else:
             await message.reply("❌ Ошибка при обновлении ника")
     else:
@@ -815,63 +1189,67 @@ async def handle_exclamation_nick(message: Message):
             
             await message.reply(f"✅ Пользователь зарегистрирован с ником: {player_name}")
             # Уведомляем пользователя
-            try:
-                await bot.send_message(
-                    target_id,
-                    f"🎉 Добро пожаловать в альянс Dice!\n"
-                    f"✅ Администратор зарегистрировал вас с ником: {player_name}\n\n"
-                    f"Теперь вам доступен полный функционал бота!\n"
-                    f"Используйте команду /start для просмотра доступных функций."
-                )
-            except:
-                pass
+            outbound.notify(
+                target_id,
+                f"🎉 Добро пожаловать в альянс Dice!\n"
+                f"✅ Администратор зарегистрировал вас с ником: {player_name}\n\n"
+                f"Теперь вам доступен полный функционал бота!\n"
+                f"Используйте команду /start для просмотра доступных функций."
+            )
         else:
             await message.reply("❌ Ошибка при регистрации пользователя")
             
+# Список игроков NICKS выводится постранично
+NICKS_PAGE_SIZE = 30
+
+def get_nicks_keyboard(page: int, pages: int):
+    if pages <= 1:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[nav_row(lambda number: NicksPage(number).pack(), page, pages)])
+
+def format_nicks_page(roster: list, page: int):
+    """Текст страницы списка игроков и общее число страниц"""
+    pages = max(1, -(-len(roster) // NICKS_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * NICKS_PAGE_SIZE
+    
+    users_list = []
+    for index, user in enumerate(roster[start:start + NICKS_PAGE_SIZE], start + 1):
+        tag = user.get('tag', 'N/A')
+        player_name = user.get('player_name', 'Без имени')
+        users_list.append(f"{index}. {tag} - {player_name}")
+    
+    return "📋 Список игроков:\n\n" + "\n".join(users_list), page, pages
+
 @router.message(F.text.startswith("NICKS"))
 async def handle_get_all_nick(message: types.Message, state: FSMContext):
 
     # Проверяем наличие чата в allowed_chats
-    if not db.is_chat_allowed(message.chat.id):
+    if not await db.is_chat_allowed(message.chat.id):
         await message.answer("Этот чат не авторизован для использования данной команды.")
         return
     
-    # Получаем всех пользователей, сортируем по player_name
-    users_response = db.client.table('users')\
-        .select('tag, player_name')\
-        .order('player_name')\
-        .execute()
-    
-    if not users_response.data:
+    roster = await db.get_roster()
+    if not roster:
         await message.answer("Список игроков пуст.")
         return
     
-    # Формируем красивый список
-    users_list = []
-    for index, user in enumerate(users_response.data, 1):
-        tag = user.get('tag', 'N/A')
-        player_name = user.get('player_name', 'Без имени')
-        users_list.append(f"{index}. {tag} - {player_name}")
+    text, page, pages = format_nicks_page(roster, 0)
+    await message.answer(text, reply_markup=get_nicks_keyboard(page, pages))
+
+@callbacks.on(NicksPage)
+async def handle_nicks_page(callback: CallbackQuery, action: NicksPage):
+    if not await db.is_chat_allowed(callback.message.chat.id):
+        await callback.answer("Этот чат не авторизован для использования данной команды.", show_alert=True)
+        return
     
-    response_text = "📋 Список игроков:\n\n" + "\n".join(users_list)
+    roster = await db.get_roster()
+    text, page, pages = format_nicks_page(roster, action.page)
     
-    await message.answer(response_text)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    # Повторное нажатие на текущую страницу не меняет сообщение
+    if text != callback.message.text:
+        await callback.message.edit_text(text, reply_markup=get_nicks_keyboard(page, pages))
+    await callback.answer()
 
 
 
@@ -879,7 +1257,7 @@ async def handle_get_all_nick(message: types.Message, state: FSMContext):
 from aiogram.types import  ReplyKeyboardMarkup, KeyboardButton
 
 # Хендлер для добавления паттерна через JSON
-@router.callback_query(F.data == "add_pattern")
+@callbacks.on("add_pattern", access=OWNER)
 async def cmd_add_pattern(callback: CallbackQuery, state: FSMContext):
     """Добавление нового паттерна"""
     await callback.message.answer('Введите новый паттерн в формате\n{"name": "DiceTeam", "elements": ["🎲","⚡","🎯"], "mas_elements": [["🎲"],["⚡"],["🎯"]]}')
@@ -911,42 +1289,24 @@ async def process_pattern_selection(message: types.Message, state: FSMContext):
     
 
 # Хендлер для выбора активного паттерна
-@router.callback_query(F.data == "set_pattern")
+@callbacks.on("set_pattern", access=OWNER)
 async def cmd_set_pattern(callback: CallbackQuery, state: FSMContext):
     """Установка активного паттерна"""
-    pattern_manager = PatternManager(db)
-    patterns = await pattern_manager.get_all_patterns()
-    
-    if not patterns:
+    markup = await patterns_keyboard.markup()
+    if markup is None:
         await callback.message.answer("❌Нет доступных паттернов.")
         return
     
-    # Создаем клавиатуру для выбора
-    inline_buttons = []
-
-    for pattern in patterns:
-        status = "✅" if pattern.status == "Active" else "❌"
-        inline_buttons.append([InlineKeyboardButton(text = f"{status} {pattern.pattern_name} (ID: {pattern.id})", callback_data=f"PATTERN {pattern.id}")])
-    keyboard = InlineKeyboardMarkup(inline_keyboard=inline_buttons)
-    
-    await callback.message.answer("Выберите паттерн для активации:", reply_markup=keyboard)
+    await callback.message.answer("Выберите паттерн для активации:", reply_markup=markup)
     await state.set_state(RegistrationStates.waiting_pattern_selection)
     await callback.answer()
 
 
-@router.callback_query(RegistrationStates.waiting_pattern_selection)
-async def process_pattern_selection(callback: CallbackQuery, state: FSMContext):
+@callbacks.on(SelectPattern, state=RegistrationStates.waiting_pattern_selection)
+async def process_pattern_selection(callback: CallbackQuery, state: FSMContext, action: SelectPattern):
     """Обработка выбора паттерна"""
-    try:
-        # Извлекаем ID из текста кнопки
-        pattern_id = int(callback.data.split(" ")[-1])
-        
-        pattern_manager = PatternManager(db)
-        await pattern_manager.set_active_pattern(pattern_id)
-        
-        await callback.message.answer("✅Паттерн успешно активирован!", reply_markup=types.ReplyKeyboardRemove())
-        
-        
-    except (IndexError, ValueError):
-        await callback.message.answer("❌Ошибка выбора паттерна. Попробуйте еще раз.", reply_markup=types.ReplyKeyboardRemove())
+    pattern_manager = PatternManager(db)
+    await pattern_manager.set_active_pattern(action.pattern_id)
+    
+    await callback.message.answer("✅Паттерн успешно активирован!", reply_markup=types.ReplyKeyboardRemove())
     await state.clear()
@@ -0,0 +1,198 @@
+import dataclasses
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Tuple, Type, Union
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.fsm.state import State
+
+# Формат данных коллбэка: "<префикс>:<версия>:<поле>:<поле>..."
+SEP = ":"
+
+# Кому доступен коллбэк
+ANYONE = "anyone"
+ADMIN = "admin"
+OWNER = "owner"
+
+# Все типы действий по префиксу - префиксы не должны повторяться
+ACTIONS: Dict[str, Type["Action"]] = {}
+
+
+class OutdatedCallback(ValueError):
+    """Кнопка создана другой версией действия"""
+
+
+@dataclasses.dataclass(frozen=True)
+class Action:
+    """Типизированные данные кнопки.
+
+    Наследники - dataclass с полями int/str; `prefix` задается в объявлении
+    класса, `version` увеличивается при изменении полей, чтобы старые кнопки
+    не разбирались по новой схеме.
+    """
+
+    prefix: ClassVar[str]
+    version: ClassVar[int] = 1
+    access: ClassVar[str] = ANYONE
+
+    def __init_subclass__(cls, prefix: str, version: int = 1, access: str = ANYONE, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if SEP in prefix or prefix in ACTIONS:
+            raise ValueError(f"Bad or duplicate callback prefix: {prefix!r}")
+        cls.prefix = prefix
+        cls.version = version
+        cls.access = access
+        ACTIONS[prefix] = cls
+
+    def pack(self) -> str:
+        values = [str(getattr(self, field.name)) for field in dataclasses.fields(self)]
+        data = SEP.join([self.prefix, str(self.version), *values])
+        if len(data.encode()) > 64:
+            raise ValueError(f"Callback data is longer than 64 bytes: {data!r}")
+        return data
+
+    @classmethod
+    def unpack(cls, parts: List[str]) -> "Action":
+        """Действие из частей коллбэка после префикса: [версия, поля...]"""
+        fields = dataclasses.fields(cls)
+        if not parts or parts[0] != str(cls.version):
+            raise OutdatedCallback(cls.prefix)
+        if len(parts) - 1 != len(fields):
+            raise ValueError(f"Wrong number of fields for {cls.prefix!r}")
+        return cls(**{field.name: field.type(value) for field, value in zip(fields, parts[1:])})
+
+    def access_level(self) -> str:
+        return self.access
+
+
+@dataclasses.dataclass
+class Entry:
+    handler: CallableObject
+    access: str
+    state: Optional[State]
+
+
+@dataclasses.dataclass
+class Route:
+    """Разобранный коллбэк: куда его передать и с какими данными"""
+    entry: Entry
+    action: Optional[Action]
+
+    @property
+    def name(self) -> str:
+        return self.entry.handler.callback.__name__
+
+    @property
+    def access(self) -> str:
+        return self.action.access_level() if self.action is not None else self.entry.access
+
+    async def call(self, callback, data: Dict[str, Any]) -> Any:
+        if self.entry.state is not None:
+            state = data.get("state")
+            if state is None or await state.get_state() != self.entry.state.state:
+                return await callback.answer()
+        return await self.entry.handler.call(callback, **data, action=self.action)
+
+
+class CallbackTable:
+    """Таблица обработчиков коллбэков с поиском по префиксу за O(1).
+
+    Простые кнопки ("view_table") ищутся по строке целиком, типизированные
+    действия - по префиксу до первого SEP; данные разбираются один раз, и
+    обработчик получает готовый объект в аргументе `action`. Для кнопок в
+    уже отправленных сообщениях можно зарегистрировать разбор старого
+    формата (`legacy`).
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Entry] = {}
+        self._legacy: List[Tuple[str, Callable[[str], Action]]] = []
+
+    def on(self, key: Union[str, Type[Action]], access: str = ANYONE, state: Optional[State] = None):
+        """Декоратор: обработчик простой кнопки (строка) или типа действия"""
+        if isinstance(key, type):
+            key, access = key.prefix, key.access
+
+        def register(func):
+            if key in self._entries:
+                raise ValueError(f"Callback {key!r} is already handled")
+            self._entries[key] = Entry(CallableObject(func), access, state)
+            return func
+        return register
+
+    def legacy(self, prefix: str, convert: Callable[[str], Action]):
+        """Разбор старого формата "<prefix><остаток>" в действие"""
+        self._legacy.append((prefix, convert))
+
+    def resolve(self, data: str) -> Optional[Route]:
+        """Маршрут для данных коллбэка; None, если обработчика нет.
+
+        Кнопка устаревшей версии действия вызывает OutdatedCallback.
+        """
+        prefix, _, rest = data.partition(SEP)
+        entry = self._entries.get(prefix)
+        if entry is not None:
+            if prefix not in ACTIONS:
+                return Route(entry, None) if not rest else None
+            try:
+                return Route(entry, ACTIONS[prefix].unpack(rest.split(SEP)))
+            except OutdatedCallback:
+                raise
+            except (TypeError, ValueError):
+                return None
+
+        # Старые форматы проверяются только если новый не подошел
+        for legacy_prefix, convert in self._legacy:
+            if data.startswith(legacy_prefix):
+                try:
+                    action = convert(data[len(legacy_prefix):])
+                except (IndexError, KeyError, ValueError):
+                    return None
+                entry = self._entries.get(action.prefix)
+                return Route(entry, action) if entry is not None else None
+        return None
+
+
+callbacks = CallbackTable()
+
+
+# Действия бота
+@dataclasses.dataclass(frozen=True)
+class ApproveRegistration(Action, prefix="ap", access=ADMIN):
+    user_id: int
+
+
+@dataclasses.dataclass(frozen=True)
+class RejectRegistration(Action, prefix="rj", access=ADMIN):
+    user_id: int
+
+
+@dataclasses.dataclass(frozen=True)
+class SetRole(Action, prefix="ro", access=ADMIN):
+    # leader, soldier, member или reject
+    role: str
+    user_id: int
+
+
+@dataclasses.dataclass(frozen=True)
+class SetOwnRole(Action, prefix="sr", access=ADMIN):
+    role: str
+
+
+@dataclasses.dataclass(frozen=True)
+class DeleteFakeName(Action, prefix="df", access=ADMIN):
+    fake_id: int
+
+
+@dataclasses.dataclass(frozen=True)
+class SelectPattern(Action, prefix="pt", access=OWNER):
+    pattern_id: int
+
+
+@dataclasses.dataclass(frozen=True)
+class NicksPage(Action, prefix="nk"):
+    page: int
+
+
+# Кнопки заявок и запросов роли живут в чате админов долго - старый формат тоже понимаем
+callbacks.legacy("approve_", lambda rest: ApproveRegistration(int(rest)))
+callbacks.legacy("reject_", lambda rest: RejectRegistration(int(rest)))
+callbacks.legacy("role_", lambda rest: SetRole(rest.split("_")[0], int(rest.split("_")[1])))
+callbacks.legacy("self_role_", lambda rest: SetOwnRole(rest))
@@ -11,10 +11,49 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
 MY_TG_ID = os.getenv("MY_TG_ID")
+# Альянс, которому принадлежат ADMIN_CHAT_ID и MY_TG_ID; остальные альянсы - в таблице alliances
+DEFAULT_ALLIANCE_ID = int(os.getenv("DEFAULT_ALLIANCE_ID", "1"))
 
 # Webhook
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
 WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}" if BOT_TOKEN else "/webhook"
+# Свой сервер Bot API (локальный telegram-bot-api или заменитель из loadtest); пусто - api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# FSM storage: путь к файлу SQLite (пусто - хранить состояния в памяти)
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "fsm_state.sqlite3")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))
+
+# Очередь входящих апдейтов: число обработчиков и максимальная длина
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+
+# Журнал update_id для отсева повторных доставок
+UPDATE_LEDGER_SIZE = int(os.getenv("UPDATE_LEDGER_SIZE", "10000"))
+UPDATE_LEDGER_PERSISTENT = os.getenv("UPDATE_LEDGER_PERSISTENT", "").lower() in ("1", "true", "yes")
+
+# Несколько воркеров uvicorn: общие файлы (блокировка, сокеты, таблица апдейтов)
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+RUNTIME_DIR = os.getenv("RUNTIME_DIR", "/tmp/iggdicebot")
+
+# Сколько запросов к Supabase допустимо на один апдейт (0 - не проверять)
+DB_ROUNDTRIP_BUDGET = int(os.getenv("DB_ROUNDTRIP_BUDGET", "6"))
+
+# Логи: уровень, формат (json или text) и доля сохраняемых частых записей
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+# Снимки ростера: расписание cron (UTC, пусто - не снимать), сколько дней
+# хранить все снимки и сколько недель - по одному за неделю
+SNAPSHOT_CRON = os.getenv("SNAPSHOT_CRON", "0 3 * * *")
+SNAPSHOT_KEEP_DAILY = int(os.getenv("SNAPSHOT_KEEP_DAILY", "14"))
+SNAPSHOT_KEEP_WEEKLY = int(os.getenv("SNAPSHOT_KEEP_WEEKLY", "12"))
+
+# Горячее состояние (альянсы, чаты, игроки, админы, паттерны) на диске для быстрого
+# перезапуска: путь к файлу (пусто - не сохранять) и как часто сохранять, секунды
+WARM_STATE_PATH = os.getenv("WARM_STATE_PATH", "warm_state.bin")
+WARM_STATE_INTERVAL = int(os.getenv("WARM_STATE_INTERVAL", "300"))
 
 # Проверка обязательных переменных
 if not all([SUPABASE_URL, SUPABASE_KEY, BOT_TOKEN, ADMIN_CHAT_ID, MY_TG_ID]):
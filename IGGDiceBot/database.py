@@ -1,18 +1,133 @@
+import asyncio
+import time
 import os
 import string
-from supabase import create_client, Client
-from typing import List, Dict, Optional
+import startup
+with startup.measure_import("supabase"):
+    from supabase import create_client, Client
+from typing import AbstractSet, Any, List, Dict, Optional, Set, Tuple
 from datetime import datetime, timedelta
 from config import SUPABASE_URL, SUPABASE_KEY
+from metrics import DB_SECONDS, DB_ERRORS, instrument_methods
+import dbtrace
+from logs import get_logger
+from name_index import NameIndex
+from singleflight import SingleFlight
+import tenants
+from tenants import Tenant, TenantRegistry
+
+log = get_logger("database")
+
+# Время жизни кэша списка игроков, секунды
+ROSTER_CACHE_TTL = 60
+# Время жизни кэша списка админов, секунды (админов, добавленных ботом, кэш видит сразу)
+ADMINS_CACHE_TTL = 60
+# Строк в одном запросе массовой загрузки ростера
+IMPORT_BATCH_SIZE = 100
+
+# Виды изменений таблицы users, которые другие воркеры применяют к своим кэшам
+USER_UPDATED = "updated"
+USER_RENAMED = "renamed"
+USER_JOINED = "joined"
+USER_LEFT = "left"
+USERS_IMPORTED = "imported"
+
+class TenantState:
+    """Кэши одного альянса"""
+
+    def __init__(self):
+        # Кэш списка игроков для NICKS: (время загрузки, строки)
+        self.roster: Optional[Tuple[float, List[Dict]]] = None
+        # Версия данных таблицы игроков: растет при любом изменении игроков или паттернов
+        self.roster_version = 0
+        # Индекс имен игроков для поиска; загружается при первом обращении
+        # и обновляется при каждой записи имени
+        self.names = NameIndex()
+        self.names_loaded = False
+        self.names_changed_during_load = False
+        self.name_loads = SingleFlight()
+        # Кэш админов: (время загрузки, tg_id)
+        self.admins: Optional[Tuple[float, Set[int]]] = None
+        self.admin_loads = SingleFlight()
+        # Строки активного паттерна (заполняет PatternManager): None - не загружены
+        self.active_pattern: Optional[List[Dict]] = None
+
 
 class Database:
+    """Доступ к таблицам Supabase.
+
+    Все таблицы, кроме alliances, разделены по альянсам столбцом
+    alliance_id: запросы фильтруются, а новые строки помечаются альянсом
+    текущего апдейта (tenants.current). Кэши тоже у каждого альянса свои.
+    """
+
     def __init__(self):
         self.client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    
+        # Альянсы, их чаты и игроки для определения альянса апдейта
+        self.tenants = TenantRegistry()
+        self._tenant_loads = SingleFlight()
+        # id альянса -> его кэши
+        self._states: Dict[int, TenantState] = {}
+        # Канал для сброса кэшей в соседних воркерах (см. attach_broadcast)
+        self.broadcast = None
+
+    def attach_broadcast(self, broadcast):
+        """Подписаться на изменения, сделанные другими воркерами"""
+        self.broadcast = broadcast
+        broadcast.subscribe("users", self._users_changed_elsewhere)
+        broadcast.subscribe("allowed_chats", self._drop_allowed_chats)
+        broadcast.subscribe("fake_names", self._fake_names_changed_elsewhere)
+        broadcast.subscribe("patterns", self._patterns_changed_elsewhere)
+        broadcast.subscribe("alliances", self._drop_alliances)
+        broadcast.subscribe("admins", self._admins_changed_elsewhere)
+
+    def _publish(self, topic: str, *args):
+        if self.broadcast is not None:
+            self.broadcast.publish(topic, *args)
+
+    async def _execute(self, query):
+        """Выполнить запрос Supabase в отдельном потоке, не блокируя event loop"""
+        started = time.perf_counter()
+        try:
+            response = await asyncio.to_thread(query.execute)
+        except Exception:
+            DB_ERRORS.inc()
+            raise
+        dbtrace.record(query, response, started)
+        return response
+
+    async def _fetch(self, query) -> List[Dict]:
+        """Выполнить запрос и вернуть строки ответа"""
+        response = await self._execute(query)
+        return response.data
+
+    @staticmethod
+    def _scoped(query):
+        """Ограничить запрос (select/update/delete) альянсом текущего апдейта"""
+        return query.eq("alliance_id", tenants.current_id())
+
+    def _state(self) -> TenantState:
+        alliance_id = tenants.current_id()
+        state = self._states.get(alliance_id)
+        if state is None:
+            state = self._states[alliance_id] = TenantState()
+        return state
+
+    @property
+    def roster_version(self) -> int:
+        """Версия игроков и паттернов текущего альянса"""
+        return self._state().roster_version
+
     # Users table operations (остаются без изменений)
     async def add_user(self, tg_id: int, username: str, tag: str, status: str = "pending") -> bool:
+        # Игрок Telegram состоит только в одном альянсе
+        member_of = (self.tenants.members or {}).get(tg_id)
+        if member_of is not None and member_of != tenants.current_id():
+            log.warning("User %s already belongs to alliance %s", tg_id, member_of)
+            return False
         try:
             data = {
+                "alliance_id": tenants.current_id(),
                 "tg_id": tg_id,
                 "username": username,
                 "tag": tag,
@@ -22,26 +137,30 @@ class Database:
                 "created_at": datetime.utcnow().isoformat(),
                 "updated_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("users").insert(data).execute()
+            response = await self._execute(self.client.table("users").insert(data))
+            if response.data:
+                self._index_name("telegram", tg_id, data["player_name"])
+                self.tenants.add_member(tg_id, data["alliance_id"])
+                self._users_changed(USER_JOINED, tg_id, data["player_name"])
             return bool(response.data)
         except Exception as e:
-            print(f"Error adding user: {e}")
+            log.error("Error adding user: %s", e)
             return False
 
     async def get_user_by_player_name(self, player_name: string) -> Optional[Dict]:
         try:
-            response = self.client.table("users").select("*").eq("player_name", player_name).execute()
+            response = await self._execute(self._scoped(self.client.table("users").select("*")).eq("player_name", player_name))
             return response.data[0] if response.data else None
         except Exception as e:
-            print(f"Error getting user: {e}")
+            log.error("Error getting user: %s", e)
             return None
 
     async def get_user(self, tg_id: int) -> Optional[Dict]:
         try:
-            response = self.client.table("users").select("*").eq("tg_id", tg_id).execute()
+            response = await self._execute(self._scoped(self.client.table("users").select("*")).eq("tg_id", tg_id))
             return response.data[0] if response.data else None
         except Exception as e:
-            print(f"Error getting user: {e}")
+            log.error("Error getting user: %s", e)
             return None
 
 
@@ -51,10 +170,11 @@ class Database:
                 "status": status,
                 "updated_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("users").update(data).eq("tg_id", tg_id).execute()
+            response = await self._execute(self._scoped(self.client.table("users").update(data)).eq("tg_id", tg_id))
+            self._users_changed()
             return bool(response.data)
         except Exception as e:
-            print(f"Error updating user status: {e}")
+            log.error("Error updating user status: %s", e)
             return False
 
     async def update_user_role(self, tg_id: int, role: str) -> bool:
@@ -63,10 +183,11 @@ class Database:
                 "role": role,
                 "updated_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("users").update(data).eq("tg_id", tg_id).execute()
+            response = await self._execute(self._scoped(self.client.table("users").update(data)).eq("tg_id", tg_id))
+            self._users_changed()
             return bool(response.data)
         except Exception as e:
-            print(f"Error updating user role: {e}")
+            log.error("Error updating user role: %s", e)
             return False
 
     async def update_user_name(self, tg_id: int, player_name: str) -> bool:
@@ -75,32 +196,147 @@ class Database:
                 "player_name": player_name,
                 "updated_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("users").update(data).eq("tg_id", tg_id).execute()
+            response = await self._execute(self._scoped(self.client.table("users").update(data)).eq("tg_id", tg_id))
+            if response.data:
+                self._index_name("telegram", tg_id, player_name)
+                self._users_changed(USER_RENAMED, tg_id, player_name)
             return bool(response.data)
         except Exception as e:
-            print(f"Error updating user name: {e}")
+            log.error("Error updating user name: %s", e)
             return False
 
     async def delete_user(self, tg_id: int) -> bool:
         try:
-            response = self.client.table("users").delete().eq("tg_id", tg_id).execute()
+            response = await self._execute(self._scoped(self.client.table("users").delete()).eq("tg_id", tg_id))
+            if response.data:
+                self._unindex_name("telegram", tg_id)
+                self.tenants.remove_member(tg_id)
+                self._users_changed(USER_LEFT, tg_id)
             return bool(response.data)
         except Exception as e:
-            print(f"Error deleting user: {e}")
+            log.error("Error deleting user: %s", e)
             return False
 
     async def get_all_users(self) -> List[Dict]:
         try:
-            response = self.client.table("users").select("*").execute()
+            response = await self._execute(self._scoped(self.client.table("users").select("*")))
             return response.data
         except Exception as e:
-            print(f"Error getting all users: {e}")
+            log.error("Error getting all users: %s", e)
             return []
 
+    async def get_roster(self) -> List[Dict]:
+        """Список игроков (tag, player_name) по алфавиту из короткоживущего кэша"""
+        state = self._state()
+        if state.roster is not None and time.monotonic() - state.roster[0] < ROSTER_CACHE_TTL:
+            return state.roster[1]
+        try:
+            return await self._load_roster(state)
+        except Exception as e:
+            log.error("Error getting roster: %s", e)
+            return []
+
+    async def _load_roster(self, state: TenantState) -> List[Dict]:
+        rows = await self._fetch(self._scoped(self.client.table("users")\
+            .select("tag, player_name"))\
+            .order("player_name"))
+        state.roster = (time.monotonic(), rows)
+        return rows
+
+    def _users_changed(self, change: str = USER_UPDATED, tg_id: Optional[int] = None, player_name: str = ""):
+        """Сбросить кэши, зависящие от таблицы users, здесь и в других воркерах.
+
+        Индекс имен и принадлежность к альянсу здесь обновляют вызывающие
+        методы; другие воркеры повторяют это по `change`, `tg_id` и `player_name`.
+        """
+        self._drop_user_caches()
+        self._publish("users", tenants.current_id(), change, tg_id or "", player_name)
+
+    def _drop_user_caches(self):
+        state = self._state()
+        state.roster = None
+        state.roster_version += 1
+
+    def _users_changed_elsewhere(self, alliance_id: str, change: str, tg_id: str, player_name: str):
+        alliance_id = int(alliance_id)
+        if change == USER_JOINED:
+            self.tenants.add_member(int(tg_id), alliance_id)
+        elif change == USER_LEFT:
+            self.tenants.remove_member(int(tg_id))
+        state = self._states.get(alliance_id)
+        if state is None:
+            return
+        state.roster = None
+        state.roster_version += 1
+        if change in (USER_JOINED, USER_RENAMED):
+            state.names.add(("telegram", int(tg_id)), player_name)
+        elif change == USER_LEFT:
+            state.names.remove(("telegram", int(tg_id)))
+        elif change == USERS_IMPORTED:
+            state.names_loaded = False
+        state.names_changed_during_load = True
+
+    def _fake_names_changed(self):
+        self._state().roster_version += 1
+        self._publish("fake_names", tenants.current_id())
+
+    def _fake_names_changed_elsewhere(self, alliance_id: str):
+        state = self._states.get(int(alliance_id))
+        if state is not None:
+            state.roster_version += 1
+            state.names_loaded = False
+
+    def patterns_changed(self):
+        """Отметить изменение паттернов (вызывает PatternManager)"""
+        state = self._state()
+        state.roster_version += 1
+        state.active_pattern = None
+        self._publish("patterns", tenants.current_id())
+
+    def _patterns_changed_elsewhere(self, alliance_id: str):
+        state = self._states.get(int(alliance_id))
+        if state is not None:
+            state.roster_version += 1
+            state.active_pattern = None
+
+    # Поиск игроков по имени
+    async def player_index(self) -> NameIndex:
+        """Индекс имен всех игроков альянса (users и fake_names), загруженный при необходимости"""
+        state = self._state()
+        if not state.names_loaded:
+            await state.name_loads.do("names", lambda: self._load_name_index(state))
+        return state.names
+
+    async def _load_name_index(self, state: TenantState):
+        state.names_changed_during_load = False
+        users, fakes = await asyncio.gather(
+            self._fetch(self._scoped(self.client.table("users").select("tg_id, player_name"))),
+            self._fetch(self._scoped(self.client.table("fake_names").select("id, player_name")))
+        )
+        index = NameIndex()
+        for user in users:
+            index.add(("telegram", user["tg_id"]), user["player_name"] or "")
+        for fake in fakes:
+            index.add(("fake", fake["id"]), fake["player_name"] or "")
+        state.names = index
+        # Запись во время загрузки могла не попасть в выборку - перечитаем при следующем поиске
+        state.names_loaded = not state.names_changed_during_load
+
+    def _index_name(self, kind: str, player_id: int, player_name: str):
+        state = self._state()
+        state.names.add((kind, player_id), player_name)
+        state.names_changed_during_load = True
+
+    def _unindex_name(self, kind: str, player_id: int):
+        state = self._state()
+        state.names.remove((kind, player_id))
+        state.names_changed_during_load = True
+
     # Fake names table operations
     async def add_fake_name(self, player_name: str, role: str = "участник") -> bool:
         try:
             data = {
+                "alliance_id": tenants.current_id(),
                 "username": "Фиктивный игрок",
                 "tag": "без Telegram",
                 "status": "approved", 
@@ -109,10 +345,13 @@ class Database:
                 "created_at": datetime.utcnow().isoformat(),
                 "updated_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("fake_names").insert(data).execute()
+            response = await self._execute(self.client.table("fake_names").insert(data))
+            self._fake_names_changed()
+            if response.data:
+                self._index_name("fake", response.data[0]["id"], player_name)
             return bool(response.data)
         except Exception as e:
-            print(f"Error adding fake name: {e}")
+            log.error("Error adding fake name: %s", e)
             return False
 
     async def update_fake_name_role(self, fake_name_id: int, role: str) -> bool:
@@ -121,10 +360,11 @@ class Database:
                 "role": role,
                 "updated_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("fake_names").update(data).eq("id", fake_name_id).execute()
+            response = await self._execute(self._scoped(self.client.table("fake_names").update(data)).eq("id", fake_name_id))
+            self._fake_names_changed()
             return bool(response.data)
         except Exception as e:
-            print(f"Error updating fake name role: {e}")
+            log.error("Error updating fake name role: %s", e)
             return False
 
     async def update_fake_name(self, fake_name_id: int, player_name: str) -> bool:
@@ -133,72 +373,209 @@ class Database:
                 "player_name": player_name,
                 "updated_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("fake_names").update(data).eq("id", fake_name_id).execute()
+            response = await self._execute(self._scoped(self.client.table("fake_names").update(data)).eq("id", fake_name_id))
+            self._fake_names_changed()
+            if response.data:
+                self._index_name("fake", fake_name_id, player_name)
             return bool(response.data)
         except Exception as e:
-            print(f"Error updating fake name: {e}")
+            log.error("Error updating fake name: %s", e)
             return False
 
     async def delete_fake_name(self, fake_name_id: int) -> bool:
         try:
-            response = self.client.table("fake_names").delete().eq("id", fake_name_id).execute()
+            response = await self._execute(self._scoped(self.client.table("fake_names").delete()).eq("id", fake_name_id))
+            self._fake_names_changed()
+            if response.data:
+                self._unindex_name("fake", fake_name_id)
             return bool(response.data)
         except Exception as e:
-            print(f"Error deleting fake name: {e}")
+            log.error("Error deleting fake name: %s", e)
             return False
 
     async def get_all_fake_names(self) -> List[Dict]:
         try:
-            response = self.client.table("fake_names").select("*").execute()
+            response = await self._execute(self._scoped(self.client.table("fake_names").select("*")))
             return response.data
         except Exception as e:
-            print(f"Error getting fake names: {e}")
+            log.error("Error getting fake names: %s", e)
             return []
 
+    # Массовая загрузка ростера
+    async def import_roster(self, new_fakes: List[Dict], users: List[Dict], fakes: List[Dict],
+                            removed_fake_ids: List[int]) -> bool:
+        """Записать изменения ростера пачками по IMPORT_BATCH_SIZE строк.
+
+        `new_fakes` добавляются в fake_names, измененные строки `users` и
+        `fakes` записываются целиком через upsert по ключу, `removed_fake_ids`
+        удаляются. Пачки отправляются параллельно; при ошибке части пачек
+        остальные все равно применяются, а результат будет False.
+        """
+        def chunks(rows):
+            return [rows[i:i + IMPORT_BATCH_SIZE] for i in range(0, len(rows), IMPORT_BATCH_SIZE)]
+
+        now = datetime.utcnow().isoformat()
+        alliance_id = tenants.current_id()
+        users = [{**user, "alliance_id": alliance_id, "updated_at": now} for user in users]
+        fakes = [{**fake, "alliance_id": alliance_id, "updated_at": now} for fake in fakes]
+        new_fakes = [{
+            "alliance_id": alliance_id,
+            "username": "Фиктивный игрок",
+            "tag": "без Telegram",
+            "status": "approved",
+            "created_at": now,
+            "updated_at": now,
+            **fake
+        } for fake in new_fakes]
+
+        # (вид игрока в индексе имен или None для удаления, запрос)
+        queries = [("fake", self.client.table("fake_names").insert(chunk)) for chunk in chunks(new_fakes)]
+        queries += [("telegram", self.client.table("users").upsert(chunk, on_conflict="tg_id")) for chunk in chunks(users)]
+        queries += [("fake", self.client.table("fake_names").upsert(chunk, on_conflict="id")) for chunk in chunks(fakes)]
+        queries += [(None, self._scoped(self.client.table("fake_names").delete()).in_("id", chunk)) for chunk in chunks(removed_fake_ids)]
+        results = await asyncio.gather(*(self._execute(query) for _, query in queries), return_exceptions=True)
+
+        ok = True
+        for (kind, _), result in zip(queries, results):
+            if isinstance(result, Exception):
+                log.error("Error importing roster: %s", result)
+                ok = False
+            elif kind is not None:
+                key = "tg_id" if kind == "telegram" else "id"
+                for row in result.data:
+                    self._index_name(kind, row[key], row["player_name"] or "")
+        for fake_id in removed_fake_ids:
+            self._unindex_name("fake", fake_id)
+
+        if users:
+            self._users_changed(USERS_IMPORTED)
+        if new_fakes or fakes or removed_fake_ids:
+            self._fake_names_changed()
+        return ok
+
+    # Альянсы: определение альянса апдейта по чату или игроку
+    async def tenant_registry(self) -> TenantRegistry:
+        """Реестр альянсов; недостающие части загружаются параллельно"""
+        if not self.tenants.loaded:
+            loads = []
+            if self.tenants.alliances is None:
+                loads.append(self._tenant_loads.do("alliances", self.load_alliances))
+            if self.tenants.allowed_chats is None:
+                loads.append(self._tenant_loads.do("allowed_chats", self.load_allowed_chats))
+            if self.tenants.members is None:
+                loads.append(self._tenant_loads.do("members", self.load_members))
+            await asyncio.gather(*loads)
+        return self.tenants
+
+    async def load_alliances(self) -> List[Tenant]:
+        """Загрузить альянсы; альянс по умолчанию есть всегда"""
+        try:
+            rows = await self._fetch(self.client.table("alliances").select("id, name, admin_chat_id, owner_tg_id"))
+            self.tenants.set_alliances(
+                Tenant(row["id"], row["name"] or "", row["admin_chat_id"], row["owner_tg_id"]) for row in rows
+            )
+        except Exception as e:
+            # Без списка альянсов чаты нельзя надежно сопоставить - повторим на следующем апдейте
+            log.error("Error loading alliances: %s", e)
+        return self.tenants.all()
+
+    async def load_members(self) -> Dict[int, int]:
+        """Загрузить принадлежность игроков Telegram к альянсам"""
+        try:
+            rows = await self._fetch(self.client.table("users").select("tg_id, alliance_id"))
+            self.tenants.members = {row["tg_id"]: row["alliance_id"] for row in rows}
+        except Exception as e:
+            log.error("Error loading alliance members: %s", e)
+        return self.tenants.members or {}
+
+    async def add_alliance(self, alliance_id: int, name: str, admin_chat_id: int, owner_tg_id: int) -> bool:
+        try:
+            data = {
+                "id": alliance_id,
+                "name": name,
+                "admin_chat_id": admin_chat_id,
+                "owner_tg_id": owner_tg_id,
+                "created_at": datetime.utcnow().isoformat()
+            }
+            response = await self._execute(self.client.table("alliances").insert(data))
+            if response.data:
+                self.tenants.set_alliances(self.tenants.all() + [Tenant(alliance_id, name, admin_chat_id, owner_tg_id)])
+            self._publish("alliances")
+            return bool(response.data)
+        except Exception as e:
+            log.error("Error adding alliance: %s", e)
+            return False
+
+    def _drop_alliances(self):
+        self.tenants.alliances = None
+
     # Allowed chats operations
     async def add_allowed_chat(self, chat_id: int, chat_title: str = "") -> bool:
         try:
             data = {
+                "alliance_id": tenants.current_id(),
                 "chat_id": chat_id,
                 "chat_title": chat_title,
                 "created_at": datetime.utcnow().isoformat()
             }
-            response = self.client.table("allowed_chats").insert(data).execute()
+            response = await self._execute(self.client.table("allowed_chats").insert(data))
+            if response.data:
+                self.tenants.allow_chat(chat_id, data["alliance_id"])
+            self._publish("allowed_chats")
             return bool(response.data)
         except Exception as e:
-            print(f"Error adding allowed chat: {e}")
+            log.error("Error adding allowed chat: %s", e)
             return False
 
     async def remove_allowed_chat(self, chat_id: int) -> bool:
         try:
-            response = self.client.table("allowed_chats").delete().eq("chat_id", chat_id).execute()
+            response = await self._execute(self._scoped(self.client.table("allowed_chats").delete()).eq("chat_id", chat_id))
+            if response.data:
+                self.tenants.forbid_chat(chat_id)
+            self._publish("allowed_chats")
             return bool(response.data)
         except Exception as e:
-            print(f"Error removing allowed chat: {e}")
+            log.error("Error removing allowed chat: %s", e)
             return False
 
-    async def is_chat_allowed(self, chat_id: int) -> bool:
+    async def load_allowed_chats(self) -> Set[int]:
+        """Загрузить разрешенные чаты всех альянсов в память; вернуть чаты текущего"""
         try:
-            response = self.client.table("allowed_chats").select("*").eq("chat_id", chat_id).execute()
-            return len(response.data) > 0
+            rows = await self._fetch(self.client.table("allowed_chats").select("chat_id, alliance_id"))
+            self.tenants.allowed_chats = {row["chat_id"]: row["alliance_id"] for row in rows}
         except Exception as e:
-            print(f"Error checking allowed chat: {e}")
-            return False
+            log.error("Error loading allowed chats: %s", e)
+        alliance_id = tenants.current_id()
+        return {chat_id for chat_id, owner in (self.tenants.allowed_chats or {}).items() if owner == alliance_id}
+
+    def _drop_allowed_chats(self):
+        # Список перезагрузится при следующей проверке is_chat_allowed
+        self.tenants.allowed_chats = None
+
+    def allowed_chat_ids(self) -> Optional[AbstractSet[int]]:
+        """Кэшированные id разрешенных чатов всех альянсов без обращения к базе (None, если не загружены)"""
+        allowed_chats = self.tenants.allowed_chats
+        return allowed_chats.keys() if allowed_chats is not None else None
+
+    async def is_chat_allowed(self, chat_id: int) -> bool:
+        """Разрешен ли чат для альянса текущего апдейта"""
+        if self.tenants.allowed_chats is None:
+            await self._tenant_loads.do("allowed_chats", self.load_allowed_chats)
+        return (self.tenants.allowed_chats or {}).get(chat_id) == tenants.current_id()
 
     async def get_all_allowed_chats(self) -> List[Dict]:
         try:
-            response = self.client.table("allowed_chats").select("*").execute()
+            response = await self._execute(self._scoped(self.client.table("allowed_chats").select("*")))
             return response.data
         except Exception as e:
-            print(f"Error getting allowed chats: {e}")
+            log.error("Error getting allowed chats: %s", e)
             return []
 
     # Комбинированные методы для работы со всеми игроками (остаются без изменений)
     async def get_all_players(self) -> List[Dict]:
         """Получить всех игроков (реальные + фиктивные)"""
         try:
-            users = await self.get_all_users()
-            fake_names = await self.get_all_fake_names()
+            users, fake_names = await asyncio.gather(self.get_all_users(), self.get_all_fake_names())
             
             for user in users:
                 user['player_type'] = 'telegram'
@@ -208,7 +585,7 @@ class Database:
             all_players = users + fake_names
             return sorted(all_players, key=lambda x: x['player_name'])
         except Exception as e:
-            print(f"Error getting all players: {e}")
+            log.error("Error getting all players: %s", e)
             return []
 
     async def get_recent_players(self) -> List[Dict]:
@@ -216,15 +593,13 @@ class Database:
         try:
             time_24_hours_ago = (datetime.utcnow() - timedelta(hours=24)).isoformat()
             
-            recent_users = self.client.table("users")\
-                .select("*")\
-                .gte("updated_at", time_24_hours_ago)\
-                .execute().data
+            recent_users = await self._fetch(self._scoped(self.client.table("users")\
+                .select("*"))\
+                .gte("updated_at", time_24_hours_ago))
             
-            recent_fakes = self.client.table("fake_names")\
-                .select("*")\
-                .gte("updated_at", time_24_hours_ago)\
-                .execute().data
+            recent_fakes = await self._fetch(self._scoped(self.client.table("fake_names")\
+                .select("*"))\
+                .gte("updated_at", time_24_hours_ago))
             
             for user in recent_users:
                 user['player_type'] = 'telegram'
@@ -233,21 +608,19 @@ class Database:
             
             return recent_users + recent_fakes
         except Exception as e:
-            print(f"Error getting recent players: {e}")
+            log.error("Error getting recent players: %s", e)
             return []
 
     async def get_leaders(self) -> List[Dict]:
         """Получить всех лидеров (реальные + фиктивные)"""
         try:
-            user_leaders = self.client.table("users")\
-                .select("*")\
-                .eq("role", "лидер")\
-                .execute().data
+            user_leaders = await self._fetch(self._scoped(self.client.table("users")\
+                .select("*"))\
+                .eq("role", "лидер"))
             
-            fake_leaders = self.client.table("fake_names")\
-                .select("*")\
-                .eq("role", "лидер")\
-                .execute().data
+            fake_leaders = await self._fetch(self._scoped(self.client.table("fake_names")\
+                .select("*"))\
+                .eq("role", "лидер"))
             
             for user in user_leaders:
                 user['player_type'] = 'telegram'
@@ -256,21 +629,19 @@ class Database:
             
             return user_leaders + fake_leaders
         except Exception as e:
-            print(f"Error getting leaders: {e}")
+            log.error("Error getting leaders: %s", e)
             return []
 
     async def get_soldiers(self) -> List[Dict]:
         """Получить всех солдат (реальные + фиктивные)"""
         try:
-            user_soldiers = self.client.table("users")\
-                .select("*")\
-                .eq("role", "солдат")\
-                .execute().data
+            user_soldiers = await self._fetch(self._scoped(self.client.table("users")\
+                .select("*"))\
+                .eq("role", "солдат"))
             
-            fake_soldiers = self.client.table("fake_names")\
-                .select("*")\
-                .eq("role", "солдат")\
-                .execute().data
+            fake_soldiers = await self._fetch(self._scoped(self.client.table("fake_names")\
+                .select("*"))\
+                .eq("role", "солдат"))
             
             for user in user_soldiers:
                 user['player_type'] = 'telegram'
@@ -279,21 +650,19 @@ class Database:
             
             return user_soldiers + fake_soldiers
         except Exception as e:
-            print(f"Error getting soldiers: {e}")
+            log.error("Error getting soldiers: %s", e)
             return []
 
     async def get_regular_members(self) -> List[Dict]:
         """Получить обычных участников (реальные + фиктивные)"""
         try:
-            user_members = self.client.table("users")\
-                .select("*")\
-                .eq("role", "участник")\
-                .execute().data
+            user_members = await self._fetch(self._scoped(self.client.table("users")\
+                .select("*"))\
+                .eq("role", "участник"))
             
-            fake_members = self.client.table("fake_names")\
-                .select("*")\
-                .eq("role", "участник")\
-                .execute().data
+            fake_members = await self._fetch(self._scoped(self.client.table("fake_names")\
+                .select("*"))\
+                .eq("role", "участник"))
             
             for user in user_members:
                 user['player_type'] = 'telegram'
@@ -302,26 +671,46 @@ class Database:
             
             return user_members + fake_members
         except Exception as e:
-            print(f"Error getting regular members: {e}")
+            log.error("Error getting regular members: %s", e)
             return []
 
     # Admins table operations
     async def is_admin(self, tg_id: int) -> bool:
         try:
-            response = self.client.table("admins").select("*").eq("tg_id", tg_id).execute()
-            return len(response.data) > 0
+            return tg_id in await self.admin_ids()
         except Exception as e:
-            print(f"Error checking admin: {e}")
+            log.error("Error checking admin: %s", e)
             return False
 
+    async def admin_ids(self) -> Set[int]:
+        """tg_id админов альянса из короткоживущего кэша"""
+        state = self._state()
+        if state.admins is None or time.monotonic() - state.admins[0] >= ADMINS_CACHE_TTL:
+            await state.admin_loads.do("admins", lambda: self._load_admins(state))
+        return state.admins[1]
+
+    async def _load_admins(self, state: TenantState):
+        rows = await self._fetch(self._scoped(self.client.table("admins").select("tg_id")))
+        state.admins = (time.monotonic(), {row["tg_id"] for row in rows})
+
+    def _admins_changed_elsewhere(self, alliance_id: str):
+        state = self._states.get(int(alliance_id))
+        if state is not None:
+            state.admins = None
+
     async def add_admin(self, tg_id: int, username: str) -> bool:
         try:
-            admin_data = {"tg_id": tg_id, "username": username}
-            response = self.client.table("admins").insert(admin_data).execute()
+            admin_data = {"alliance_id": tenants.current_id(), "tg_id": tg_id, "username": username}
+            response = await self._execute(self.client.table("admins").insert(admin_data))
+            state = self._state()
+            if response.data and state.admins is not None:
+                state.admins[1].add(tg_id)
+            self._publish("admins", tenants.current_id())
             
             user_exists = await self.get_user(tg_id)
             if not user_exists:
                 user_data = {
+                    "alliance_id": admin_data["alliance_id"],
                     "tg_id": tg_id,
                     "username": username,
                     "tag": f"@{username}" if username else f"id{tg_id}",
@@ -331,9 +720,89 @@ class Database:
                     "created_at": datetime.utcnow().isoformat(),
                     "updated_at": datetime.utcnow().isoformat()
                 }
-                self.client.table("users").insert(user_data).execute()
+                await self._execute(self.client.table("users").insert(user_data))
+                self._index_name("telegram", tg_id, user_data["player_name"])
+                self.tenants.add_member(tg_id, user_data["alliance_id"])
+                self._users_changed(USER_JOINED, tg_id, user_data["player_name"])
             
             return bool(response.data)
         except Exception as e:
-            print(f"Error adding admin: {e}")
-            return False
\ No newline at end of file
+            log.error("Error adding admin: %s", e)
+            return False
+
+    # Горячее состояние для быстрого перезапуска (см. warm_state.py)
+    def export_state(self) -> Dict[str, Any]:
+        """Загруженные кэши в виде простых типов; незагруженные части - None"""
+        registry = self.tenants
+        states = {}
+        for alliance_id, state in self._states.items():
+            states[alliance_id] = {
+                "roster": [(row["tag"], row["player_name"]) for row in state.roster[1]]
+                if state.roster is not None else None,
+                "names": [(kind, player_id, name) for (kind, player_id), name in state.names.names.items()]
+                if state.names_loaded else None,
+                "admins": sorted(state.admins[1]) if state.admins is not None else None,
+                "active_pattern": state.active_pattern
+            }
+        return {
+            # Альянс по умолчанию всегда берется из окружения
+            "alliances": [
+                (tenant.alliance_id, tenant.name, tenant.admin_chat_id, tenant.owner_id)
+                for tenant in registry.alliances.values() if tenant.alliance_id != registry.default.alliance_id
+            ] if registry.alliances is not None else None,
+            "allowed_chats": dict(registry.allowed_chats) if registry.allowed_chats is not None else None,
+            "members": dict(registry.members) if registry.members is not None else None,
+            "states": states
+        }
+
+    def restore_state(self, data: Dict[str, Any]):
+        """Заполнить кэши из export_state; части, которые уже загружены, не трогаются"""
+        registry = self.tenants
+        if registry.alliances is None and data["alliances"] is not None:
+            registry.set_alliances(Tenant(*row) for row in data["alliances"])
+        if registry.allowed_chats is None and data["allowed_chats"] is not None:
+            registry.allowed_chats = data["allowed_chats"]
+        if registry.members is None and data["members"] is not None:
+            registry.members = data["members"]
+
+        now = time.monotonic()
+        for alliance_id, saved in data["states"].items():
+            state = self._states.setdefault(alliance_id, TenantState())
+            if state.roster is None and saved["roster"] is not None:
+                state.roster = (now, [{"tag": tag, "player_name": name} for tag, name in saved["roster"]])
+            if not state.names_loaded and saved["names"] is not None:
+                index = NameIndex()
+                for kind, player_id, name in saved["names"]:
+                    index.add((kind, player_id), name)
+                state.names = index
+                state.names_loaded = True
+            if state.admins is None and saved["admins"] is not None:
+                state.admins = (now, set(saved["admins"]))
+            if state.active_pattern is None:
+                state.active_pattern = saved["active_pattern"]
+
+    async def refresh_state(self):
+        """Перечитать из базы все закэшированное: реестр альянсов, игроков, имена и админов.
+
+        Новые данные заменяют старые только после загрузки, поэтому апдейты
+        все это время обслуживаются из кэша. Активный паттерн сбрасывается и
+        загрузится при следующем обращении.
+        """
+        await asyncio.gather(self.load_alliances(), self.load_allowed_chats(), self.load_members())
+        for alliance_id, state in list(self._states.items()):
+            tenant = self.tenants.get(alliance_id)
+            if tenant is None:
+                # Альянс удален, пока бот был выключен
+                del self._states[alliance_id]
+                continue
+            with tenants.scope(tenant):
+                loads = [self._load_name_index(state), self._load_admins(state)]
+                if state.roster is not None:
+                    loads.append(self._load_roster(state))
+                await asyncio.gather(*loads)
+                state.active_pattern = None
+
+
+# Запросы подписываются методом, время каждого публичного метода попадает в /metrics
+dbtrace.label_methods(Database)
+instrument_methods(Database, DB_SECONDS)
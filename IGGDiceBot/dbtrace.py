@@ -0,0 +1,151 @@
+import functools
+import inspect
+import json
+import time
+from contextvars import ContextVar
+from typing import Any, List, Optional, Tuple
+from config import DB_ROUNDTRIP_BUDGET
+from metrics import registry
+from logs import get_logger
+
+log = get_logger("dbtrace")
+
+DB_ROUNDTRIPS = registry.histogram(
+    "bot_db_roundtrips_per_update", "Supabase round trips made while handling one update",
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+)
+DB_BUDGET_EXCEEDED = registry.counter(
+    "bot_db_roundtrip_budget_exceeded_total", "Updates that made more Supabase round trips than allowed", ["handler"]
+)
+
+
+class _Call:
+    __slots__ = ("method", "http_method", "path", "rows", "data", "elapsed")
+
+    def __init__(self, method: str, http_method: str, path: str, rows: int, data: Any, elapsed: float):
+        self.method = method
+        self.http_method = http_method
+        self.path = path
+        self.rows = rows
+        self.data = data
+        self.elapsed = elapsed
+
+    @property
+    def size(self) -> int:
+        # Размер считается только для отчета, а не на каждый запрос
+        return len(json.dumps(self.data, default=str)) if self.data else 0
+
+    def __str__(self) -> str:
+        return f"{self.method} {self.http_method} {self.path} rows={self.rows} bytes={self.size} {self.elapsed * 1000:.0f}ms"
+
+
+class UpdateTrace:
+    """Запросы к Supabase, сделанные при обработке одного апдейта"""
+
+    def __init__(self, update_id: Optional[int]):
+        self.update_id = update_id
+        self.handler = "unknown"
+        self.calls: List[_Call] = []
+
+    @property
+    def rows(self) -> int:
+        return sum(call.rows for call in self.calls)
+
+    @property
+    def size(self) -> int:
+        return sum(call.size for call in self.calls)
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        """Методы, вызванные за апдейт больше одного раза (признак N+1)"""
+        counts = {}
+        for call in self.calls:
+            counts[call.method] = counts.get(call.method, 0) + 1
+        return [(method, count) for method, count in counts.items() if count > 1]
+
+
+_current: ContextVar[Optional[UpdateTrace]] = ContextVar("db_trace", default=None)
+
+# Публичный метод, выполняющий запрос (задается обертками label_methods)
+_method: ContextVar[str] = ContextVar("db_method", default="?")
+
+
+def start(update_id: Optional[int]):
+    """Начать трассировку апдейта; вернуть токен для `finish`"""
+    return _current.set(UpdateTrace(update_id))
+
+
+def finish(token, budget: int = DB_ROUNDTRIP_BUDGET) -> Optional[UpdateTrace]:
+    """Закончить трассировку и предупредить, если апдейт превысил бюджет запросов"""
+    trace = _current.get()
+    _current.reset(token)
+    if trace is None:
+        return None
+    DB_ROUNDTRIPS.observe(len(trace.calls))
+    if budget and len(trace.calls) > budget:
+        DB_BUDGET_EXCEEDED.inc(handler=trace.handler)
+        log.warning(
+            "Update made %s DB round trips (budget %s)", len(trace.calls), budget,
+            extra={
+                "handler": trace.handler,
+                "db_rows": trace.rows,
+                "db_bytes": trace.size,
+                "db_repeated": dict(trace.repeated()),
+                "db_calls": [str(call) for call in trace.calls]
+            }
+        )
+    return trace
+
+
+def current() -> Optional[UpdateTrace]:
+    return _current.get()
+
+
+def set_handler(name: str):
+    trace = _current.get()
+    if trace is not None:
+        trace.handler = name
+
+
+def record(query, response: Any, started: float):
+    """Записать выполненный запрос в трассировку текущего апдейта, если она идет"""
+    trace = _current.get()
+    if trace is None:
+        return
+    data = getattr(response, "data", None)
+    if isinstance(data, list):
+        rows = len(data)
+    else:
+        rows = 1 if data else 0
+    trace.calls.append(_Call(
+        _method.get(),
+        getattr(query, "http_method", "?"),
+        getattr(query, "path", "?"),
+        rows,
+        data,
+        time.perf_counter() - started
+    ))
+
+
+def label_methods(cls):
+    """Подписывать запросы публичных async-методов класса именем метода.
+
+    Имя хранится в контекстной переменной, поэтому доходит и до запросов,
+    запущенных через asyncio.gather; вложенный метод подписывает своим именем.
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, _labeled(func, name))
+    return cls
+
+
+def _labeled(func, name: str):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _method.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _method.reset(token)
+
+    return wrapper
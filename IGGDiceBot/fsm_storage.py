@@ -0,0 +1,275 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import FSM_STORAGE_PATH, FSM_STATE_TTL
+
+# Как часто сбрасывать накопленные изменения на диск, секунды
+FLUSH_INTERVAL = 1.0
+# Как часто удалять из файла просроченные состояния, секунды
+EXPIRE_INTERVAL = 60.0
+# При таком размере горячего слоя из него вычищаются пустые записи
+HOT_MAX_ENTRIES = 10000
+# Тема Broadcast, по которой соседние воркеры забывают измененную запись
+BROADCAST_TOPIC = "fsm"
+
+
+class _Entry:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+
+class DialogTracking:
+    """Пары (чат, пользователь) с незавершенным диалогом, известные в памяти.
+
+    Фильтр групповых сообщений проверяет по ним, идет ли у игрока диалог,
+    не читая состояние из хранилища. Пара может пережить истечение
+    состояния - тогда сообщение просто проходит дальше фильтра.
+    """
+
+    dialogs: Set[Tuple[int, int]]
+
+    def has_dialog(self, chat_id: int, user_id: int) -> bool:
+        return (chat_id, user_id) in self.dialogs
+
+    def _track(self, chat_id: int, user_id: int, state: Optional[str]):
+        if state is None:
+            self.dialogs.discard((chat_id, user_id))
+        else:
+            self.dialogs.add((chat_id, user_id))
+
+
+class MemoryFSMStorage(DialogTracking, MemoryStorage):
+    """MemoryStorage с учетом активных диалогов"""
+
+    def __init__(self):
+        super().__init__()
+        self.dialogs = set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await super().set_state(key, state)
+        self._track(key.chat_id, key.user_id, state.state if isinstance(state, State) else state)
+
+
+class SQLiteStorage(DialogTracking, BaseStorage):
+    """FSM-хранилище в файле SQLite с горячим слоем в памяти.
+
+    Чтение обслуживается из памяти, изменения накапливаются и пишутся на диск
+    пачками раз в FLUSH_INTERVAL секунд. Состояния, не менявшиеся дольше `ttl`,
+    считаются брошенными и удаляются. В режиме `shared` (несколько воркеров
+    на одном файле) каждое изменение сразу пишется в файл, а соседние
+    воркеры через Broadcast (см. attach_broadcast) забывают эту запись и
+    читают ее из файла заново, поэтому следующий шаг диалога видит
+    состояние, даже если попал в другой воркер. Обращения к SQLite
+    выполняются в потоке.
+    """
+
+    def __init__(self, path: str, ttl: float = FSM_STATE_TTL, shared: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.shared = shared
+        self.hot: Dict[str, _Entry] = {}
+        self._dirty: Set[str] = set()
+        self._flushing: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        # Соединение одно на все потоки
+        self._conn_lock = threading.Lock()
+        self._last_expire = 0.0
+        # Канал сброса записей в соседних воркерах; счетчик сбросов отсекает
+        # чтение из файла, начатое до сброса и завершившееся после него
+        self.broadcast = None
+        self._invalidations = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.dialogs = {
+            self._pair(key) for key, in self.conn.execute(
+                "SELECT key FROM fsm WHERE state IS NOT NULL AND updated_at >= ?", (time.time() - ttl,)
+            )
+        }
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    @staticmethod
+    def _pair(key: str) -> Tuple[int, int]:
+        _, chat_id, user_id = key.split(":", 3)[:3]
+        return int(chat_id), int(user_id)
+
+    def attach_broadcast(self, broadcast):
+        """Сообщать соседним воркерам об изменениях и получать их изменения"""
+        self.broadcast = broadcast
+        broadcast.subscribe(BROADCAST_TOPIC, self._changed_elsewhere)
+
+    def _changed_elsewhere(self, key: str, state: str = ""):
+        self._invalidations += 1
+        self.hot.pop(key, None)
+        self._track(*self._pair(key), state or None)
+
+    async def _entry(self, key: str) -> _Entry:
+        entry = self.hot.get(key)
+        if entry is not None:
+            return entry
+
+        invalidations = self._invalidations
+        row = await asyncio.to_thread(self._read, key)
+        # Пока шло чтение, запись могла появиться в горячем слое
+        if key in self.hot:
+            return self.hot[key]
+        if row is None or time.time() - row[2] > self.ttl:
+            entry = _Entry(None, {}, time.time())
+        else:
+            entry = _Entry(row[0], json.loads(row[1]), row[2])
+        # Прочитанное до сброса из соседнего воркера могло устареть - не кэшируем
+        if invalidations == self._invalidations:
+            if len(self.hot) >= HOT_MAX_ENTRIES:
+                self._evict(full=True)
+            self.hot[key] = entry
+        return entry
+
+    def _read(self, key: str):
+        with self._conn_lock:
+            return self.conn.execute("SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)).fetchone()
+
+    def _touch(self, key: str, entry: _Entry):
+        entry.updated_at = time.time()
+        self._dirty.add(key)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _write_through(self, column: str, key: str, value: Optional[str], state: Optional[str]):
+        await asyncio.to_thread(self._write_column, column, key, value)
+        if self.broadcast is not None:
+            self.broadcast.publish(BROADCAST_TOPIC, key, state or "")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey = self._key(key)
+        value = state.state if isinstance(state, State) else state
+        entry = await self._entry(skey)
+        self._track(key.chat_id, key.user_id, value)
+        if self.shared:
+            await self._write_through("state", skey, value, value)
+            self._renew(entry)
+            entry.state = value
+            return
+        entry.state = value
+        self._touch(skey, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._entry(self._key(key))
+        if time.time() - entry.updated_at > self.ttl:
+            return None
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        skey = self._key(key)
+        entry = await self._entry(skey)
+        if self.shared:
+            self._renew(entry)
+            await self._write_through("data", skey, json.dumps(data), entry.state)
+            entry.data = data.copy()
+            return
+        entry.data = data.copy()
+        self._touch(skey, entry)
+
+    def _renew(self, entry: _Entry):
+        # Как в _write_column: у просроченной записи вторая колонка сбрасывается
+        now = time.time()
+        if now - entry.updated_at > self.ttl:
+            entry.state, entry.data = None, {}
+        entry.updated_at = now
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._entry(self._key(key))
+        if time.time() - entry.updated_at > self.ttl:
+            return {}
+        return entry.data.copy()
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией и удалить просроченные состояния"""
+        async with self._lock:
+            if not self._dirty:
+                return
+            keys = self._flushing = self._dirty
+            self._dirty = set()
+            upserts, deletes = [], []
+            for key in keys:
+                entry = self.hot[key]
+                if entry.state is None and not entry.data:
+                    deletes.append((key,))
+                else:
+                    upserts.append((key, entry.state, json.dumps(entry.data), entry.updated_at))
+            try:
+                await asyncio.to_thread(self._write, upserts, deletes, time.time() - self.ttl)
+            finally:
+                self._flushing = set()
+            self._evict()
+
+    def _write(self, upserts, deletes, expire_before: float):
+        with self._conn_lock, self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR REPLACE INTO fsm VALUES (?, ?, ?, ?)", upserts)
+            self.conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            self.conn.execute("DELETE FROM fsm WHERE updated_at < ?", (expire_before,))
+
+    def _write_column(self, column: str, key: str, value: Optional[str]):
+        # Режим shared: меняется только state или data, вторая колонка могла быть
+        # записана другим воркером; у просроченной записи она сбрасывается
+        other = "data" if column == "state" else "state"
+        state, data = (value, "{}") if column == "state" else (None, value)
+        now = time.time()
+        with self._conn_lock:
+            self.conn.execute(
+                "INSERT INTO fsm VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                f"{column} = excluded.{column}, "
+                f"{other} = CASE WHEN fsm.updated_at < ? THEN excluded.{other} ELSE fsm.{other} END, "
+                "updated_at = excluded.updated_at",
+                (key, state, data, now, now - self.ttl)
+            )
+            if now - self._last_expire > EXPIRE_INTERVAL:
+                self._last_expire = now
+                self.conn.execute("DELETE FROM fsm WHERE updated_at < ?", (now - self.ttl,))
+
+    def _evict(self, full: bool = False):
+        # Брошенные записи горячему слою не нужны. Пустые записи избавляют
+        # обычных игроков от чтения файла на каждом сообщении, поэтому
+        # удаляются, только когда горячий слой переполнен
+        expire_before = time.time() - self.ttl
+        for key in [key for key, entry in self.hot.items() if key not in self._dirty and key not in self._flushing and (
+            entry.updated_at < expire_before or (full and entry.state is None and not entry.data)
+        )]:
+            del self.hot[key]
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        self.conn.close()
+
+
+def create_fsm_storage(shared: bool = False) -> DialogTracking:
+    """Хранилище FSM по настройкам: SQLite-файл или память, если путь не задан"""
+    if FSM_STORAGE_PATH:
+        return SQLiteStorage(FSM_STORAGE_PATH, shared=shared)
+    return MemoryFSMStorage()
@@ -0,0 +1,22 @@
+from typing import Optional
+import aiohttp
+
+# Таймаут запросов общего HTTP-клиента, секунды
+HTTP_TIMEOUT = 30
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Общая aiohttp-сессия для служебных HTTP-запросов (создается при первом вызове)"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+    return _session
+
+
+async def close_http_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,50 @@
+import asyncio
+from collections import deque
+from config import UPDATE_LEDGER_SIZE
+
+
+class UpdateLedger:
+    """Журнал недавно полученных update_id для отсева повторных доставок.
+
+    Кольцевой буфер задает порядок вытеснения, множество дает проверку за O(1);
+    память ограничена `capacity` записями. Необязательное общее хранилище
+    (`backing` с блокирующими методами `claim(update_id) -> bool` и
+    `release(update_id)`) переживает перезапуски и видно всем воркерам;
+    к нему обращаются из потока, чтобы не задерживать ответ вебхуку.
+    """
+
+    def __init__(self, capacity: int = UPDATE_LEDGER_SIZE, backing=None):
+        self.capacity = capacity
+        self.backing = backing
+        self._order: deque = deque()
+        self._seen = set()
+        self.duplicates = 0
+
+    async def register(self, update_id: int) -> bool:
+        """Запомнить апдейт. False, если он уже встречался"""
+        if update_id in self._seen:
+            self.duplicates += 1
+            return False
+        # Запоминаем до обращения к хранилищу: повтор, пришедший за это время, тоже отсеется
+        self._remember(update_id)
+        is_new = self.backing is None or await asyncio.to_thread(self.backing.claim, update_id)
+        if not is_new:
+            self.duplicates += 1
+        return is_new
+
+    async def release(self, update_id: int):
+        """Забыть апдейт, который не удалось принять: повторная доставка обработается"""
+        if update_id in self._seen:
+            self._seen.discard(update_id)
+            self._order.remove(update_id)
+        if self.backing is not None:
+            await asyncio.to_thread(self.backing.release, update_id)
+
+    def _remember(self, update_id: int):
+        if len(self._order) >= self.capacity:
+            self._seen.discard(self._order.popleft())
+        self._order.append(update_id)
+        self._seen.add(update_id)
+
+    def __len__(self) -> int:
+        return len(self._order)
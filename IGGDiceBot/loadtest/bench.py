@@ -0,0 +1,224 @@
+"""Микробенчмарки методов Database, PatternManager и SnapshotManager.
+
+Каждый публичный async-метод вызывается многократно против заменителя
+Supabase (loadtest/standins.py), заполненного ростерами разного размера.
+Для каждого метода печатаются p50/p95/p99 времени вызова, число запросов к
+Supabase, строк и байт на вызов (по трассировке dbtrace).
+
+Запуск из папки IGGDiceBot:
+
+    python -m loadtest.bench --sizes 50,500,5000 --iterations 50 --db-latency 0
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+from loadtest.run import percentile
+from loadtest.standins import FAKE_SUPABASE_KEY, Latency, PostgrestStandIn
+
+FIRST_TG_ID = 1000000
+# Идентификаторы, которые создают бенчмарки записи
+NEW_USERS = 5000000
+NEW_ADMINS = 6000000
+NEW_CHATS = -2000000000000
+NEW_ALLIANCES = 1000
+SEEDED_CHATS = tuple(-1000000000000 - number for number in range(20))
+SEEDED_ADMINS = tuple(range(FIRST_TG_ID, FIRST_TG_ID + 5))
+ROLES = ("лидер", "солдат", "участник")
+
+
+class Context:
+    """Данные текущего ростера, из которых бенчмарки берут аргументы"""
+
+    def __init__(self, standin: PostgrestStandIn, size: int, snapshots=None):
+        self.standin = standin
+        self.size = size
+        self.snapshots = snapshots
+
+    def player_id(self, i: int) -> int:
+        return FIRST_TG_ID + i * 7919 % self.size
+
+    def player_name(self, i: int) -> str:
+        return f"Player{i * 7919 % self.size:05d}"
+
+    def fake_ids(self, prefix: str = "") -> List[int]:
+        return [row["id"] for row in self.standin.tables["fake_names"] if row["player_name"].startswith(prefix)]
+
+    def changed_fakes(self, i: int) -> List[Dict[str, Any]]:
+        """Все фиктивные игроки с новой ролью - изменения, как при загрузке ростера"""
+        role = ROLES[i % len(ROLES)]
+        return [{**row, "role": role} for row in self.standin.tables["fake_names"]]
+
+    def pattern_id(self) -> int:
+        return self.standin.tables["table_patterns"][0]["id"]
+
+    def snapshot_id(self) -> int:
+        return self.standin.tables["roster_snapshots"][0]["id"]
+
+
+async def cold_player_index(db):
+    # Из кэша индекс отдается мгновенно - меряем его загрузку
+    db._state().names_loaded = False
+    return await db.player_index()
+
+
+Benchmark = Callable[[Any, Any, int, Context], Awaitable[Any]]
+
+# Бенчмарки в порядке запуска: создающие записи идут раньше удаляющих их
+BENCHMARKS: Dict[str, Benchmark] = {
+    "Database.get_user": lambda db, pm, i, ctx: db.get_user(ctx.player_id(i)),
+    "Database.get_user_by_player_name": lambda db, pm, i, ctx: db.get_user_by_player_name(ctx.player_name(i)),
+    "Database.is_admin": lambda db, pm, i, ctx: db.is_admin(ctx.player_id(i)),
+    "Database.admin_ids": lambda db, pm, i, ctx: db.admin_ids(),
+    "Database.get_all_users": lambda db, pm, i, ctx: db.get_all_users(),
+    "Database.get_roster": lambda db, pm, i, ctx: db.get_roster(),
+    "Database.get_all_fake_names": lambda db, pm, i, ctx: db.get_all_fake_names(),
+    "Database.get_all_players": lambda db, pm, i, ctx: db.get_all_players(),
+    "Database.get_recent_players": lambda db, pm, i, ctx: db.get_recent_players(),
+    "Database.get_leaders": lambda db, pm, i, ctx: db.get_leaders(),
+    "Database.get_soldiers": lambda db, pm, i, ctx: db.get_soldiers(),
+    "Database.get_regular_members": lambda db, pm, i, ctx: db.get_regular_members(),
+    "Database.load_allowed_chats": lambda db, pm, i, ctx: db.load_allowed_chats(),
+    "Database.is_chat_allowed": lambda db, pm, i, ctx: db.is_chat_allowed(SEEDED_CHATS[i % len(SEEDED_CHATS)]),
+    "Database.get_all_allowed_chats": lambda db, pm, i, ctx: db.get_all_allowed_chats(),
+    "Database.load_alliances": lambda db, pm, i, ctx: db.load_alliances(),
+    "Database.load_members": lambda db, pm, i, ctx: db.load_members(),
+    "Database.tenant_registry": lambda db, pm, i, ctx: db.tenant_registry(),
+    "Database.player_index": lambda db, pm, i, ctx: cold_player_index(db),
+    "Database.refresh_state": lambda db, pm, i, ctx: db.refresh_state(),
+    "Database.add_user": lambda db, pm, i, ctx: db.add_user(NEW_USERS + i, f"bench{i}", f"@bench{i}"),
+    "Database.update_user_status": lambda db, pm, i, ctx: db.update_user_status(NEW_USERS + i, "approved"),
+    "Database.update_user_role": lambda db, pm, i, ctx: db.update_user_role(NEW_USERS + i, "солдат"),
+    "Database.update_user_name": lambda db, pm, i, ctx: db.update_user_name(NEW_USERS + i, f"Bench{i}"),
+    "Database.delete_user": lambda db, pm, i, ctx: db.delete_user(NEW_USERS + i),
+    "Database.add_admin": lambda db, pm, i, ctx: db.add_admin(NEW_ADMINS + i, f"admin{i}"),
+    "Database.add_fake_name": lambda db, pm, i, ctx: db.add_fake_name(f"BenchFake{i}"),
+    "Database.update_fake_name_role": lambda db, pm, i, ctx: db.update_fake_name_role(ctx.fake_ids("BenchFake")[i], "лидер"),
+    "Database.update_fake_name": lambda db, pm, i, ctx: db.update_fake_name(ctx.fake_ids("BenchFake")[i], f"BenchFake{i}x"),
+    "Database.delete_fake_name": lambda db, pm, i, ctx: db.delete_fake_name(ctx.fake_ids("BenchFake")[0]),
+    "Database.add_allowed_chat": lambda db, pm, i, ctx: db.add_allowed_chat(NEW_CHATS - i, f"bench {i}"),
+    "Database.remove_allowed_chat": lambda db, pm, i, ctx: db.remove_allowed_chat(NEW_CHATS - i),
+    "Database.import_roster": lambda db, pm, i, ctx: db.import_roster(
+        [{"player_name": f"BenchImport{i}", "role": "участник"}], [], ctx.changed_fakes(i), []
+    ),
+    "Database.add_alliance": lambda db, pm, i, ctx: db.add_alliance(NEW_ALLIANCES + i, f"bench {i}", NEW_CHATS - i, NEW_ADMINS + i),
+    "PatternManager.get_active_pattern": lambda db, pm, i, ctx: pm.get_active_pattern(),
+    "PatternManager.get_all_patterns": lambda db, pm, i, ctx: pm.get_all_patterns(),
+    "PatternManager.set_active_pattern": lambda db, pm, i, ctx: pm.set_active_pattern(ctx.pattern_id()),
+    "PatternManager.create_pattern": lambda db, pm, i, ctx: pm.create_pattern(f"Bench{i}", ["A", "B"], [["a"], ["b"]]),
+    "SnapshotManager.current_snapshot": lambda db, pm, i, ctx: ctx.snapshots.current_snapshot(),
+    "SnapshotManager.take_snapshot": lambda db, pm, i, ctx: ctx.snapshots.take_snapshot(),
+    "SnapshotManager.get_snapshots": lambda db, pm, i, ctx: ctx.snapshots.get_snapshots(),
+    "SnapshotManager.get_snapshot": lambda db, pm, i, ctx: ctx.snapshots.get_snapshot(ctx.snapshot_id()),
+    "SnapshotManager.get_snapshot_before": lambda db, pm, i, ctx: ctx.snapshots.get_snapshot_before(datetime.now(timezone.utc)),
+    "SnapshotManager.prune_snapshots": lambda db, pm, i, ctx: ctx.snapshots.prune_snapshots(),
+}
+
+
+def public_methods(cls) -> List[str]:
+    return [
+        f"{cls.__name__}.{name}" for name, func in vars(cls).items()
+        if not name.startswith("_") and inspect.iscoroutinefunction(func)
+    ]
+
+
+async def measure(name: str, benchmark: Benchmark, db, pm, ctx: Context, iterations: int, warmup: int) -> Dict[str, Any]:
+    import dbtrace
+
+    latencies, round_trips, rows, sizes = [], [], [], []
+    for i in range(warmup + iterations):
+        token = dbtrace.start(None)
+        started = time.perf_counter()
+        try:
+            await benchmark(db, pm, i, ctx)
+        finally:
+            elapsed = time.perf_counter() - started
+            trace = dbtrace.finish(token, budget=0)
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        round_trips.append(len(trace.calls))
+        rows.append(trace.rows)
+        sizes.append(trace.size)
+    return {
+        "size": ctx.size,
+        "method": name,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "round_trips": round(sum(round_trips) / len(round_trips), 2),
+        "rows": round(sum(rows) / len(rows), 1),
+        "bytes": round(sum(sizes) / len(sizes))
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    standin = PostgrestStandIn(Latency(args.db_latency / 1000, args.db_jitter / 1000))
+    url = await standin.start()
+    # config читает окружение при импорте - модули бота импортируются после запуска заменителя
+    os.environ.update(SUPABASE_URL=url, SUPABASE_KEY=FAKE_SUPABASE_KEY, BOT_TOKEN="123456:BENCH",
+                      ADMIN_CHAT_ID="-1", MY_TG_ID=str(SEEDED_ADMINS[0]))
+    from database import Database
+    from Patterns.PatternManager import PatternManager
+    from snapshots import SnapshotManager
+
+    selected = [name for name in BENCHMARKS if not args.only or any(part in name for part in args.only.split(","))]
+    covered = set(BENCHMARKS)
+    uncovered = [name for name in public_methods(Database) + public_methods(PatternManager)
+                 + public_methods(SnapshotManager) if name not in covered]
+
+    results = []
+    try:
+        for size in args.sizes:
+            standin.reset()
+            standin.seed(players=size, fake_players=max(1, size // 10), first_tg_id=FIRST_TG_ID,
+                         admins=SEEDED_ADMINS, chats=SEEDED_CHATS)
+            # Новый экземпляр на каждый размер: кэши не переходят между прогонами
+            db = Database()
+            pm = PatternManager(db)
+            ctx = Context(standin, size, SnapshotManager(db))
+            for name in selected:
+                result = await measure(name, BENCHMARKS[name], db, pm, ctx, args.iterations, args.warmup)
+                results.append(result)
+                if not args.json:
+                    print_row(result)
+    finally:
+        await standin.stop()
+    return {"config": vars(args), "results": results, "uncovered": uncovered}
+
+
+HEADER = f"{'size':>6}  {'method':40}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'trips':>7}{'rows':>8}{'bytes':>10}"
+
+
+def print_row(result: Dict[str, Any]):
+    print(f"{result['size']:>6}  {result['method']:40}{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}"
+          f"{result['round_trips']:>7}{result['rows']:>8}{result['bytes']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Database, PatternManager and SnapshotManager methods against a Supabase stand-in")
+    parser.add_argument("--sizes", type=lambda text: [int(size) for size in text.split(",")], default=[50, 500, 5000],
+                        help="roster sizes, comma-separated")
+    parser.add_argument("--iterations", type=int, default=50, help="measured calls per method")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured calls before measuring")
+    parser.add_argument("--db-latency", type=float, default=0, help="Supabase latency, ms")
+    parser.add_argument("--db-jitter", type=float, default=0, help="extra random Supabase latency, ms")
+    parser.add_argument("--only", default="", help="run only methods whose name contains one of these, comma-separated")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if not args.json:
+        print(HEADER)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif report["uncovered"]:
+        print(f"No benchmark for: {', '.join(report['uncovered'])}")
+
+
+if __name__ == "__main__":
+    main()
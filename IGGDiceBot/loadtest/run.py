@@ -0,0 +1,346 @@
+"""Нагрузочный тест бота без Telegram и Supabase.
+
+Поднимает заменители Bot API и Supabase (loadtest/standins.py), запускает
+приложение из main.py отдельным процессом uvicorn и с заданной частотой
+отправляет в вебхук смесь апдейтов. Задержкой апдейта считается время от
+отправки в вебхук до первого ответа бота в Bot API: для коллбэков - по
+callback_query_id, для сообщений - по чату (каждое сообщение идет в свой
+чат или в чат из большого пула).
+
+Запуск из папки IGGDiceBot:
+
+    python -m loadtest.run --rate 50 --duration 30 --mix nick=70,start=20,approve=5,table=5 \\
+        --db-latency 20 --tg-latency 30
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import aiohttp
+from callbacks import ApproveRegistration
+from loadtest.standins import FakeBotApi, FAKE_SUPABASE_KEY, Latency, PostgrestStandIn
+
+BOT_TOKEN = "123456:LOADTEST"
+OWNER_ID = 1
+ADMIN_CHAT_ID = -1
+# Диапазоны идентификаторов синтетических пользователей и чатов
+NICK_USERS = 1000000
+START_USERS = 2000000
+PENDING_USERS = 3000000
+ADMINS = 4000000
+GROUP_CHATS = -1000000000000
+# Сколько ждать ответа бота после окончания отправки, секунды
+GRACE_PERIOD = 10.0
+APP_START_TIMEOUT = 60.0
+KINDS = ("nick", "start", "approve", "table")
+
+
+def percentile(values: List[float], share: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(share * len(ordered) + 0.5)) - 1))]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown update kind {kind!r}, expected one of {', '.join(KINDS)}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+class Pending:
+    __slots__ = ("kind", "sent_at")
+
+    def __init__(self, kind: str, sent_at: float):
+        self.kind = kind
+        self.sent_at = sent_at
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.mix = args.mix
+        self.users = itertools.count()
+        self.update_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        # Ожидающие ответа апдейты: по callback_query_id и по чату (в порядке отправки)
+        self.by_callback: Dict[str, Pending] = {}
+        self.by_chat: Dict[int, Deque[Pending]] = defaultdict(deque)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.ack_latencies: List[float] = []
+        self.sent: Dict[str, int] = defaultdict(int)
+        self.webhook_errors: Dict[str, int] = defaultdict(int)
+        self.throttled = 0
+        self.db = PostgrestStandIn(Latency(args.db_latency / 1000, args.db_jitter / 1000))
+        self.telegram = FakeBotApi(Latency(args.tg_latency / 1000, args.tg_jitter / 1000), on_call=self.on_bot_call)
+
+    # Сопоставление ответов бота с апдейтами
+
+    def on_bot_call(self, method: str, params: Dict[str, str]):
+        now = time.perf_counter()
+        text = params.get("text", "")
+        if "Слишком много запросов" in text:
+            self.throttled += 1
+        pending = None
+        callback_id = params.get("callback_query_id")
+        if callback_id is not None:
+            pending = self.by_callback.pop(callback_id, None)
+        else:
+            chat_id = params.get("chat_id")
+            queue = self.by_chat.get(int(chat_id)) if chat_id and chat_id.lstrip("-").isdigit() else None
+            if queue:
+                pending = queue.popleft()
+        if pending is not None:
+            self.latencies[pending.kind].append(now - pending.sent_at)
+
+    # Синтетические апдейты
+
+    def _message(self, user_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+        return {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": 1, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"user{user_id}"}
+            }
+        }
+
+    def _callback(self, user_id: int, data: str) -> Tuple[Dict[str, Any], str]:
+        callback_id = str(next(self.callback_ids))
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": callback_id, "chat_instance": "loadtest", "data": data,
+                "from": {"id": user_id, "is_bot": False, "first_name": "Admin", "username": f"admin{user_id}"},
+                "message": {"message_id": 1, "date": int(time.time()), "text": "menu",
+                            "chat": {"id": user_id, "type": "private"}}
+            }
+        }, callback_id
+
+    def make_update(self, kind: str) -> Tuple[Dict[str, Any], Optional[str], Optional[int]]:
+        """Апдейт и ключ, по которому ждать ответ: (update, callback_query_id, chat_id)"""
+        number = next(self.users)
+        if kind == "nick":
+            # Часть ников меняют существующие игроки, часть - новые
+            user_id = NICK_USERS + (number % self.args.players if random.random() < 0.7 else self.args.players + number)
+            chat_id = GROUP_CHATS - number % self.args.chats
+            return self._message(user_id, chat_id, f"+NICK Player{number}"), None, chat_id
+        if kind == "start":
+            user_id = START_USERS + number
+            return self._message(user_id, user_id, "/start"), None, user_id
+        admin_id = ADMINS + number % self.args.admins
+        if kind == "approve":
+            update, callback_id = self._callback(admin_id, ApproveRegistration(PENDING_USERS + number % self.args.pending).pack())
+        else:
+            update, callback_id = self._callback(admin_id, "view_table")
+        return update, callback_id, None
+
+    # Запуск
+
+    def app_env(self, port: int, runtime_dir: str) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update(
+            SUPABASE_URL=self.db.url, SUPABASE_KEY=FAKE_SUPABASE_KEY,
+            BOT_TOKEN=BOT_TOKEN, ADMIN_CHAT_ID=str(ADMIN_CHAT_ID), MY_TG_ID=str(OWNER_ID),
+            TELEGRAM_API_URL=self.telegram.url, WEBHOOK_URL=f"http://127.0.0.1:{port}",
+            FSM_STORAGE_PATH="", RUNTIME_DIR=runtime_dir, WEB_CONCURRENCY=str(self.args.workers),
+            LOG_LEVEL=self.args.log_level
+        )
+        return env
+
+    async def start_app(self, port: int, runtime_dir: str) -> asyncio.subprocess.Process:
+        app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(self.args.workers), "--log-level", "warning",
+            cwd=app_dir, env=self.app_env(port, runtime_dir)
+        )
+        deadline = time.monotonic() + APP_START_TIMEOUT
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if process.returncode is not None:
+                    raise RuntimeError(f"Bot process exited with code {process.returncode}")
+                try:
+                    async with session.get(f"http://127.0.0.1:{port}/health") as response:
+                        if response.status == 200:
+                            return process
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        process.terminate()
+        raise RuntimeError("Bot did not start in time")
+
+    async def send(self, session: aiohttp.ClientSession, url: str, kind: str):
+        update, callback_id, chat_id = self.make_update(kind)
+        pending = Pending(kind, time.perf_counter())
+        if callback_id is not None:
+            self.by_callback[callback_id] = pending
+        else:
+            self.by_chat[chat_id].append(pending)
+        self.sent[kind] += 1
+        try:
+            async with session.post(url, json=update) as response:
+                await response.read()
+                ok = response.status == 200
+        except aiohttp.ClientError:
+            ok = False
+        self.ack_latencies.append(time.perf_counter() - pending.sent_at)
+        if not ok:
+            self.webhook_errors[kind] += 1
+            # Отклоненный апдейт ответа не получит
+            if callback_id is not None:
+                self.by_callback.pop(callback_id, None)
+            elif pending in self.by_chat[chat_id]:
+                self.by_chat[chat_id].remove(pending)
+
+    async def fire(self, port: int) -> float:
+        """Отправлять апдейты с постоянной частотой (открытая модель нагрузки)"""
+        url = f"http://127.0.0.1:{port}/webhook/{BOT_TOKEN}"
+        kinds, weights = zip(*self.mix.items())
+        interval = 1 / self.args.rate
+        total = int(self.args.rate * self.args.duration)
+        tasks = set()
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started = time.perf_counter()
+            for number in range(total):
+                delay = started + number * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                task = asyncio.create_task(self.send(session, url, random.choices(kinds, weights)[0]))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+
+            # Ждем оставшиеся ответы
+            deadline = time.perf_counter() + GRACE_PERIOD
+            while (self.by_callback or any(self.by_chat.values())) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+            async with session.get(f"http://127.0.0.1:{port}/health") as response:
+                self.health = await response.json()
+        return elapsed
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        self.db.seed(
+            players=args.players, fake_players=args.fake_players, first_tg_id=NICK_USERS,
+            admins=tuple([OWNER_ID] + [ADMINS + number for number in range(args.admins)]),
+            chats=tuple(GROUP_CHATS - number for number in range(args.chats)),
+            pending=tuple(PENDING_USERS + number for number in range(args.pending))
+        )
+        await self.db.start()
+        await self.telegram.start()
+        port = args.port or _free_port()
+        with tempfile.TemporaryDirectory(prefix="iggdicebot-loadtest-") as runtime_dir:
+            process = await self.start_app(port, runtime_dir)
+            try:
+                elapsed = await self.fire(port)
+            finally:
+                process.send_signal(signal.SIGINT)
+                try:
+                    await asyncio.wait_for(process.wait(), 30)
+                except asyncio.TimeoutError:
+                    process.kill()
+                await self.telegram.stop()
+                await self.db.stop()
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        def summary(values: List[float]) -> Dict[str, float]:
+            return {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+                "max_ms": round(max(values) * 1000, 1) if values else 0.0
+            }
+
+        answered = [value for values in self.latencies.values() for value in values]
+        sent = sum(self.sent.values())
+        errors = sum(self.webhook_errors.values())
+        return {
+            "config": vars(self.args),
+            "sent": sent,
+            "offered_rate": round(sent / elapsed, 1) if elapsed else 0.0,
+            "throughput": round(len(answered) / elapsed, 1) if elapsed else 0.0,
+            "webhook_errors": errors,
+            "unanswered": sent - errors - len(answered),
+            "throttled_replies": self.throttled,
+            "webhook_ack": summary(self.ack_latencies),
+            "end_to_end": summary(answered),
+            "by_kind": {
+                kind: dict(summary(self.latencies[kind]), sent=self.sent[kind], webhook_errors=self.webhook_errors[kind])
+                for kind in self.sent
+            },
+            "supabase_requests": self.db.requests,
+            "supabase_bytes": self.db.bytes_sent,
+            "bot_api_calls": dict(sorted(self.telegram.calls.items())),
+            "bot_health": getattr(self, "health", None)
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"Sent {report['sent']} updates at {report['offered_rate']}/s, "
+          f"answered {report['end_to_end']['count']} ({report['throughput']}/s)")
+    print(f"Webhook errors: {report['webhook_errors']}, unanswered: {report['unanswered']}, "
+          f"throttled replies: {report['throttled_replies']}")
+    print(f"Supabase requests: {report['supabase_requests']} ({report['supabase_bytes']} bytes), "
+          f"Bot API calls: {sum(report['bot_api_calls'].values())}")
+    print(f"{'':12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [("webhook ack", report["webhook_ack"]), ("end-to-end", report["end_to_end"])]
+    rows += sorted(report["by_kind"].items())
+    for name, stats in rows:
+        print(f"{name:12}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot against local Telegram and Supabase stand-ins")
+    parser.add_argument("--rate", type=float, default=20, help="updates per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("nick=70,start=20,approve=5,table=5"),
+                        help="update mix as kind=weight pairs: nick, start, approve, table")
+    parser.add_argument("--players", type=int, default=500, help="seeded Telegram players")
+    parser.add_argument("--fake-players", type=int, default=50, help="seeded fake players")
+    parser.add_argument("--admins", type=int, default=200, help="admins pressing approve/view_table")
+    parser.add_argument("--chats", type=int, default=200, help="allowed group chats for +NICK")
+    parser.add_argument("--pending", type=int, default=1000, help="pending registrations to approve")
+    parser.add_argument("--db-latency", type=float, default=20, help="Supabase latency, ms")
+    parser.add_argument("--db-jitter", type=float, default=10, help="extra random Supabase latency, ms")
+    parser.add_argument("--tg-latency", type=float, default=30, help="Bot API latency, ms")
+    parser.add_argument("--tg-jitter", type=float, default=20, help="extra random Bot API latency, ms")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--port", type=int, default=0, help="port for the bot (default: any free port)")
+    parser.add_argument("--log-level", default="WARNING", help="bot log level")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadTest(args).run())
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
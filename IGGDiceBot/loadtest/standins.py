@@ -0,0 +1,325 @@
+"""Локальные заменители внешних сервисов для нагрузочных тестов и бенчмарков.
+
+PostgrestStandIn отвечает на запросы supabase-py к /rest/v1/<таблица>
+(фильтры eq/neq/gt/gte/lt/lte/like/ilike/in/is, select, order, limit, offset,
+upsert), FakeBotApi - на вызовы Bot API. Оба умеют добавлять задержку к
+каждому ответу и считают запросы и переданные байты.
+"""
+import asyncio
+import json
+import random
+import re
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+from aiohttp import web
+
+# Таблицы бота и их первичные ключи
+TABLES = {
+    "users": "tg_id",
+    "admins": "tg_id",
+    "fake_names": "id",
+    "allowed_chats": "chat_id",
+    "table_patterns": "id",
+    "roster_snapshots": "id",
+    "alliances": "id"
+}
+# Таблицы, разделенные по альянсам; столбец alliance_id по умолчанию - как в миграции из README
+ALLIANCE_TABLES = {"users", "admins", "fake_names", "allowed_chats", "table_patterns", "roster_snapshots"}
+DEFAULT_ALLIANCE_ID = 1
+# Ключ, который принимает любой supabase-py: JWT с пустым payload
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.e30.standin"
+ROLES = ("лидер", "солдат", "участник")
+
+
+class Latency:
+    """Задержка ответа: `base` секунд плюс равномерный разброс до `jitter`"""
+
+    def __init__(self, base: float = 0.0, jitter: float = 0.0):
+        self.base = base
+        self.jitter = jitter
+
+    async def wait(self):
+        delay = self.base + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _Server:
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _json(self, payload: Any, status: int = 200) -> web.Response:
+        body = json.dumps(payload, ensure_ascii=False, default=str)
+        self.bytes_sent += len(body.encode())
+        return web.Response(text=body, status=status, content_type="application/json")
+
+
+class PostgrestStandIn(_Server):
+    """PostgREST-совместимый заменитель Supabase для таблиц бота"""
+
+    def __init__(self, latency: Optional[Latency] = None):
+        super().__init__(latency)
+        self.tables: Dict[str, List[Dict[str, Any]]] = {name: [] for name in TABLES}
+        self._next_id: Dict[str, int] = {name: 1 for name in TABLES}
+        self.by_table: Dict[Tuple[str, str], int] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/rest/v1/{table}", self._handle)
+        return app
+
+    # Наполнение данными
+
+    def reset(self):
+        """Очистить таблицы и счетчики"""
+        self.tables = {name: [] for name in TABLES}
+        self._next_id = {name: 1 for name in TABLES}
+        self.by_table = {}
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def seed(self, players: int = 100, fake_players: int = 20, admins: Tuple[int, ...] = (),
+             chats: Tuple[int, ...] = (), pending: Tuple[int, ...] = (), first_tg_id: int = 1000000,
+             alliance_id: int = DEFAULT_ALLIANCE_ID):
+        """Заполнить таблицы альянса `alliance_id`: `players` игроков Telegram (tg_id с `first_tg_id`),
+        фиктивных игроков, админов, разрешенные чаты, заявки и активный паттерн"""
+        now = datetime.utcnow()
+        scope = {"alliance_id": alliance_id}
+        for number in range(players):
+            tg_id = first_tg_id + number
+            self.insert("users", {**scope, **self._user(tg_id, f"Player{number:05d}", "approved",
+                                                        ROLES[number % len(ROLES)], now - timedelta(hours=number % 72))})
+        for tg_id in pending:
+            self.insert("users", {**scope, **self._user(tg_id, "П У С Т О", "pending", "участник", now)})
+        for number in range(fake_players):
+            self.insert("fake_names", {
+                **scope, "username": "Фиктивный игрок", "tag": "без Telegram", "status": "approved",
+                "player_name": f"Fake{number:05d}", "role": ROLES[number % len(ROLES)],
+                "created_at": now.isoformat(), "updated_at": (now - timedelta(hours=number % 72)).isoformat()
+            })
+        for tg_id in admins:
+            self.insert("admins", {**scope, "tg_id": tg_id, "username": f"admin{tg_id}"})
+            if not self._find("users", "tg_id", tg_id):
+                self.insert("users", {**scope, **self._user(tg_id, f"Admin{tg_id}", "approved", "лидер", now)})
+        for chat_id in chats:
+            self.insert("allowed_chats", {**scope, "chat_id": chat_id, "chat_title": f"chat {chat_id}"})
+        self.insert("table_patterns", {
+            **scope, "pattern_name": "Load test", "pattern_elements": "Player,Fake,Admin",
+            "pattern_mas_elements": json.dumps([["player"], ["fake"], ["admin"]]),
+            "status": "Active", "created_at": now.isoformat()
+        })
+
+    @staticmethod
+    def _user(tg_id: int, player_name: str, status: str, role: str, updated_at: datetime) -> Dict[str, Any]:
+        return {
+            "tg_id": tg_id, "username": f"user{tg_id}", "tag": f"@user{tg_id}", "status": status,
+            "player_name": player_name, "role": role,
+            "created_at": updated_at.isoformat(), "updated_at": updated_at.isoformat()
+        }
+
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(row)
+        key = TABLES[table]
+        if key == "id" and "id" not in row:
+            row["id"] = self._next_id[table]
+            self._next_id[table] += 1
+        row.setdefault("created_at", datetime.utcnow().isoformat())
+        if table in ALLIANCE_TABLES:
+            row.setdefault("alliance_id", DEFAULT_ALLIANCE_ID)
+        self.tables[table].append(row)
+        return row
+
+    def _find(self, table: str, column: str, value: Any) -> List[Dict[str, Any]]:
+        return [row for row in self.tables[table] if row.get(column) == value]
+
+    # Разбор запроса PostgREST
+
+    @staticmethod
+    def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+        negate = expression.startswith("not.")
+        if negate:
+            expression = expression[4:]
+        operator, _, operand = expression.partition(".")
+        value = row.get(column)
+        text = "" if value is None else str(value)
+        if operator == "eq":
+            result = text == operand
+        elif operator == "neq":
+            result = text != operand
+        elif operator in ("gt", "gte", "lt", "lte"):
+            left, right = _comparable(value, operand)
+            result = {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[operator] \
+                if value is not None else False
+        elif operator in ("like", "ilike"):
+            pattern = operand.replace("*", "%")
+            result = _like(text, pattern, operator == "ilike")
+        elif operator == "in":
+            result = text in [item.strip('"') for item in operand.strip("()").split(",")]
+        elif operator == "is":
+            result = value is None if operand == "null" else text.lower() == operand
+        else:
+            raise ValueError(f"Unsupported operator {operator!r}")
+        return not result if negate else result
+
+    def _filter(self, table: str, params) -> List[Dict[str, Any]]:
+        rows = self.tables[table]
+        for column, expression in params.items():
+            if column in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            rows = [row for row in rows if self._matches(row, column, expression)]
+        return rows
+
+    @staticmethod
+    def _shape(rows: List[Dict[str, Any]], params) -> List[Dict[str, Any]]:
+        for order in reversed(params.get("order", "").split(",") if params.get("order") else []):
+            column, _, direction = order.partition(".")
+            rows = sorted(rows, key=lambda row: (row.get(column) is None, str(row.get(column, ""))),
+                          reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", 0))
+        limit = params.get("limit")
+        rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+        select = unquote(params.get("select", "*"))
+        if select != "*":
+            columns = [column.strip() for column in select.split(",")]
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return rows
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        self.requests += 1
+        table = request.match_info["table"]
+        if table not in self.tables:
+            return self._json({"message": f"relation {table} does not exist"}, status=404)
+        self.by_table[(table, request.method)] = self.by_table.get((table, request.method), 0) + 1
+        params = request.query
+
+        if request.method == "GET":
+            return self._json(self._shape(self._filter(table, params), params))
+
+        if request.method == "POST":
+            payload = await request.json()
+            rows = payload if isinstance(payload, list) else [payload]
+            upsert = "merge-duplicates" in request.headers.get("Prefer", "")
+            key = params.get("on_conflict") or TABLES[table]
+            result = []
+            for row in rows:
+                existing = self._find(table, key, row.get(key)) if upsert and key in row else []
+                if existing:
+                    existing[0].update(row)
+                    result.append(existing[0])
+                else:
+                    result.append(self.insert(table, row))
+            return self._json(self._shape(result, {"select": params.get("select", "*")}), status=201)
+
+        if request.method == "PATCH":
+            changes = {key: (datetime.utcnow().isoformat() if value == "now()" else value)
+                       for key, value in (await request.json()).items()}
+            rows = self._filter(table, params)
+            for row in rows:
+                row.update(changes)
+            return self._json(rows)
+
+        if request.method == "DELETE":
+            rows = self._filter(table, params)
+            ids = {id(row) for row in rows}
+            self.tables[table] = [row for row in self.tables[table] if id(row) not in ids]
+            return self._json(rows)
+
+        return self._json({"message": "method not allowed"}, status=405)
+
+
+def _comparable(value: Any, operand: str):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value, float(operand)
+    return str(value), operand
+
+
+def _like(text: str, pattern: str, case_insensitive: bool) -> bool:
+    regex = "^" + ".*".join(re.escape(part) for part in pattern.split("%")) + "$"
+    return re.match(regex, text, re.IGNORECASE if case_insensitive else 0) is not None
+
+
+# Методы Bot API, которые возвращают Message
+MESSAGE_METHODS = {
+    "sendmessage", "sendphoto", "senddocument", "editmessagetext", "editmessagereplymarkup", "editmessagecaption"
+}
+
+
+class FakeBotApi(_Server):
+    """Заменитель Bot API: принимает любые методы и отвечает правдоподобными объектами.
+
+    `on_call(method, params)` вызывается для каждого запроса - по нему
+    нагрузочный тест сопоставляет ответы бота с отправленными апдейтами.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, on_call: Optional[Callable[[str, Dict[str, str]], None]] = None):
+        super().__init__(latency)
+        self.on_call = on_call
+        self.calls: Dict[str, int] = {}
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        return app
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = {key: str(value) for key, value in (await request.json()).items()}
+        else:
+            params = {key: value for key, value in (await request.post()).items() if isinstance(value, str)}
+        if method == "getupdates":
+            # Бот под нагрузочным тестом работает через вебхук
+            await asyncio.sleep(min(float(params.get("timeout", 0)), 1.0))
+            return self._json({"ok": True, "result": []})
+
+        await self.latency.wait()
+        self.requests += 1
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.on_call is not None:
+            self.on_call(method, params)
+        return self._json({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method: str, params: Dict[str, str]) -> Any:
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "Load test bot", "username": "loadtest_bot"}
+        if method == "getchat":
+            return _chat(int(params.get("chat_id", 0)))
+        if method in MESSAGE_METHODS:
+            self._message_id += 1
+            return {
+                "message_id": self._message_id,
+                "date": int(datetime.utcnow().timestamp()),
+                "chat": _chat(int(params.get("chat_id", 0) or 0)),
+                "text": params.get("text", "")
+            }
+        return True
+
+
+def _chat(chat_id: int) -> Dict[str, Any]:
+    if chat_id < 0:
+        return {"id": chat_id, "type": "supergroup", "title": f"chat {chat_id}"}
+    return {"id": chat_id, "type": "private", "username": f"user{chat_id}", "first_name": "user"}
@@ -0,0 +1,146 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE
+
+# Поля контекста апдейта, которые попадают в каждую запись
+CONTEXT_FIELDS = ("update_id", "chat_id", "alliance_id", "handler", "latency_ms")
+# Стандартные атрибуты LogRecord - все остальное считается переданным через extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("log_context", default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"iggdicebot.{name}")
+
+
+def bind(**fields) -> Any:
+    """Начать контекст апдейта; вернуть токен для `unbind`"""
+    return _context.set(dict(fields))
+
+
+def unbind(token):
+    _context.reset(token)
+
+
+def update_context(**fields):
+    """Дополнить контекст текущего апдейта (например, именем хендлера)"""
+    context = _context.get()
+    if context is not None:
+        context.update(fields)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи поля контекста апдейта"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field) if context else None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает лишь долю частых записей.
+
+    Запись считается частой, если передана с `extra={"sample": True}`;
+    предупреждения и ошибки не отбрасываются никогда.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sample", False) or record.levelno >= logging.WARNING:
+            return True
+        if random.random() < self.rate:
+            record.sample_rate = self.rate
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and value is not None
+        )
+        return f"{line} [{fields}]" if fields else line
+
+
+sampling = SamplingFilter(LOG_SAMPLE_RATE)
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Настроить логирование через очередь: запись в stdout идет в отдельном потоке.
+
+    Обработчик-очередь на корневом логгере только кладет запись в очередь,
+    поэтому event loop не ждет вывода. Контекст апдейта и выборка применяются
+    до постановки в очередь, пока запись еще в нужном контексте.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    records: queue.Queue = queue.Queue(-1)
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(sampling)
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+    # Логи доступа uvicorn идут через тот же обработчик
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    # aiogram пишет строку на каждый апдейт; ее заменяет выборочная запись LogContextMiddleware
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Дописать оставшиеся записи и остановить поток вывода"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
@@ -1,72 +1,215 @@
-from fastapi import FastAPI, Request, HTTPException
-from contextlib import asynccontextmanager
-import uvicorn
-from bot import bot, dp, db
-from config import BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, MY_TG_ID
+import startup
+from logs import setup_logging, shutdown_logging, get_logger
+
+# Логи пишутся из фонового потока; настраиваются раньше, чем кто-либо начнет логировать
+setup_logging()
+log = get_logger("main")
+
+with startup.measure_import("fastapi"):
+    from fastapi import FastAPI, Request, HTTPException
+    from fastapi.responses import PlainTextResponse
+    from contextlib import asynccontextmanager
+    import uvicorn
+with startup.measure_import("bot"):
+    from bot import bot, dp, db, group_prefilter, outbound
+from Patterns.TableRenderer import TableRenderer
+from update_queue import UpdateQueue
+from polling import Poller
+from fsm_storage import SQLiteStorage
+from ledger import UpdateLedger
+from scheduler import scheduler
+import tenants
+from snapshots import SnapshotManager
+import warm_state
+from http_client import get_http_session, close_http_session
+from config import WEBHOOK_URL, WEBHOOK_PATH, MY_TG_ID, WORKERS, UPDATE_LEDGER_PERSISTENT, SNAPSHOT_CRON
+from config import WARM_STATE_PATH, WARM_STATE_INTERVAL
+from workers import leader_lock, broadcast, update_claims
+from metrics import registry
 import asyncio
-import threading
+import os
 import time
-import requests
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup
+# Интервал пинга, чтобы Render не усыплял приложение, секунды
+KEEP_AWAKE_INTERVAL = 600
+
+# Как часто воркер без блокировки лидера пытается ее получить, секунды
+LEADER_RETRY_INTERVAL = 30
+
+async def set_up_webhook():
     if WEBHOOK_URL:
         webhook_url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
-        await bot.set_webhook(webhook_url)
-        print(f"✅ Webhook set to: {webhook_url}")
+        await bot.set_webhook(webhook_url, allowed_updates=dp.resolve_used_update_types())
+        log.info("Webhook set to %s", webhook_url)
     else:
         await bot.delete_webhook()
-        print("✅ Webhook deleted - using polling")
-    
-    # Add yourself as admin and user if not exists
+        log.info("Webhook deleted - using polling")
+        poller.start()
+
+async def bootstrap_owner():
+    """Добавить владельца в админы и игроки, если его еще нет"""
     my_tg_id = int(MY_TG_ID)
     if not await db.is_admin(my_tg_id):
         try:
             my_chat = await bot.get_chat(my_tg_id)
             username = my_chat.username or "Владелец"
             if await db.add_admin(my_tg_id, username):
-                print("✅ Owner added as admin and user")
+                log.info("Owner added as admin and user")
             else:
-                print("❌ Failed to add owner as admin")
+                log.error("Failed to add owner as admin")
         except Exception as e:
-            print(f"Error adding owner: {e}")
+            log.exception("Error adding owner: %s", e)
+
+async def run_leader_tasks():
+    """Задачи, которые выполняются один раз на деплой, а не в каждом воркере"""
+    results = await asyncio.gather(set_up_webhook(), bootstrap_owner(), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            log.error("Startup task failed: %s", result, exc_info=result)
+    startup.mark("leader_tasks_done")
     
-    # Start background task to keep Render awake
+    # Пинг раз в 10 минут, чтобы Render не усыплял приложение
     if WEBHOOK_URL:
-        threading.Thread(target=keep_awake, daemon=True).start()
-        print("✅ Background keep-awake task started")
+        scheduler.every("keep_awake", KEEP_AWAKE_INTERVAL, keep_awake, jitter=30)
+        log.info("Background keep-awake job scheduled")
+    
+    # Одного снимка на деплой достаточно, поэтому его планирует только лидер
+    if SNAPSHOT_CRON:
+        scheduler.cron("roster_snapshot", SNAPSHOT_CRON, snapshot_roster, jitter=60)
+    
+    # База у воркеров общая, поэтому файла горячего состояния хватает одного
+    if WARM_STATE_PATH:
+        scheduler.every("warm_state", WARM_STATE_INTERVAL, save_warm_state, jitter=30)
+
+async def wait_for_leadership():
+    """Забрать роль лидера, если текущий лидер завершится"""
+    while not leader_lock.try_acquire():
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+    log.info("Worker %s became leader", os.getpid())
+    await run_leader_tasks()
+
+async def warm_up_renderer():
+    try:
+        await asyncio.to_thread(TableRenderer.warm_up)
+        startup.mark("renderer_warm")
+    except Exception as e:
+        log.exception("Renderer warm-up failed: %s", e)
+
+async def validate_warm_state():
+    try:
+        await warm_state.validate(db)
+    except Exception as e:
+        log.exception("Warm state validation failed: %s", e)
+    startup.mark("warm_state_validated")
+
+async def save_warm_state():
+    await warm_state.save(db, WARM_STATE_PATH)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Запуск
+    outbound.start()
+    update_queue.start()
+    scheduler.start()
+    
+    # Воркеры сообщают друг другу о сбросе кэшей и состояний FSM через локальный канал
+    if WORKERS > 1:
+        await broadcast.start()
+        db.attach_broadcast(broadcast)
+        if isinstance(dp.storage, SQLiteStorage):
+            dp.storage.attach_broadcast(broadcast)
+    
+    # Кэши, сохраненные прошлым запуском, сразу обслуживают апдейты, а ниже сверяются с базой
+    warm = bool(WARM_STATE_PATH) and warm_state.load(db, WARM_STATE_PATH)
+    if warm:
+        startup.mark("warm_state_loaded")
     
-    print("✅ Bot started successfully")
+    # Стартовый I/O идет в фоне, чтобы не задерживать первый апдейт: альянсы
+    # и разрешенные чаты загружаются при первой проверке, рендерер прогревается в потоке
+    background = [
+        asyncio.create_task(warm_up_renderer()),
+        asyncio.create_task(validate_warm_state() if warm else db.tenant_registry()),
+        asyncio.create_task(db.player_index()),
+        asyncio.create_task(run_leader_tasks() if leader_lock.try_acquire() else wait_for_leadership())
+    ]
+    
+    startup.mark("lifespan_ready")
+    log.info("Bot started successfully", extra={"worker": os.getpid(), "leader": leader_lock.acquired})
     yield
     
-    # Shutdown
+    # Остановка
+    for task in background:
+        task.cancel()
+    await poller.stop()
+    await scheduler.stop()
+    await update_queue.stop()
+    await outbound.stop()
+    if WARM_STATE_PATH and leader_lock.acquired:
+        try:
+            await save_warm_state()
+        except Exception as e:
+            log.exception("Saving warm state failed: %s", e)
+    await dp.storage.close()
     await bot.session.close()
+    await close_http_session()
+    leader_lock.release()
+    broadcast.close()
+    shutdown_logging()
 
 app = FastAPI(lifespan=lifespan)
+update_queue = UpdateQueue(bot, dp)
+poller = Poller(bot, dp, update_queue)
 
-def keep_awake():
-    """Ping the app every 10 minutes to keep Render awake"""
-    while True:
-        try:
-            if WEBHOOK_URL:
-                response = requests.get(WEBHOOK_URL)
-                print(f"🔄 Keep-alive ping: {response.status_code}")
-            time.sleep(600)  # 10 minutes
-        except Exception as e:
-            print(f"❌ Keep-alive error: {e}")
-            time.sleep(60)
+registry.gauge("bot_updates_in_flight", "Updates being handled right now", function=lambda: update_queue.in_flight)
+registry.gauge("bot_update_queue_depth", "Updates waiting in the queue", function=lambda: update_queue.queue.qsize())
+registry.counter("bot_updates_processed_total", "Updates handled since start", function=lambda: update_queue.processed)
+registry.counter("bot_updates_failed_total", "Updates whose handler raised", function=lambda: update_queue.failed)
+registry.counter("bot_updates_dropped_total", "Group messages dropped by the pre-filter", function=lambda: group_prefilter.dropped)
+registry.counter("bot_updates_duplicate_total", "Redelivered updates dropped by the ledger", function=lambda: update_ledger.duplicates)
+registry.gauge("bot_outbound_queue_depth", "Outbound messages waiting to be sent", function=lambda: outbound.queue.qsize())
+# Общая таблица заявок - постоянное хранилище журнала и распределение апдейтов между воркерами
+update_ledger = UpdateLedger(backing=update_claims if WORKERS > 1 or UPDATE_LEDGER_PERSISTENT else None)
+
+async def keep_awake():
+    """Пинг приложения, чтобы Render его не усыплял"""
+    async with get_http_session().get(WEBHOOK_URL) as response:
+        log.info("Keep-alive ping: %s", response.status, extra={"sample": True})
+
+async def snapshot_roster():
+    """Сохранить снимок ростера каждого альянса и удалить снимки вне правил хранения"""
+    snapshots = SnapshotManager(db)
+    registry = await db.tenant_registry()
+    for tenant in registry.all():
+        with tenants.scope(tenant):
+            await snapshots.take_snapshot()
+            removed = await snapshots.prune_snapshots()
+        if removed:
+            log.info("Pruned %s roster snapshots", removed, extra={"alliance_id": tenant.alliance_id})
 
 @app.post(WEBHOOK_PATH)
 async def bot_webhook(request: Request):
     try:
         update = await request.json()
-        # Правильный способ обработки вебхука в aiogram 3.x
-        await dp.feed_webhook_update(bot, update)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        raise HTTPException(status_code=400, detail="Not a Telegram update")
+    
+    # Очередь заполнена: Telegram доставит апдейт повторно позже
+    if update_queue.full():
+        update_queue.rejected += 1
+        raise HTTPException(status_code=503, detail="Update queue is full")
+    
+    # Повторные доставки подтверждаются и отбрасываются
+    if not await update_ledger.register(update["update_id"]):
         return {"status": "ok"}
-    except Exception as e:
-        print(f"Webhook error: {e}")
-        return {"error": str(e)}, 400
+    
+    # Отвечаем сразу, обработчики работают в фоне; очередь могла
+    # заполниться, пока записывалась заявка
+    if not update_queue.offer(update):
+        await update_ledger.release(update["update_id"])
+        raise HTTPException(status_code=503, detail="Update queue is full")
+    return {"status": "ok"}
 
 @app.get("/")
 async def root():
@@ -78,14 +221,31 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": time.time()}
+    return {
+        "status": "healthy",
+        "timestamp": time.time(),
+        "worker": os.getpid(),
+        "leader": leader_lock.acquired,
+        "dropped_updates": group_prefilter.dropped,
+        "updates": update_queue.metrics(),
+        "polling": {"running": poller.running, "received": poller.received},
+        "duplicate_updates": update_ledger.duplicates,
+        "outbound": outbound.metrics(),
+        "jobs": scheduler.metrics(),
+        "startup": startup.report()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/set_webhook")
 async def set_webhook():
     """Ручная установка вебхука"""
     if WEBHOOK_URL:
         webhook_url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
-        result = await bot.set_webhook(webhook_url)
+        result = await bot.set_webhook(webhook_url, allowed_updates=dp.resolve_used_update_types())
         return {"status": "webhook_set", "url": webhook_url, "result": result}
     return {"status": "no_webhook_url"}
 
@@ -96,4 +256,5 @@ async def delete_webhook():
     return {"status": "webhook_deleted", "result": result}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # При WEB_CONCURRENCY > 1 uvicorn нужна строка импорта приложения
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS, log_config=None)
\ No newline at end of file
@@ -0,0 +1,190 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Счетчик; `function` позволяет отдавать значение уже существующего счетчика объекта"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.function = function
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """Значение задается через set/inc/dec или вычисляется функцией при выдаче метрик"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.function = function
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # На каждый набор меток: счетчики по корзинам (последняя - +Inf), сумма
+        self.series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        self.observe_key(self._key(labels), value)
+
+    def observe_key(self, key: LabelValues, value: float):
+        """observe с заранее собранным ключом меток - для горячих путей"""
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.label_names, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, documentation, labels, function))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_SECONDS = registry.histogram("bot_handler_seconds", "aiogram handler latency", ["handler"])
+HANDLER_ERRORS = registry.counter("bot_handler_errors_total", "aiogram handler exceptions", ["handler"])
+DB_SECONDS = registry.histogram("bot_db_method_seconds", "Database method latency", ["method"])
+DB_ERRORS = registry.counter("bot_db_errors_total", "Failed Supabase requests")
+PATTERN_SECONDS = registry.histogram("bot_pattern_method_seconds", "PatternManager method latency", ["method"])
+SNAPSHOT_SECONDS = registry.histogram("bot_snapshot_method_seconds", "SnapshotManager method latency", ["method"])
+RENDER_SECONDS = registry.histogram("bot_render_phase_seconds", "TableRenderer phase latency", ["phase"])
+TELEGRAM_SECONDS = registry.histogram("bot_telegram_api_seconds", "Outbound Telegram Bot API call latency", ["method"])
+TELEGRAM_ERRORS = registry.counter("bot_telegram_api_errors_total", "Failed Telegram Bot API calls", ["method"])
+THROTTLED = registry.counter("bot_throttled_actions_total", "Actions rejected by the per-user/per-chat rate limit", ["handler"])
+
+
+def instrument_methods(cls, histogram: Histogram, label: str = "method"):
+    """Обернуть публичные async-методы класса замером времени в `histogram`"""
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, _timed(func, histogram, {label: name}))
+    return cls
+
+
+def _timed(func, histogram: Histogram, labels: Dict[str, str]):
+    key = histogram._key(labels)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe_key(key, time.perf_counter() - started)
+
+    return wrapper
@@ -0,0 +1,366 @@
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+from callbacks import ADMIN, OWNER, CallbackTable, OutdatedCallback, Route
+from database import Database
+import dbtrace
+from fsm_storage import DialogTracking
+import logs
+from metrics import HANDLER_SECONDS, HANDLER_ERRORS, TELEGRAM_SECONDS, TELEGRAM_ERRORS, THROTTLED
+from ratelimit import KeyedBuckets, worker_share
+import tenants
+
+log = logs.get_logger("middlewares")
+
+# Префиксы сообщений, которые бот обрабатывает в групповых чатах
+GROUP_COMMAND_PREFIXES = ("/", "+NICK ", "!NICK ", "NICKS")
+GROUP_CHAT_TYPES = {"group", "supergroup"}
+
+# Стоимость действий в токенах лимита (по имени хендлера); остальные стоят DEFAULT_ACTION_COST
+ACTION_COSTS = {
+    "view_table": 10,
+    "handle_get_all_nick": 3,
+    "handle_nicks_page": 1,
+    "handle_plus_nick": 1,
+    "handle_exclamation_nick": 1,
+    "cmd_import_roster": 5,
+    "import_roster_document": 5,
+    "apply_roster_import": 5,
+    "cmd_export_roster": 3,
+    "cmd_take_snapshot": 3,
+    "cmd_roster_diff": 5
+}
+DEFAULT_ACTION_COST = 1
+# Лимиты действий: пользователь - 20 токенов, 1 в секунду; групповой чат - 30 токенов, 2 в секунду
+USER_ACTION_RATE = 1
+USER_ACTION_BURST = 20
+CHAT_ACTION_RATE = 2
+CHAT_ACTION_BURST = 30
+
+# Команды лички, которыми новый игрок выбирает альянс: /start <id> (ссылка t.me/<бот>?start=<id>), /register <id>
+ALLIANCE_COMMANDS = ("/start", "/register")
+
+# Ключи, которые middleware добавляет в данные хендлера
+CONTEXT_KEYS = {"user", "is_admin", "is_owner"}
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """Имя хендлера апдейта; для коллбэков - обработчика из таблицы коллбэков"""
+    route = data.get("route")
+    if route is not None:
+        return route.name
+    handler_object = data.get("handler")
+    return handler_object.callback.__name__ if handler_object is not None else "unknown"
+
+
+class TenantMiddleware(BaseMiddleware):
+    """Определяет альянс апдейта и делает его текущим (tenants.current).
+
+    Альянс находится по чату или игроку в реестре в памяти (см.
+    TenantRegistry.resolve); реестр загружается при первом апдейте. Пока
+    его не удается загрузить, апдейты не обрабатываются - иначе данные
+    другого альянса попали бы в альянс по умолчанию.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        registry = self.db.tenants
+        if not registry.loaded:
+            await self.db.tenant_registry()
+            if not registry.loaded:
+                log.warning("Update skipped: alliances are not loaded")
+                return None
+
+        chat = data.get("event_chat")
+        from_user = data.get("event_from_user")
+        tenant = registry.resolve(
+            chat.id if chat is not None else None,
+            chat is None or chat.type == "private",
+            from_user.id if from_user is not None else None,
+            self._requested_alliance(event)
+        )
+        logs.update_context(alliance_id=tenant.alliance_id)
+        token = tenants.use(tenant)
+        try:
+            return await handler(event, data)
+        finally:
+            tenants.reset(token)
+
+    @staticmethod
+    def _requested_alliance(event: Update) -> Optional[int]:
+        message = event.message
+        if message is None or message.chat.type != "private" or not message.text:
+            return None
+        parts = message.text.split()
+        if len(parts) == 2 and parts[0] in ALLIANCE_COMMANDS and parts[1].isdigit():
+            return int(parts[1])
+        return None
+
+
+class CallbackRouteMiddleware(BaseMiddleware):
+    """Разбирает данные коллбэка по таблице один раз за апдейт.
+
+    Маршрут передается дальше как `route`; коллбэки без обработчика и
+    кнопки устаревших версий отвечаются здесь и до хендлеров не доходят.
+    """
+
+    def __init__(self, table: CallbackTable):
+        self.table = table
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            route = self.table.resolve(event.data or "")
+        except OutdatedCallback:
+            await event.answer("Кнопка устарела, откройте меню заново.", show_alert=True)
+            return None
+        if route is None:
+            await event.answer()
+            return None
+        data["route"] = route
+        return await handler(event, data)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Один раз за апдейт загружает пользователя и его права.
+
+    Запись пользователя и флаг администратора запрашиваются параллельно,
+    результат передается в хендлеры как `user`, `is_admin` и `is_owner`.
+    Коллбэки без нужных прав отклоняются до вызова хендлера.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None:
+            return await handler(event, data)
+
+        # Во внутренней позиции хендлер уже известен, для коллбэков - из
+        # маршрута: если ему не нужны данные пользователя и права, лишние
+        # запросы не выполняем
+        route: Route = data.get("route")
+        handler_object = route.entry.handler if route is not None else data.get("handler")
+        if handler_object is not None and not CONTEXT_KEYS & handler_object.params:
+            if route is None or route.access not in (ADMIN, OWNER):
+                return await handler(event, data)
+
+        user, is_admin = await asyncio.gather(
+            self.db.get_user(from_user.id),
+            self.db.is_admin(from_user.id)
+        )
+        is_owner = from_user.id == tenants.current().owner_id
+
+        if route is not None and not self._is_allowed(route.access, is_admin, is_owner):
+            await event.answer("У вас нет прав для этого действия!", show_alert=True)
+            return None
+
+        data["user"] = user
+        data["is_admin"] = is_admin
+        data["is_owner"] = is_owner
+        return await handler(event, data)
+
+    @staticmethod
+    def _is_allowed(access: str, is_admin: bool, is_owner: bool) -> bool:
+        if access == OWNER:
+            return is_owner
+        if access == ADMIN:
+            return is_admin
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничивает частоту действий пользователя и группового чата.
+
+    Каждое действие списывает токены по ACTION_COSTS сразу из bucket'а
+    пользователя и, в группах, из bucket'а чата: отрисовка таблицы стоит
+    дорого, смена ника - дешево. Превысившему лимит бот один раз за период
+    ожидания вежливо отвечает, остальные такие апдейты молча отбрасывает.
+    Для сообщений работает во внутренней позиции, где уже известен хендлер,
+    для коллбэков - во внешней сразу после CallbackRouteMiddleware, чтобы
+    отклоненное нажатие не загружало пользователя. Лимиты заданы на деплой: `processes` воркеров делят их поровну (см. worker_share).
+    """
+
+    def __init__(self, processes: int = 1):
+        max_cost = max(ACTION_COSTS.values())
+        self.users = KeyedBuckets(*worker_share(USER_ACTION_RATE, USER_ACTION_BURST, processes, max_cost))
+        self.chats = KeyedBuckets(*worker_share(CHAT_ACTION_RATE, CHAT_ACTION_BURST, processes, max_cost))
+        # Ключ лимита -> до какого момента повторно не предупреждать
+        self._warned: Dict[Tuple[str, int], float] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None or (data.get("handler") is None and data.get("route") is None):
+            return await handler(event, data)
+        name = handler_name(data)
+        cost = ACTION_COSTS.get(name, DEFAULT_ACTION_COST)
+
+        chat = data.get("event_chat")
+        limit_key, wait = ("user", from_user.id), self.users.try_consume(from_user.id, cost)
+        if not wait and chat is not None and chat.type in GROUP_CHAT_TYPES:
+            wait = self.chats.try_consume(chat.id, cost)
+            if wait:
+                # Действие не выполнится - токены пользователя возвращаем
+                self.users.get(from_user.id).refund(cost)
+                limit_key = ("chat", chat.id)
+        if not wait:
+            return await handler(event, data)
+
+        THROTTLED.inc(handler=name)
+        await self._warn(event, limit_key, wait)
+        return None
+
+    async def _warn(self, event: TelegramObject, limit_key: Tuple[str, int], wait: float):
+        now = time.monotonic()
+        if self._warned.get(limit_key, 0) > now:
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return
+        if len(self._warned) >= KeyedBuckets.DEFAULT_MAX_KEYS:
+            self._warned = {key: until for key, until in self._warned.items() if until > now}
+        self._warned[limit_key] = now + wait
+        text = f"⏳ Слишком много запросов, попробуйте через {math.ceil(wait)} сек."
+        if isinstance(event, CallbackQuery):
+            await event.answer(text, show_alert=True)
+        elif isinstance(event, Message):
+            await event.reply(text)
+
+
+class GroupChatPrefilter(BaseMiddleware):
+    """Отбрасывает сообщения групповых чатов, которые бот все равно не обработает.
+
+    Работает на уровне апдейта раньше FSM и определения альянса: все
+    проверки выполняются в памяти, без обращений к хранилищу и базе.
+    Команды с "/" пропускаются всегда, чтобы /add_chat работал в новых чатах,
+    остальные команды - только в разрешенных чатах. Документы и сообщения с
+    подписью пропускаются (это /import), обычный текст - только если у игрока
+    в этом чате идет диалог (см. DialogTracking).
+    """
+
+    def __init__(self, db: Database, storage: DialogTracking):
+        self.db = db
+        self.storage = storage
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        message = event.message
+        if message is not None and message.chat.type in GROUP_CHAT_TYPES and self._should_drop(message):
+            self.dropped += 1
+            return None
+        return await handler(event, data)
+
+    def _should_drop(self, message: Message) -> bool:
+        if message.document is not None or message.caption is not None:
+            return False
+        text = message.text or ""
+        if text.startswith("/"):
+            return False
+        if text.startswith(GROUP_COMMAND_PREFIXES):
+            allowed_chats = self.db.allowed_chat_ids()
+            return allowed_chats is not None and message.chat.id not in allowed_chats
+        from_user = message.from_user
+        return from_user is None or not self.storage.has_dialog(message.chat.id, from_user.id)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Привязывает update_id и chat_id к логам апдейта и пишет время его обработки"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        chat = data.get("event_chat")
+        token = logs.bind(update_id=event.update_id, chat_id=chat.id if chat is not None else None)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            log.info("Update handled", extra={"latency_ms": latency_ms, "sample": True})
+            logs.unbind(token)
+
+
+class DbTraceMiddleware(BaseMiddleware):
+    """Считает запросы к Supabase за апдейт и предупреждает о превышении бюджета"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        token = dbtrace.start(event.update_id)
+        try:
+            return await handler(event, data)
+        finally:
+            dbtrace.finish(token)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замеряет время и ошибки каждого хендлера (внутренний middleware)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = handler_name(data)
+        dbtrace.set_handler(name)
+        logs.update_context(handler=name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Замеряет время исходящих запросов к Bot API по методам"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_ERRORS.inc(method=name)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method=name)
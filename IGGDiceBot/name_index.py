@@ -0,0 +1,104 @@
+import heapq
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+# Ключ игрока в индексе: ("telegram", tg_id) или ("fake", id из fake_names)
+PlayerKey = Tuple[str, int]
+
+
+def fold(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameIndex:
+    """Индекс игровых имен в памяти для поиска по фрагменту.
+
+    Имена хранятся в нижнем регистре (casefold). Короткие запросы (1-2
+    символа) ищутся по префиксу в отсортированном списке, длинные - по
+    пересечению триграмм с проверкой подстроки. Точные совпадения и
+    совпадения с начала имени идут первыми.
+    """
+
+    def __init__(self):
+        self.names: Dict[PlayerKey, str] = {}
+        self._folded: Dict[PlayerKey, str] = {}
+        self._sorted: List[Tuple[str, PlayerKey]] = []
+        self._trigrams: Dict[str, Set[PlayerKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, key: PlayerKey) -> bool:
+        return key in self.names
+
+    def add(self, key: PlayerKey, player_name: str):
+        if key in self.names:
+            self.remove(key)
+        folded = fold(player_name)
+        self.names[key] = player_name
+        self._folded[key] = folded
+        insort(self._sorted, (folded, key))
+        for trigram in trigrams(folded):
+            self._trigrams.setdefault(trigram, set()).add(key)
+
+    def remove(self, key: PlayerKey):
+        folded = self._folded.pop(key, None)
+        if folded is None:
+            return
+        del self.names[key]
+        position = bisect_left(self._sorted, (folded, key))
+        if position < len(self._sorted) and self._sorted[position] == (folded, key):
+            del self._sorted[position]
+        for trigram in trigrams(folded):
+            keys = self._trigrams.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._trigrams[trigram]
+
+    def search(self, query: str, limit: int = 20, kind: Optional[str] = None) -> List[PlayerKey]:
+        """Ключи игроков, в имени которых есть `query`; `kind` ограничивает вид игрока"""
+        query = fold(query)
+        if not query:
+            keys = (key for _, key in self._sorted)
+        elif len(query) < 3:
+            keys = self._prefixed(query)
+        else:
+            keys = self._containing(query)
+        if kind is not None:
+            keys = (key for key in keys if key[0] == kind)
+
+        if len(query) < 3:
+            # Префиксный обход уже идет по алфавиту, а точное совпадение в нем первое
+            return list(islice(keys, limit))
+
+        # Ранжирование: точное совпадение, затем начало имени, затем остальное
+        folded = self._folded
+        return heapq.nsmallest(
+            limit, keys,
+            key=lambda key: (folded[key] != query, not folded[key].startswith(query), folded[key], key)
+        )
+
+    def _prefixed(self, prefix: str):
+        position = bisect_left(self._sorted, (prefix,))
+        while position < len(self._sorted) and self._sorted[position][0].startswith(prefix):
+            yield self._sorted[position][1]
+            position += 1
+
+    def _containing(self, query: str) -> List[PlayerKey]:
+        postings = []
+        for trigram in trigrams(query):
+            keys = self._trigrams.get(trigram)
+            if not keys:
+                return []
+            postings.append(keys)
+        # Перебираем самый короткий список, остальные только проверяем
+        postings.sort(key=len)
+        smallest, rest = postings[0], postings[1:]
+        folded = self._folded
+        return [key for key in smallest if all(key in keys for keys in rest) and query in folded[key]]
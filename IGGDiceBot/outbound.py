@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from ratelimit import TokenBucket, KeyedBuckets, worker_share
+from logs import get_logger
+
+log = get_logger("outbound")
+
+# Лимиты Telegram: ~30 сообщений в секунду всего, ~1 в секунду в личный чат
+# и ~20 в минуту в группу
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+PRIVATE_CHAT_RATE = 1
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 3
+
+# Повторы при сетевых ошибках и ошибках сервера Telegram
+MAX_ATTEMPTS = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+
+WORKERS = 4
+
+URGENT = 0
+NORMAL = 1
+
+
+@dataclass(order=True)
+class OutboundMessage:
+    priority: int
+    seq: int
+    chat_id: Union[int, str] = field(compare=False)
+    text: str = field(compare=False)
+    kwargs: Dict[str, Any] = field(compare=False, default_factory=dict)
+    future: Optional[asyncio.Future] = field(compare=False, default=None)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+    attempts: int = field(compare=False, default=0)
+
+
+class OutboundScheduler:
+    """Центральная очередь исходящих сообщений.
+
+    Соблюдает глобальный лимит и лимиты на каждый чат, учитывает RetryAfter
+    (flood wait относится ко всему боту, поэтому на это время останавливается
+    вся отправка) и повторяет отправку с экспоненциальной задержкой.
+    `notify` ставит сообщение в очередь и сразу возвращает управление,
+    `send` ждет доставки.
+    """
+
+    def __init__(self, bot: Bot, workers: int = WORKERS, processes: int = 1):
+        self.bot = bot
+        self.workers = workers
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        # Лимиты Telegram общие на бота: `processes` воркеров делят их поровну
+        self.global_bucket = TokenBucket(*worker_share(GLOBAL_RATE, GLOBAL_BURST, processes))
+        self.private_buckets = KeyedBuckets(*worker_share(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST, processes))
+        self.group_buckets = KeyedBuckets(*worker_share(GROUP_CHAT_RATE, GROUP_CHAT_BURST, processes))
+        # До какого момента (time.monotonic) отправка приостановлена после RetryAfter
+        self.resume_at = 0.0
+        self._seq = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._delayed = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться отправки очереди (не дольше `timeout`) и остановить воркеров"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Outbound queue not drained: %s messages left", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self, chat_id: Union[int, str], text: str, **kwargs):
+        """Поставить сообщение в очередь, не дожидаясь отправки"""
+        self.queue.put_nowait(OutboundMessage(NORMAL, next(self._seq), chat_id, text, kwargs))
+
+    async def send(self, chat_id: Union[int, str], text: str, **kwargs):
+        """Отправить сообщение вне очереди обычных уведомлений и дождаться результата"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(OutboundMessage(URGENT, next(self._seq), chat_id, text, kwargs, future))
+        return await future
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "delayed": self._delayed,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rate_limited": self.rate_limited,
+            "avg_latency_ms": round(self._latency_total / self.sent * 1000, 1) if self.sent else 0.0,
+            "max_latency_ms": round(self._latency_max * 1000, 1)
+        }
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        # У групп и каналов отрицательные id или @username
+        if isinstance(chat_id, int) and chat_id > 0:
+            return self.private_buckets.get(chat_id)
+        return self.group_buckets.get(chat_id)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._process(item)
+            except Exception as e:
+                self._fail(item, e)
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, item: OutboundMessage):
+        pause = self.resume_at - time.monotonic()
+        while pause > 0:
+            await asyncio.sleep(pause)
+            pause = self.resume_at - time.monotonic()
+
+        chat_bucket = self._chat_bucket(item.chat_id)
+        wait = chat_bucket.try_consume()
+        if wait:
+            # Чат перегружен - откладываем сообщение, не задерживая другие чаты
+            self._requeue(item, wait)
+            return
+
+        while True:
+            wait = self.global_bucket.try_consume()
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+
+        try:
+            message = await self.bot.send_message(item.chat_id, item.text, **item.kwargs)
+        except TelegramRetryAfter as e:
+            self.rate_limited += 1
+            chat_bucket.tokens = 0
+            self.resume_at = max(self.resume_at, time.monotonic() + e.retry_after)
+            self._requeue(item, e.retry_after)
+            return
+        except (TelegramNetworkError, TelegramServerError) as e:
+            item.attempts += 1
+            if item.attempts >= MAX_ATTEMPTS:
+                self._fail(item, e)
+                return
+            self.retried += 1
+            self._requeue(item, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (item.attempts - 1)))
+            return
+
+        latency = time.monotonic() - item.enqueued_at
+        self.sent += 1
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        if item.future is not None and not item.future.done():
+            item.future.set_result(message)
+
+    def _requeue(self, item: OutboundMessage, delay: float):
+        self._delayed += 1
+        asyncio.get_running_loop().call_later(delay, self._put_back, item)
+
+    def _put_back(self, item: OutboundMessage):
+        self._delayed -= 1
+        self.queue.put_nowait(item)
+
+    def _fail(self, item: OutboundMessage, error: Exception):
+        self.failed += 1
+        if item.future is not None and not item.future.done():
+            item.future.set_exception(error)
+        else:
+            log.error("Outbound message failed: %s", error, extra={"chat_id": item.chat_id})
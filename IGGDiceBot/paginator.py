@@ -0,0 +1,89 @@
+import dataclasses
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from callbacks import Action, ANYONE, OWNER
+from singleflight import SingleFlight
+import tenants
+
+# Кнопка списка: (текст, callback_data)
+Item = Tuple[str, str]
+
+# Кнопок выбора на странице; Telegram допускает не больше 100 кнопок в клавиатуре
+PAGE_SIZE = 8
+
+# Все списки по имени - обработчик листания находит список по коллбэку
+PAGED_KEYBOARDS: Dict[str, "PagedKeyboard"] = {}
+
+
+def nav_row(page_data: Callable[[int], str], page: int, pages: int) -> List[InlineKeyboardButton]:
+    """Ряд ◀ n/m ▶; page_data(n) - данные коллбэка для перехода на страницу n"""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀", callback_data=page_data(page - 1)))
+    buttons.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=page_data(page)))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton(text="▶", callback_data=page_data(page + 1)))
+    return buttons
+
+
+@dataclasses.dataclass(frozen=True)
+class ListPage(Action, prefix="pg"):
+    name: str
+    page: int
+
+    def access_level(self) -> str:
+        # Листать список может тот, кому доступен сам список
+        keyboard = PAGED_KEYBOARDS.get(self.name)
+        return keyboard.access if keyboard is not None else OWNER
+
+
+class PagedKeyboard:
+    """Клавиатура выбора из длинного списка, по PAGE_SIZE кнопок на страницу.
+
+    Кнопки строятся один раз из `load()` и кэшируются для каждого альянса,
+    пока не изменится `version()`; одновременные загрузки объединяются. Листание меняет
+    клавиатуру того же сообщения (см. обработчик в bot.py), в коллбэке
+    (ListPage) передается только имя списка и номер страницы; листать
+    может тот, у кого есть права `access`.
+    """
+
+    def __init__(self, name: str, load: Callable[[], Awaitable[List[Item]]], version: Callable[[], int],
+                 footer: Optional[List[InlineKeyboardButton]] = None, page_size: int = PAGE_SIZE,
+                 access: str = ANYONE):
+        self.name = name
+        self.access = access
+        self.load = load
+        self.version = version
+        self.footer = footer
+        self.page_size = page_size
+        # id альянса -> (версия, кнопки)
+        self._items: Dict[int, Tuple[int, List[Item]]] = {}
+        self._loads = SingleFlight()
+        PAGED_KEYBOARDS[name] = self
+
+    async def items(self) -> List[Item]:
+        alliance_id, version = tenants.current_id(), self.version()
+        cached = self._items.get(alliance_id)
+        if cached is None or cached[0] != version:
+            items = await self._loads.do((alliance_id, version), self.load)
+            cached = self._items[alliance_id] = (version, items)
+        return cached[1]
+
+    async def markup(self, page: int = 0) -> Optional[InlineKeyboardMarkup]:
+        """Клавиатура страницы `page` (номер ограничивается числом страниц); None для пустого списка"""
+        items = await self.items()
+        if not items:
+            return None
+        pages = -(-len(items) // self.page_size)
+        page = min(max(page, 0), pages - 1)
+        start = page * self.page_size
+
+        keyboard = [
+            [InlineKeyboardButton(text=text, callback_data=callback_data)]
+            for text, callback_data in items[start:start + self.page_size]
+        ]
+        if pages > 1:
+            keyboard.append(nav_row(lambda number: ListPage(self.name, number).pack(), page, pages))
+        if self.footer:
+            keyboard.append(self.footer)
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
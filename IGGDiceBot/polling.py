@@ -0,0 +1,92 @@
+import asyncio
+import signal
+from typing import Optional
+from aiogram import Bot, Dispatcher
+from aiogram.methods import GetUpdates
+from update_queue import UpdateQueue
+from logs import get_logger
+
+log = get_logger("polling")
+
+# Long polling: Telegram держит запрос до POLLING_TIMEOUT секунд и отвечает
+# сразу, как только появляется апдейт, поэтому большой таймаут не добавляет
+# задержки, а только сокращает число пустых запросов
+POLLING_TIMEOUT = 25
+MAX_BACKOFF = 30
+
+
+class Poller:
+    """Получение апдейтов через getUpdates для запуска без публичного URL.
+
+    Апдейты передаются в ту же очередь UpdateQueue, что и в режиме вебхука:
+    параллельность ограничена числом ее обработчиков, а заполненная очередь
+    приостанавливает получение новых апдейтов.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, queue: UpdateQueue):
+        self.bot = bot
+        self.dp = dp
+        self.queue = queue
+        self.offset: Optional[int] = None
+        self.received = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        allowed_updates = self.dp.resolve_used_update_types()
+        backoff = 1.0
+        log.info("Polling started")
+        while True:
+            try:
+                updates = await self.bot(
+                    GetUpdates(offset=self.offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates),
+                    request_timeout=POLLING_TIMEOUT + 10
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Polling error: %s, retrying in %.0fs", e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = 1.0
+            for update in updates:
+                # Сдвигаем offset сразу: апдейт уже в очереди, повторно он не нужен
+                self.offset = update.update_id + 1
+                self.received += 1
+                await self.queue.put(update)
+
+
+async def run_polling():
+    """Запустить бота в режиме polling с теми же задачами запуска, что и у веб-приложения"""
+    from config import WEBHOOK_URL
+    from main import app, lifespan
+
+    if WEBHOOK_URL:
+        raise SystemExit("WEBHOOK_URL is set: unset it to run the bot with polling")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async with lifespan(app):
+        await stop_event.wait()
+        log.info("Stopping polling")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_polling())
@@ -0,0 +1,72 @@
+import time
+from typing import Dict, Hashable, Tuple
+
+
+class TokenBucket:
+    """Классический token bucket: `rate` токенов в секунду, не больше `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, cost: float = 1) -> float:
+        """Списать `cost` токенов. Возвращает 0 при успехе или сколько секунд ждать"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost: float = 1):
+        """Вернуть списанные токены, если действие так и не выполнилось"""
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class KeyedBuckets:
+    """Набор token bucket'ов по ключу (чат, пользователь) с очисткой простаивающих"""
+
+    DEFAULT_MAX_KEYS = 10000
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = DEFAULT_MAX_KEYS):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+
+    def get(self, key: Hashable) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._prune()
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.capacity)
+        return bucket
+
+    def try_consume(self, key: Hashable, cost: float = 1) -> float:
+        return self.get(key).try_consume(cost)
+
+    def _prune(self):
+        # Полные bucket'ы ничем не отличаются от новых - их можно забыть
+        for key in [key for key, bucket in self.buckets.items() if bucket.is_full()]:
+            del self.buckets[key]
+
+
+def worker_share(rate: float, burst: float, processes: int, min_burst: float = 1) -> Tuple[float, float]:
+    """Скорость и запас bucket'а одного из `processes` воркеров, поровну делящих общий лимит.
+
+    Bucket'ы у каждого воркера свои, поэтому без деления деплой из N
+    воркеров пропускал бы в N раз больше. Запас не меньше `min_burst`,
+    чтобы самое дорогое действие оставалось выполнимым.
+    """
+    processes = max(processes, 1)
+    return rate / processes, max(min_burst, burst / processes)
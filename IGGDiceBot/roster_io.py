@@ -0,0 +1,212 @@
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from name_index import fold
+
+FORMATS = ("csv", "tsv", "json")
+ROLES = ("лидер", "солдат", "участник")
+# Английские названия ролей тоже принимаются
+ROLE_ALIASES = {"leader": "лидер", "soldier": "солдат", "member": "участник"}
+DEFAULT_ROLE = "участник"
+MAX_NAME_LENGTH = 64
+MAX_ROWS = 1000
+# Сколько ошибок и имен каждой группы показывать в ответе
+MAX_LISTED = 10
+
+HEADER = ("player_name", "role")
+NAME_HEADERS = {"player_name", "name", "ник", "имя"}
+
+
+class RosterRow(NamedTuple):
+    player_name: str
+    role: str
+
+
+class RosterFormatError(ValueError):
+    """Документ не прошел проверку; `errors` - все найденные ошибки"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def detect_format(text: str, filename: Optional[str] = None) -> str:
+    """Формат документа по расширению файла или по содержимому"""
+    if filename and "." in filename:
+        extension = filename.rsplit(".", 1)[1].lower()
+        if extension in FORMATS:
+            return extension
+    stripped = text.lstrip()
+    if stripped.startswith(("[", "{")):
+        return "json"
+    first_line = stripped.split("\n", 1)[0]
+    return "tsv" if "\t" in first_line else "csv"
+
+
+def parse(text: str, fmt: Optional[str] = None, filename: Optional[str] = None) -> List[RosterRow]:
+    """Разобрать и проверить документ целиком.
+
+    Возвращает строки с нормализованной ролью или бросает RosterFormatError
+    со всеми ошибками сразу (пустые и слишком длинные имена, неизвестные
+    роли, повторы имен без учета регистра).
+    """
+    fmt = fmt or detect_format(text, filename)
+    records = _json_records(text) if fmt == "json" else _table_records(text, "\t" if fmt == "tsv" else None)
+
+    errors = []
+    rows = []
+    seen: Dict[str, int] = {}
+    for line, name, role in records:
+        name = " ".join((name or "").split())
+        role = (role or "").strip().lower() or DEFAULT_ROLE
+        role = ROLE_ALIASES.get(role, role)
+        if not name:
+            errors.append(f"строка {line}: пустое имя")
+            continue
+        if len(name) > MAX_NAME_LENGTH:
+            errors.append(f"строка {line}: имя длиннее {MAX_NAME_LENGTH} символов")
+            continue
+        if role not in ROLES:
+            errors.append(f"строка {line}: неизвестная роль '{role}'")
+            continue
+        if fold(name) in seen:
+            errors.append(f"строка {line}: имя '{name}' уже было в строке {seen[fold(name)]}")
+            continue
+        seen[fold(name)] = line
+        rows.append(RosterRow(name, role))
+
+    if len(rows) > MAX_ROWS:
+        errors.append(f"слишком много игроков: {len(rows)}, максимум {MAX_ROWS}")
+    if not rows and not errors:
+        errors.append("в документе нет игроков")
+    if errors:
+        raise RosterFormatError(errors)
+    return rows
+
+
+def _json_records(text: str) -> List[Tuple[int, str, str]]:
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise RosterFormatError([f"неверный JSON: {e.msg} (строка {e.lineno})"])
+    if isinstance(data, dict):
+        data = data.get("players")
+    if not isinstance(data, list):
+        raise RosterFormatError(['ожидается список [{"player_name": ..., "role": ...}]'])
+
+    records = []
+    for number, item in enumerate(data, 1):
+        if isinstance(item, dict):
+            name = item.get("player_name", item.get("name"))
+            records.append((number, str(name) if name is not None else "", str(item.get("role") or "")))
+        elif isinstance(item, list) and item:
+            records.append((number, str(item[0]), str(item[1]) if len(item) > 1 else ""))
+        elif isinstance(item, str):
+            records.append((number, item, ""))
+        else:
+            records.append((number, "", ""))
+    return records
+
+
+def _table_records(text: str, delimiter: Optional[str]) -> List[Tuple[int, str, str]]:
+    if delimiter is None:
+        # Разделитель CSV: запятая или точка с запятой (так сохраняет Excel)
+        first_line = text.lstrip().split("\n", 1)[0]
+        delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
+    records = []
+    first = True
+    for cells in reader:
+        if not any(cell.strip() for cell in cells):
+            continue
+        # Первая непустая строка может быть заголовком
+        if first and cells[0].strip().lower() in NAME_HEADERS:
+            first = False
+            continue
+        first = False
+        records.append((reader.line_num, cells[0], cells[1] if len(cells) > 1 else ""))
+    return records
+
+
+def dump(rows: List[RosterRow], fmt: str) -> str:
+    """Документ в формате `fmt`, который снова можно загрузить через parse"""
+    if fmt == "json":
+        return json.dumps([row._asdict() for row in rows], ensure_ascii=False, indent=2)
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n")
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+@dataclass
+class RosterDiff:
+    """Изменения ростера при загрузке документа.
+
+    Игроки сопоставляются по имени без учета регистра и лишних пробелов.
+    Фиктивные игроки, которых нет в документе, удаляются; игроки Telegram
+    не удаляются никогда и попадают в `not_listed`.
+    """
+    added: List[RosterRow] = field(default_factory=list)
+    # (строка игрока из базы, строка документа)
+    renamed: List[Tuple[Dict, RosterRow]] = field(default_factory=list)
+    role_changed: List[Tuple[Dict, RosterRow]] = field(default_factory=list)
+    unchanged: List[RosterRow] = field(default_factory=list)
+    removed: List[Dict] = field(default_factory=list)
+    not_listed: List[Dict] = field(default_factory=list)
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.renamed or self.role_changed or self.removed)
+
+
+def diff(rows: List[RosterRow], users: List[Dict], fake_names: List[Dict]) -> RosterDiff:
+    # При одинаковых именах игрок Telegram важнее фиктивного (тот будет удален как дубль)
+    existing: Dict[str, Dict] = {}
+    for player in fake_names + users:
+        existing[fold(player.get("player_name") or "")] = player
+
+    result = RosterDiff()
+    matched = set()
+    for row in rows:
+        player = existing.get(fold(row.player_name))
+        if player is None:
+            result.added.append(row)
+            continue
+        matched.add(id(player))
+        if player.get("player_name") != row.player_name:
+            result.renamed.append((player, row))
+        elif player.get("role") != row.role:
+            result.role_changed.append((player, row))
+        else:
+            result.unchanged.append(row)
+
+    result.removed = [fake for fake in fake_names if id(fake) not in matched]
+    result.not_listed = [user for user in users if id(user) not in matched]
+    return result
+
+
+def format_diff(roster_diff: RosterDiff, applied: bool) -> str:
+    """Текст отчета об изменениях: до применения - что будет сделано, после - что сделано"""
+    def names(items: List[str]) -> str:
+        shown = ", ".join(items[:MAX_LISTED])
+        return shown + (f" и еще {len(items) - MAX_LISTED}" if len(items) > MAX_LISTED else "")
+
+    groups = [
+        ("➕ Добавлены" if applied else "➕ Будут добавлены",
+         [row.player_name for row in roster_diff.added]),
+        ("✏️ Переименованы" if applied else "✏️ Будут переименованы",
+         [f"{player['player_name']} → {row.player_name}" for player, row in roster_diff.renamed]),
+        ("🔁 Сменили роль" if applied else "🔁 Сменят роль",
+         [f"{row.player_name} ({player['role']} → {row.role})" for player, row in roster_diff.role_changed]),
+        ("🗑️ Удалены" if applied else "🗑️ Будут удалены",
+         [fake["player_name"] for fake in roster_diff.removed]),
+    ]
+    lines = [f"{title}: {len(items)}" + (f"\n{names(items)}" if items else "") for title, items in groups]
+    lines.append(f"= Без изменений: {len(roster_diff.unchanged)}")
+    if roster_diff.not_listed:
+        lines.append(f"👤 Игроки Telegram не из списка (не удаляются): {len(roster_diff.not_listed)}\n"
+                     f"{names([user['player_name'] or '' for user in roster_diff.not_listed])}")
+    return "\n\n".join(lines)
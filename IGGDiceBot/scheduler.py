@@ -0,0 +1,202 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from logs import get_logger
+
+log = get_logger("scheduler")
+
+JobFunc = Callable[[], Awaitable[Any]]
+
+# Диапазоны полей cron: минута, час, день месяца, месяц, день недели (0 - воскресенье)
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+
+class CronSchedule:
+    """Расписание в формате cron из пяти полей (UTC): `*`, `*/n`, `a-b`, `a-b/n` и списки через запятую"""
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, CRON_FIELDS)
+        )
+        # Как в cron: если заданы и день месяца, и день недели, подходит любой из них
+        self.any_day = parts[2] != "*" and parts[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for item in field.split(","):
+            step = 1
+            if "/" in item:
+                item, step_text = item.split("/", 1)
+                step = int(step_text)
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start, end = (int(value) for value in item.split("-", 1))
+            else:
+                start = end = int(item)
+            if start < low or end > high or step < 1:
+                raise ValueError(f"Cron field {field!r} is out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        # isoweekday: 1 - понедельник ... 7 - воскресенье
+        day_ok = moment.day in self.days
+        weekday_ok = moment.isoweekday() % 7 in self.weekdays
+        return day_ok or weekday_ok if self.any_day else day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайший момент срабатывания строго после `moment`"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+
+class Job:
+    def __init__(self, name: str, func: JobFunc, interval: Optional[float] = None,
+                 cron: Optional[CronSchedule] = None, jitter: float = 0, run_immediately: bool = False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = cron
+        self.jitter = jitter
+        self.run_immediately = run_immediately
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_run_at: Optional[float] = None
+        self.next_run_at: Optional[float] = None
+
+    def delay(self) -> float:
+        """Секунды до следующего запуска с учетом случайного сдвига"""
+        if self.cron is not None:
+            now = datetime.now(timezone.utc)
+            delay = (self.cron.next_after(now) - now).total_seconds()
+        else:
+            delay = self.interval
+        return delay + random.uniform(0, self.jitter)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "schedule": self.cron.expression if self.cron else f"every {self.interval}s",
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_duration_ms": round(self.last_duration * 1000, 1),
+            "max_duration_ms": round(self.max_duration * 1000, 1),
+            "avg_duration_ms": round(self.total_duration / self.runs * 1000, 1) if self.runs else 0.0,
+            "last_run_at": self.last_run_at,
+            "next_run_at": self.next_run_at
+        }
+
+
+class Scheduler:
+    """Планировщик периодических задач внутри event loop.
+
+    Задачи запускаются по интервалу или cron-выражению, со случайным сдвигом
+    `jitter`. Если предыдущий запуск задачи еще не закончился, очередной
+    пропускается. Для каждой задачи собирается статистика времени выполнения.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._started = False
+
+    def every(self, name: str, seconds: float, func: JobFunc, jitter: float = 0, run_immediately: bool = False) -> Job:
+        return self._add(Job(name, func, interval=seconds, jitter=jitter, run_immediately=run_immediately))
+
+    def cron(self, name: str, expression: str, func: JobFunc, jitter: float = 0) -> Job:
+        return self._add(Job(name, func, cron=CronSchedule(expression), jitter=jitter))
+
+    def _add(self, job: Job) -> Job:
+        if job.name in self.jobs:
+            raise ValueError(f"Job {job.name!r} is already scheduled")
+        self.jobs[job.name] = job
+        if self._started:
+            self._tasks.append(asyncio.create_task(self._loop(job)))
+        return job
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._tasks = [asyncio.create_task(self._loop(job)) for job in self.jobs.values()]
+
+    async def stop(self):
+        self._started = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, job: Job):
+        running: Set[asyncio.Task] = set()
+        try:
+            if job.run_immediately:
+                self._launch(job, running)
+            while True:
+                delay = job.delay()
+                job.next_run_at = time.time() + delay
+                await asyncio.sleep(delay)
+                self._launch(job, running)
+        finally:
+            for task in running:
+                task.cancel()
+
+    def _launch(self, job: Job, running: Set[asyncio.Task]):
+        if job.running:
+            job.skipped += 1
+            return
+        job.running = True
+        task = asyncio.create_task(self._execute(job))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    async def _execute(self, job: Job):
+        job.last_run_at = time.time()
+        started = time.perf_counter()
+        try:
+            await job.func()
+        except Exception as e:
+            job.failures += 1
+            log.exception("Job %s failed: %s", job.name, e)
+        finally:
+            duration = time.perf_counter() - started
+            job.running = False
+            job.runs += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {name: job.metrics() for name, job in self.jobs.items()}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один.
+
+    Пока вычисление по ключу выполняется, остальные вызовы с тем же ключом
+    ждут его результат (или исключение), а не запускают свое. После
+    завершения ключ забывается - следующий вызов считает заново.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield: отмена одного ожидающего не должна отменять общее вычисление
+            return await asyncio.shield(future)
+
+        future = self._in_flight[key] = asyncio.ensure_future(func())
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # Исключение уже получили ожидающие; без этого asyncio ругается, если их не осталось
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,346 @@
+import asyncio
+import base64
+import hashlib
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from config import SNAPSHOT_KEEP_DAILY, SNAPSHOT_KEEP_WEEKLY
+from database import Database
+import dbtrace
+from logs import get_logger
+from metrics import SNAPSHOT_SECONDS, instrument_methods
+from name_index import fold
+import tenants
+
+log = get_logger("snapshots")
+
+# Версия двоичного формата снимка
+FORMAT_VERSION = 1
+# Виды игроков в порядке кодов формата
+KINDS = ("fake", "telegram")
+# Сколько имен каждой группы показывать в текстовом отчете
+MAX_LISTED = 30
+
+
+class SnapshotEntry(NamedTuple):
+    kind: str
+    player_id: int
+    player_name: str
+    role: str
+
+
+# Кодирование: varint без знака и zigzag для разностей идентификаторов
+
+def _put_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _put_text(out: bytearray, text: str):
+    raw = text.encode()
+    _put_varint(out, len(raw))
+    out += raw
+
+
+def _get_text(data: bytes, position: int) -> Tuple[str, int]:
+    length, position = _get_varint(data, position)
+    return data[position:position + length].decode(), position + length
+
+
+@dataclass
+class RosterSnapshot:
+    """Состав ростера на момент `taken_at`.
+
+    Записи отсортированы по (вид, id) - это ключ игрока, по которому снимки
+    сравниваются за один проход слиянием. В базе снимок хранится по
+    столбцам: коды видов, разности id, коды ролей из словаря ролей и имена;
+    результат сжимается zlib.
+    """
+    taken_at: datetime
+    entries: List[SnapshotEntry]
+    id: Optional[int] = None
+
+    @classmethod
+    def from_rows(cls, taken_at: datetime, users: List[Dict], fake_names: List[Dict]) -> "RosterSnapshot":
+        entries = [SnapshotEntry("telegram", user["tg_id"], user["player_name"] or "", user["role"] or "")
+                   for user in users]
+        entries += [SnapshotEntry("fake", fake["id"], fake["player_name"] or "", fake["role"] or "")
+                    for fake in fake_names]
+        entries.sort(key=lambda entry: (entry.kind, entry.player_id))
+        return cls(taken_at, entries)
+
+    def encode(self) -> bytes:
+        roles = sorted({entry.role for entry in self.entries})
+        role_codes = {role: code for code, role in enumerate(roles)}
+        kind_codes = {kind: code for code, kind in enumerate(KINDS)}
+
+        out = bytearray()
+        _put_varint(out, FORMAT_VERSION)
+        _put_varint(out, len(roles))
+        for role in roles:
+            _put_text(out, role)
+        _put_varint(out, len(self.entries))
+        out += bytes(kind_codes[entry.kind] for entry in self.entries)
+        previous = 0
+        for entry in self.entries:
+            delta = entry.player_id - previous
+            _put_varint(out, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+            previous = entry.player_id
+        for entry in self.entries:
+            _put_varint(out, role_codes[entry.role])
+        for entry in self.entries:
+            _put_text(out, entry.player_name)
+        return zlib.compress(bytes(out), 9)
+
+    @classmethod
+    def decode(cls, blob: bytes, taken_at: datetime, snapshot_id: Optional[int] = None) -> "RosterSnapshot":
+        data = zlib.decompress(blob)
+        version, position = _get_varint(data, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version {version}")
+        count, position = _get_varint(data, position)
+        roles = []
+        for _ in range(count):
+            role, position = _get_text(data, position)
+            roles.append(role)
+        count, position = _get_varint(data, position)
+        kinds = [KINDS[code] for code in data[position:position + count]]
+        position += count
+        ids = []
+        previous = 0
+        for _ in range(count):
+            value, position = _get_varint(data, position)
+            previous += value >> 1 if not value & 1 else -((value + 1) >> 1)
+            ids.append(previous)
+        role_codes = []
+        for _ in range(count):
+            code, position = _get_varint(data, position)
+            role_codes.append(code)
+        names = []
+        for _ in range(count):
+            name, position = _get_text(data, position)
+            names.append(name)
+        entries = [SnapshotEntry(kind, player_id, name, roles[code])
+                   for kind, player_id, name, code in zip(kinds, ids, names, role_codes)]
+        return cls(taken_at, entries, snapshot_id)
+
+
+@dataclass
+class SnapshotDiff:
+    joined: List[SnapshotEntry] = field(default_factory=list)
+    left: List[SnapshotEntry] = field(default_factory=list)
+    # (было, стало)
+    renamed: List[Tuple[SnapshotEntry, SnapshotEntry]] = field(default_factory=list)
+    role_changed: List[Tuple[SnapshotEntry, SnapshotEntry]] = field(default_factory=list)
+    # Фиктивный игрок заменен зарегистрировавшимся игроком Telegram с тем же ником
+    registered: List[Tuple[SnapshotEntry, SnapshotEntry]] = field(default_factory=list)
+
+    @property
+    def changes(self) -> int:
+        return len(self.joined) + len(self.left) + len(self.renamed) + len(self.role_changed) + len(self.registered)
+
+
+def diff(old: RosterSnapshot, new: RosterSnapshot) -> SnapshotDiff:
+    """Изменения между снимками: один проход слиянием по отсортированным ключам"""
+    result = SnapshotDiff()
+    old_entries, new_entries = old.entries, new.entries
+    i = j = 0
+    while i < len(old_entries) or j < len(new_entries):
+        before = old_entries[i] if i < len(old_entries) else None
+        after = new_entries[j] if j < len(new_entries) else None
+        before_key = (before.kind, before.player_id) if before else None
+        after_key = (after.kind, after.player_id) if after else None
+        if after is None or (before is not None and before_key < after_key):
+            result.left.append(before)
+            i += 1
+        elif before is None or after_key < before_key:
+            result.joined.append(after)
+            j += 1
+        else:
+            if before.player_name != after.player_name:
+                result.renamed.append((before, after))
+            if before.role != after.role:
+                result.role_changed.append((before, after))
+            i += 1
+            j += 1
+
+    # Ушедший фиктивный и пришедший игрок Telegram с тем же ником - это регистрация
+    left_fakes = {fold(entry.player_name): entry for entry in result.left if entry.kind == "fake"}
+    joined = []
+    for entry in result.joined:
+        fake = left_fakes.pop(fold(entry.player_name), None) if entry.kind == "telegram" else None
+        if fake is not None:
+            result.registered.append((fake, entry))
+        else:
+            joined.append(entry)
+    registered_fakes = {id(fake) for fake, _ in result.registered}
+    result.joined = joined
+    result.left = [entry for entry in result.left if id(entry) not in registered_fakes]
+    return result
+
+
+def diff_groups(roster_diff: SnapshotDiff) -> List[Tuple[str, str, List[str]]]:
+    """Группы отчета: (заголовок, ключ цвета TableRenderer, строки)"""
+    return [
+        ("➕ Пришли", "leader", [entry.player_name for entry in roster_diff.joined]),
+        ("➖ Ушли", "nopattern", [entry.player_name for entry in roster_diff.left]),
+        ("✏️ Сменили ник", "updated",
+         [f"{before.player_name} → {after.player_name}" for before, after in roster_diff.renamed]),
+        ("🔁 Сменили роль", "soldier",
+         [f"{after.player_name}: {before.role} → {after.role}" for before, after in roster_diff.role_changed]),
+        ("🔗 Зарегистрировались", "header", [after.player_name for _, after in roster_diff.registered]),
+    ]
+
+
+def describe(snapshot: RosterSnapshot) -> str:
+    taken_at = snapshot.taken_at.strftime("%d.%m.%Y %H:%M UTC")
+    source = f"снимок #{snapshot.id}" if snapshot.id is not None else "сейчас"
+    return f"{taken_at} ({source}, игроков: {len(snapshot.entries)})"
+
+
+def format_diff(roster_diff: SnapshotDiff, old: RosterSnapshot, new: RosterSnapshot) -> str:
+    lines = [f"📊 Изменения ростера\nс {describe(old)}\nпо {describe(new)}"]
+    if not roster_diff.changes:
+        lines.append("Изменений нет.")
+    for title, _, items in diff_groups(roster_diff):
+        if items:
+            shown = ", ".join(items[:MAX_LISTED])
+            more = f" и еще {len(items) - MAX_LISTED}" if len(items) > MAX_LISTED else ""
+            lines.append(f"{title}: {len(items)}\n{shown}{more}")
+    return "\n\n".join(lines)
+
+
+def render_diff(roster_diff: SnapshotDiff) -> Optional[bytes]:
+    """Картинка отчета в цветах таблицы ростера (выполнять в потоке); None, если рендер недоступен"""
+    from Patterns.TableRenderer import TableRenderer
+
+    groups = [group for group in diff_groups(roster_diff) if group[2]]
+    columns = {title: items for title, _, items in groups}
+    colors = {title: color for title, color, _ in groups}
+    image = TableRenderer().create_diff_image(columns, colors)
+    return image.getvalue() if image is not None else None
+
+
+def expired(snapshots: List[Tuple[int, datetime]], now: datetime,
+            keep_daily: int = SNAPSHOT_KEEP_DAILY, keep_weekly: int = SNAPSHOT_KEEP_WEEKLY) -> List[int]:
+    """Снимки к удалению: моложе `keep_daily` дней хранятся все, моложе
+    `keep_weekly` недель - последний за каждую неделю, старше - ни один.
+    Самый новый снимок не удаляется никогда."""
+    kept_weeks = set()
+    result = []
+    ordered = sorted(snapshots, key=lambda item: item[1], reverse=True)
+    for position, (snapshot_id, taken_at) in enumerate(ordered):
+        age = now - taken_at
+        week = taken_at.isocalendar()[:2]
+        if position == 0 or age < timedelta(days=keep_daily):
+            kept_weeks.add(week)
+        elif age < timedelta(weeks=keep_weekly) and week not in kept_weeks:
+            kept_weeks.add(week)
+        else:
+            result.append(snapshot_id)
+    return result
+
+
+def _parse_time(value: str) -> datetime:
+    taken_at = datetime.fromisoformat(value)
+    return taken_at if taken_at.tzinfo else taken_at.replace(tzinfo=timezone.utc)
+
+
+class SnapshotManager:
+    """Снимки ростера в таблице roster_snapshots.
+
+    Столбцы: id, taken_at, players (число игроков), digest (sha1 данных) и
+    data (base64 сжатого снимка) и alliance_id - у каждого альянса свои
+    снимки. Снимок, совпадающий с последним, не сохраняется повторно.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def _table(self):
+        return self.db.client.table("roster_snapshots")
+
+    async def current_snapshot(self) -> RosterSnapshot:
+        """Снимок текущего ростера (не сохраняется)"""
+        users, fake_names = await asyncio.gather(
+            self.db._fetch(self.db._scoped(self.db.client.table("users")
+                .select("tg_id, player_name, role"))
+                .eq("status", "approved")),
+            self.db._fetch(self.db._scoped(self.db.client.table("fake_names")
+                .select("id, player_name, role")))
+        )
+        return RosterSnapshot.from_rows(datetime.now(timezone.utc), users, fake_names)
+
+    async def take_snapshot(self) -> Optional[Dict]:
+        """Сохранить снимок текущего ростера; вернуть строку снимка без данных"""
+        snapshot = await self.current_snapshot()
+        blob = await asyncio.to_thread(snapshot.encode)
+        digest = hashlib.sha1(blob).hexdigest()
+
+        latest = await self.get_snapshots(limit=1)
+        if latest and latest[0]["digest"] == digest:
+            return latest[0]
+
+        rows = await self.db._fetch(self._table().insert({
+            "alliance_id": tenants.current_id(),
+            "taken_at": snapshot.taken_at.isoformat(),
+            "players": len(snapshot.entries),
+            "digest": digest,
+            "data": base64.b64encode(blob).decode()
+        }))
+        if not rows:
+            return None
+        log.info("Roster snapshot saved", extra={"snapshot_id": rows[0]["id"], "players": len(snapshot.entries),
+                                                 "bytes": len(blob)})
+        return {key: value for key, value in rows[0].items() if key != "data"}
+
+    async def get_snapshots(self, limit: int = 20) -> List[Dict]:
+        """Последние снимки (без данных), новые первыми"""
+        return await self.db._fetch(self.db._scoped(self._table()
+            .select("id, taken_at, players, digest"))
+            .order("taken_at", desc=True)
+            .limit(limit))
+
+    async def get_snapshot(self, snapshot_id: int) -> Optional[RosterSnapshot]:
+        rows = await self.db._fetch(self.db._scoped(self._table().select("*")).eq("id", snapshot_id))
+        return self._decode(rows[0]) if rows else None
+
+    async def get_snapshot_before(self, moment: datetime) -> Optional[RosterSnapshot]:
+        """Последний снимок, сделанный не позже `moment`"""
+        rows = await self.db._fetch(self.db._scoped(self._table()
+            .select("*"))
+            .lte("taken_at", moment.isoformat())
+            .order("taken_at", desc=True)
+            .limit(1))
+        return self._decode(rows[0]) if rows else None
+
+    async def prune_snapshots(self, now: Optional[datetime] = None) -> int:
+        """Удалить снимки по правилам хранения (см. expired); вернуть их число"""
+        rows = await self.db._fetch(self.db._scoped(self._table().select("id, taken_at")))
+        ids = expired([(row["id"], _parse_time(row["taken_at"])) for row in rows],
+                      now or datetime.now(timezone.utc))
+        if ids:
+            await self.db._execute(self.db._scoped(self._table().delete()).in_("id", ids))
+        return len(ids)
+
+    @staticmethod
+    def _decode(row: Dict) -> RosterSnapshot:
+        return RosterSnapshot.decode(base64.b64decode(row["data"]), _parse_time(row["taken_at"]), row["id"])
+
+
+dbtrace.label_methods(SnapshotManager)
+instrument_methods(SnapshotManager, SNAPSHOT_SECONDS)
@@ -0,0 +1,48 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from logs import get_logger
+
+log = get_logger("startup")
+
+# Точка отсчета: импорт этого модуля - первое, что делает main.py
+_started_at = time.monotonic()
+
+import_times: Dict[str, float] = {}
+marks: Dict[str, float] = {}
+first_update_ms: Optional[float] = None
+
+
+def _elapsed_ms(since: float) -> float:
+    return round((time.monotonic() - since) * 1000, 1)
+
+
+@contextmanager
+def measure_import(name: str):
+    """Засечь время импорта группы модулей"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        import_times[name] = _elapsed_ms(started)
+
+
+def mark(name: str):
+    """Отметить этап запуска (мс от старта процесса)"""
+    marks[name] = _elapsed_ms(_started_at)
+
+
+def first_update_handled():
+    """Вызывается после каждого обработанного апдейта, запоминает только первый"""
+    global first_update_ms
+    if first_update_ms is None:
+        first_update_ms = _elapsed_ms(_started_at)
+        log.info("First update handled %s ms after start", first_update_ms)
+
+
+def report() -> Dict[str, Any]:
+    return {
+        "imports_ms": import_times,
+        "marks_ms": marks,
+        "first_update_ms": first_update_ms
+    }
@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+from config import ADMIN_CHAT_ID, MY_TG_ID, DEFAULT_ALLIANCE_ID
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """Альянс: свои игроки, админы, разрешенные чаты, паттерны и кэши"""
+    alliance_id: int
+    name: str
+    admin_chat_id: int
+    owner_id: int
+
+
+# Альянс из переменных окружения существует всегда, даже без таблицы alliances
+DEFAULT = Tenant(DEFAULT_ALLIANCE_ID, "", int(ADMIN_CHAT_ID), int(MY_TG_ID))
+
+# Альянс текущего апдейта (задает TenantMiddleware) или фоновой задачи (scope)
+_current: ContextVar[Tenant] = ContextVar("tenant", default=DEFAULT)
+
+
+def current() -> Tenant:
+    return _current.get()
+
+
+def current_id() -> int:
+    return _current.get().alliance_id
+
+
+def use(tenant: Tenant):
+    """Сделать альянс текущим; вернуть токен для `reset`"""
+    return _current.set(tenant)
+
+
+def reset(token):
+    _current.reset(token)
+
+
+@contextmanager
+def scope(tenant: Tenant):
+    """Выполнить блок от имени альянса (фоновые задачи по всем альянсам)"""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+class TenantRegistry:
+    """Альянсы и принадлежность к ним чатов и игроков.
+
+    Все поиски - обращения к словарям: чат админов и разрешенный чат
+    принадлежат одному альянсу, игрок Telegram состоит в одном альянсе.
+    Части загружаются из базы независимо (см. Database.tenant_registry);
+    None - часть еще не загружена или сброшена.
+    """
+
+    def __init__(self, default: Tenant = DEFAULT):
+        self.default = default
+        self.alliances: Optional[Dict[int, Tenant]] = None
+        self._admin_chats: Dict[int, Tenant] = {}
+        # Разрешенный чат -> id альянса
+        self.allowed_chats: Optional[Dict[int, int]] = None
+        # tg_id игрока -> id альянса
+        self.members: Optional[Dict[int, int]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.alliances is not None and self.allowed_chats is not None and self.members is not None
+
+    def set_alliances(self, tenants: Iterable[Tenant]):
+        alliances = {tenant.alliance_id: tenant for tenant in tenants}
+        alliances.setdefault(self.default.alliance_id, self.default)
+        self.alliances = alliances
+        self._admin_chats = {tenant.admin_chat_id: tenant for tenant in alliances.values()}
+
+    def all(self) -> List[Tenant]:
+        return list((self.alliances or {self.default.alliance_id: self.default}).values())
+
+    def get(self, alliance_id: int) -> Optional[Tenant]:
+        return (self.alliances or {}).get(alliance_id)
+
+    def for_chat(self, chat_id: int) -> Optional[Tenant]:
+        """Альянс группового чата: чат админов или разрешенный чат"""
+        tenant = self._admin_chats.get(chat_id)
+        if tenant is None and self.allowed_chats is not None:
+            alliance_id = self.allowed_chats.get(chat_id)
+            tenant = self.get(alliance_id) if alliance_id is not None else None
+        return tenant
+
+    def for_member(self, tg_id: int) -> Optional[Tenant]:
+        alliance_id = (self.members or {}).get(tg_id)
+        return self.get(alliance_id) if alliance_id is not None else None
+
+    def resolve(self, chat_id: Optional[int], private: bool, user_id: Optional[int],
+                requested: Optional[int] = None) -> Tenant:
+        """Альянс апдейта.
+
+        Групповой чат определяет альянс сам; в незнакомой группе (например,
+        /add_chat) и в личке альянс берется по игроку. Новый игрок может
+        выбрать альянс ссылкой /start <id> или командой /register <id>
+        (`requested`), иначе попадает в альянс по умолчанию.
+        """
+        tenant = None
+        if chat_id is not None and not private:
+            tenant = self.for_chat(chat_id)
+        if tenant is None and user_id is not None:
+            tenant = self.for_member(user_id)
+        if tenant is None and requested is not None:
+            tenant = self.get(requested)
+        return tenant or self.get(self.default.alliance_id) or self.default
+
+    # Обновление после записи в базу
+    def add_member(self, tg_id: int, alliance_id: int):
+        if self.members is not None:
+            self.members[tg_id] = alliance_id
+
+    def remove_member(self, tg_id: int):
+        if self.members is not None:
+            self.members.pop(tg_id, None)
+
+    def allow_chat(self, chat_id: int, alliance_id: int):
+        if self.allowed_chats is not None:
+            self.allowed_chats[chat_id] = alliance_id
+
+    def forbid_chat(self, chat_id: int):
+        if self.allowed_chats is not None:
+            self.allowed_chats.pop(chat_id, None)
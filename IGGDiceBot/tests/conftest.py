@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Модули бота лежат плоско в IGGDiceBot и импортируют друг друга по имени
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config требует эти переменные при импорте; тестам они не нужны
+for name, value in {
+    "SUPABASE_URL": "http://localhost",
+    "SUPABASE_KEY": "test",
+    "BOT_TOKEN": "123456:test",
+    "ADMIN_CHAT_ID": "1",
+    "MY_TG_ID": "1",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,97 @@
+import dataclasses
+import pytest
+from callbacks import (
+    ADMIN, Action, ApproveRegistration, CallbackTable, OutdatedCallback, RejectRegistration, SetOwnRole, SetRole,
+    callbacks,
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Sample(Action, prefix="tst", version=2, access=ADMIN):
+    item_id: int
+    label: str
+
+
+async def handler(callback, action=None):
+    return action
+
+
+def table_with(*keys) -> CallbackTable:
+    table = CallbackTable()
+    for key in keys:
+        table.on(key)(handler)
+    # Разбор старых форматов берем у таблицы бота
+    for prefix, convert in callbacks._legacy:
+        table.legacy(prefix, convert)
+    return table
+
+
+def test_pack_unpack_round_trip():
+    action = Sample(42, "abc")
+    assert action.pack() == "tst:2:42:abc"
+    assert Sample.unpack(["2", "42", "abc"]) == action
+    assert SetRole("leader", 123456789).pack() == "ro:1:leader:123456789"
+
+
+def test_pack_rejects_data_over_64_bytes():
+    assert len(Sample(1, "x" * 56).pack()) == 64
+    with pytest.raises(ValueError, match="64 bytes"):
+        Sample(1, "x" * 57).pack()
+    # Ограничение в байтах, а не в символах
+    with pytest.raises(ValueError):
+        Sample(1, "я" * 29).pack()
+
+
+def test_duplicate_prefix_is_rejected():
+    with pytest.raises(ValueError):
+        @dataclasses.dataclass(frozen=True)
+        class Duplicate(Action, prefix="tst"):
+            pass
+
+
+def test_resolve_typed_and_plain_buttons():
+    table = table_with(Sample, "view_table")
+    route = table.resolve("tst:2:7:name")
+    assert route.action == Sample(7, "name")
+    assert route.access == ADMIN
+    assert route.name == "handler"
+    assert table.resolve("view_table").action is None
+    # Лишние поля у простой кнопки, чужой префикс и мусор в полях
+    assert table.resolve("view_table:1") is None
+    assert table.resolve("unknown") is None
+    assert table.resolve("tst:2:seven:name") is None
+    assert table.resolve("tst:2:7") is None
+
+
+def test_resolve_outdated_version():
+    table = table_with(Sample)
+    with pytest.raises(OutdatedCallback):
+        table.resolve("tst:1:7:name")
+
+
+def test_on_rejects_second_handler():
+    table = table_with("view_table")
+    with pytest.raises(ValueError):
+        table.on("view_table")(handler)
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("approve_123", ApproveRegistration(123)),
+    ("reject_456", RejectRegistration(456)),
+    ("role_soldier_789", SetRole("soldier", 789)),
+    ("role_reject_789", SetRole("reject", 789)),
+    ("self_role_leader", SetOwnRole("leader")),
+])
+def test_legacy_formats(data, expected):
+    table = table_with(ApproveRegistration, RejectRegistration, SetRole, SetOwnRole)
+    assert table.resolve(data).action == expected
+
+
+@pytest.mark.parametrize("data", ["approve_abc", "role_soldier", "role_member_x"])
+def test_broken_legacy_data(data):
+    table = table_with(ApproveRegistration, SetRole)
+    assert table.resolve(data) is None
+
+
+def test_legacy_without_handler():
+    assert table_with().resolve("approve_1") is None
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from aiogram.fsm.storage.base import StorageKey
+import fsm_storage
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=-100, user_id=7)
+OTHER = StorageKey(bot_id=1, chat_id=-100, user_id=8)
+
+
+def test_state_and_data_survive_reopen(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def write():
+        storage = SQLiteStorage(path)
+        await storage.set_state(KEY, "Form:name")
+        await storage.set_data(KEY, {"step": 2, "name": "Alice"})
+        assert await storage.get_state(KEY) == "Form:name"
+        assert await storage.get_data(KEY) == {"step": 2, "name": "Alice"}
+        await storage.flush()
+        await storage.close()
+
+    async def read():
+        storage = SQLiteStorage(path)
+        try:
+            assert storage.has_dialog(-100, 7) and not storage.has_dialog(-100, 8)
+            assert await storage.get_state(KEY) == "Form:name"
+            assert await storage.get_data(KEY) == {"step": 2, "name": "Alice"}
+            assert await storage.get_state(OTHER) is None
+            assert await storage.get_data(OTHER) == {}
+        finally:
+            await storage.close()
+
+    asyncio.run(write())
+    asyncio.run(read())
+
+
+def test_cleared_state_is_deleted_from_file(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def scenario():
+        storage = SQLiteStorage(path)
+        await storage.set_state(KEY, "Form:name")
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+        reopened = SQLiteStorage(path)
+        count = reopened.conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+        await reopened.close()
+        return count
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_negative_entries_stay_hot_after_flush(tmp_path, monkeypatch):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"))
+        reads = []
+        read = storage._read
+        monkeypatch.setattr(storage, "_read", lambda key: reads.append(key) or read(key))
+        assert await storage.get_state(OTHER) is None
+        await storage.set_state(KEY, "Form:name")
+        await storage.flush()
+        # Пустая запись OTHER не вытеснена: повторное чтение идет из памяти
+        assert await storage.get_state(OTHER) is None
+        assert len(reads) == 2
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_eviction_when_full_and_expired(tmp_path, monkeypatch):
+    monkeypatch.setattr(fsm_storage, "HOT_MAX_ENTRIES", 3)
+
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"), ttl=60)
+        await storage.set_state(KEY, "Form:name")
+        for user_id in range(100, 103):
+            await storage.get_state(StorageKey(bot_id=1, chat_id=-100, user_id=user_id))
+        # Переполнение вытеснило пустые записи, но не запись с состоянием
+        assert storage._key(KEY) in storage.hot
+        assert len(storage.hot) == 2
+        await storage.flush()
+        storage.hot[storage._key(KEY)].updated_at = time.time() - 120
+        storage._evict()
+        assert storage._key(KEY) not in storage.hot
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+class LocalBroadcast:
+    """Broadcast между хранилищами одного процесса"""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, topic, callback):
+        self.subscribers.append(callback)
+
+    def publish(self, topic, *args):
+        for callback in self.subscribers:
+            if callback.__self__ is not self.publisher:
+                callback(*args)
+
+
+def test_shared_workers_see_each_other_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def scenario():
+        first, second = SQLiteStorage(path, shared=True), SQLiteStorage(path, shared=True)
+        channel = LocalBroadcast()
+        first.attach_broadcast(channel)
+        second.attach_broadcast(channel)
+        reads = []
+        read = second._read
+        monkeypatch.setattr(second, "_read", lambda key: reads.append(key) or read(key))
+
+        assert await second.get_state(KEY) is None
+        assert await second.get_state(KEY) is None
+        assert len(reads) == 1
+
+        channel.publisher = first
+        await first.set_state(KEY, "Form:name")
+        await first.set_data(KEY, {"step": 1})
+        # Запись сразу в файле, горячий слой соседа сброшен
+        assert await second.get_state(KEY) == "Form:name"
+        assert await second.get_data(KEY) == {"step": 1}
+        assert len(reads) == 2
+        assert second.has_dialog(-100, 7)
+
+        channel.publisher = second
+        await second.set_state(KEY, None)
+        assert not first.has_dialog(-100, 7)
+        assert await first.get_state(KEY) is None
+        assert await first.get_data(KEY) == {"step": 1}
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
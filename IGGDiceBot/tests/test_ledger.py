@@ -0,0 +1,42 @@
+import asyncio
+from ledger import UpdateLedger
+
+
+class Backing:
+    def __init__(self, claimed=()):
+        self.claimed = set(claimed)
+
+    def claim(self, update_id: int) -> bool:
+        if update_id in self.claimed:
+            return False
+        self.claimed.add(update_id)
+        return True
+
+    def release(self, update_id: int):
+        self.claimed.discard(update_id)
+
+
+def test_duplicates_and_eviction():
+    async def scenario():
+        ledger = UpdateLedger(capacity=2)
+        assert await ledger.register(1)
+        assert not await ledger.register(1)
+        assert await ledger.register(2)
+        assert await ledger.register(3)
+        # 1 вытеснен из буфера
+        assert await ledger.register(1)
+        assert len(ledger) == 2
+        assert ledger.duplicates == 1
+    asyncio.run(scenario())
+
+
+def test_backing_and_release():
+    async def scenario():
+        backing = Backing(claimed={5})
+        ledger = UpdateLedger(capacity=10, backing=backing)
+        assert not await ledger.register(5)
+        assert await ledger.register(6)
+        await ledger.release(6)
+        assert 6 not in backing.claimed
+        assert await ledger.register(6)
+    asyncio.run(scenario())
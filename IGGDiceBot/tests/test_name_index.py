@@ -0,0 +1,34 @@
+from name_index import NameIndex, fold
+
+
+def build():
+    index = NameIndex()
+    for key, name in [(("telegram", 1), "Dragon"), (("telegram", 2), "Drago  Slayer"),
+                      (("fake", 3), "Snapdragon"), (("fake", 4), "Alice")]:
+        index.add(key, name)
+    return index
+
+
+def test_fold_normalizes_case_and_spaces():
+    assert fold("  Big   DRAGON ") == "big dragon"
+
+
+def test_search_ranks_exact_then_prefix():
+    index = build()
+    assert index.search("dragon") == [("telegram", 1), ("fake", 3)]
+    assert index.search("drag") == [("telegram", 2), ("telegram", 1), ("fake", 3)]
+    assert index.search("dr") == [("telegram", 2), ("telegram", 1)]
+    assert index.search("dragon", kind="fake") == [("fake", 3)]
+    assert index.search("zzz") == []
+
+
+def test_add_replaces_and_remove_forgets():
+    index = build()
+    index.add(("telegram", 1), "Phoenix")
+    assert index.search("dragon") == [("fake", 3)]
+    assert index.search("phoe") == [("telegram", 1)]
+    index.remove(("fake", 3))
+    index.remove(("fake", 99))
+    assert ("fake", 3) not in index
+    assert index.search("dragon") == []
+    assert len(index) == 3
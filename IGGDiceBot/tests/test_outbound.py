@@ -0,0 +1,60 @@
+import asyncio
+import time
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SendMessage
+import outbound
+from outbound import OutboundScheduler
+
+
+class FakeBot:
+    """Bot API, который отвечает 429 на первые `flood` запросов"""
+
+    def __init__(self, flood: int = 0, retry_after: int = 1, errors: int = 0):
+        self.flood = flood
+        self.retry_after = retry_after
+        self.errors = errors
+        self.sent = []
+        self.rejected = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if self.flood:
+            self.flood -= 1
+            self.rejected.append(time.monotonic())
+            raise TelegramRetryAfter(method, "Flood control exceeded", self.retry_after)
+        if self.errors:
+            self.errors -= 1
+            raise TelegramServerError(method, "Bad Gateway")
+        self.sent.append((time.monotonic(), chat_id, text))
+        return text
+
+
+def run(bot: FakeBot, messages: int) -> OutboundScheduler:
+    async def scenario():
+        scheduler = OutboundScheduler(bot)
+        scheduler.start()
+        results = await asyncio.gather(*(scheduler.send(chat_id, f"message {chat_id}")
+                                         for chat_id in range(1, messages + 1)))
+        await scheduler.stop()
+        assert sorted(results) == sorted(f"message {chat_id}" for chat_id in range(1, messages + 1))
+        return scheduler
+    return asyncio.run(scenario())
+
+
+def test_retry_after_pauses_all_workers():
+    bot = FakeBot(flood=1, retry_after=1)
+    scheduler = run(bot, 8)
+    assert scheduler.rate_limited == 1
+    assert len(bot.rejected) == 1
+    # Сообщения, взятые другими воркерами после 429, ждут окончания flood wait
+    flooded_at = bot.rejected[0]
+    late = [sent_at for sent_at, _, _ in bot.sent if sent_at > flooded_at]
+    assert late and min(late) >= flooded_at + 1
+
+
+def test_server_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(outbound, "BASE_BACKOFF", 0.01)
+    bot = FakeBot(errors=2)
+    scheduler = run(bot, 2)
+    assert scheduler.retried == 2
+    assert scheduler.sent == 2
@@ -0,0 +1,47 @@
+import asyncio
+import datetime
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, Document, Message, Update, User
+from fsm_storage import MemoryFSMStorage
+from middlewares import GroupChatPrefilter
+
+GROUP_ID = -100
+ALLOWED_ID = -200
+PLAYER = User(id=7, is_bot=False, first_name="Alice")
+
+
+class Db:
+    def allowed_chat_ids(self):
+        return {ALLOWED_ID}
+
+
+def message(text=None, chat_id=GROUP_ID, chat_type="supergroup", **fields) -> Message:
+    return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=chat_id, type=chat_type),
+                   from_user=PLAYER, text=text, **fields)
+
+
+def passes(prefilter: GroupChatPrefilter, event: Message) -> bool:
+    async def handler(update, data):
+        return True
+    return bool(asyncio.run(prefilter(handler, Update(update_id=1, message=event), {})))
+
+
+def test_drops_chatter_and_commands_of_unknown_chats():
+    prefilter = GroupChatPrefilter(Db(), MemoryFSMStorage())
+    assert not passes(prefilter, message("hello"))
+    assert not passes(prefilter, message("+NICK Alice"))
+    assert passes(prefilter, message("+NICK Alice", chat_id=ALLOWED_ID))
+    assert passes(prefilter, message("/add_chat"))
+    assert passes(prefilter, message(caption="/import", document=Document(file_id="f", file_unique_id="u")))
+    assert passes(prefilter, message("hello", chat_id=PLAYER.id, chat_type="private"))
+    assert prefilter.dropped == 2
+
+
+def test_passes_text_of_players_in_a_dialog():
+    storage = MemoryFSMStorage()
+    prefilter = GroupChatPrefilter(Db(), storage)
+    key = StorageKey(bot_id=1, chat_id=GROUP_ID, user_id=PLAYER.id)
+    asyncio.run(storage.set_state(key, "RegistrationStates:waiting_name"))
+    assert passes(prefilter, message("New Name"))
+    asyncio.run(storage.set_state(key, None))
+    assert not passes(prefilter, message("New Name"))
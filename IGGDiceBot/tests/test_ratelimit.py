@@ -0,0 +1,39 @@
+import ratelimit
+from ratelimit import KeyedBuckets, TokenBucket, worker_share
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_waits_and_refills(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_consume() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_consume() == 0.5
+    clock.now += 0.5
+    assert bucket.try_consume() == 0.0
+    bucket.refund(10)
+    assert bucket.is_full() and bucket.tokens == 3
+
+
+def test_keyed_buckets_prune_full(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    buckets = KeyedBuckets(rate=1, capacity=1, max_keys=2)
+    buckets.try_consume("a")
+    buckets.try_consume("b")
+    clock.now += 5
+    buckets.try_consume("c")
+    assert list(buckets.buckets) == ["c"]
+
+
+def test_worker_share():
+    assert worker_share(30, 30, 3) == (10, 10)
+    assert worker_share(1, 2, 4, min_burst=3) == (0.25, 3)
+    assert worker_share(5, 5, 0) == (5, 5)
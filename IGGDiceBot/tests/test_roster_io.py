@@ -0,0 +1,59 @@
+import pytest
+from roster_io import RosterFormatError, RosterRow, detect_format, dump, parse
+
+
+def test_parse_csv_with_header_and_aliases():
+    text = "player_name,role\nAlice,leader\n  Bob   Smith ,солдат\nCarol,\n"
+    assert parse(text) == [
+        RosterRow("Alice", "лидер"),
+        RosterRow("Bob Smith", "солдат"),
+        RosterRow("Carol", "участник"),
+    ]
+
+
+def test_parse_semicolon_csv_and_tsv():
+    assert parse("Alice;member\nBob;leader\n") == [RosterRow("Alice", "участник"), RosterRow("Bob", "лидер")]
+    assert parse("Alice\tsoldier\n", filename="roster.tsv") == [RosterRow("Alice", "солдат")]
+
+
+def test_parse_json_variants():
+    text = '{"players": [{"player_name": "Alice", "role": "leader"}, ["Bob", "солдат"], "Carol"]}'
+    assert parse(text) == [
+        RosterRow("Alice", "лидер"),
+        RosterRow("Bob", "солдат"),
+        RosterRow("Carol", "участник"),
+    ]
+
+
+def test_detect_format():
+    assert detect_format("[]") == "json"
+    assert detect_format("a\tb\n") == "tsv"
+    assert detect_format("a,b\n") == "csv"
+    assert detect_format("a,b\n", filename="list.JSON") == "json"
+
+
+def test_parse_collects_all_errors():
+    text = "Alice,leader\n,member\nALICE ,member\nBob,king\n" + "X" * 65 + ",member\n"
+    with pytest.raises(RosterFormatError) as error:
+        parse(text)
+    assert error.value.errors == [
+        "строка 2: пустое имя",
+        "строка 3: имя 'ALICE' уже было в строке 1",
+        "строка 4: неизвестная роль 'king'",
+        "строка 5: имя длиннее 64 символов",
+    ]
+
+
+def test_parse_rejects_empty_and_broken_documents():
+    with pytest.raises(RosterFormatError, match="нет игроков"):
+        parse("player_name,role\n")
+    with pytest.raises(RosterFormatError, match="неверный JSON"):
+        parse("[{", fmt="json")
+    with pytest.raises(RosterFormatError, match="ожидается список"):
+        parse('{"name": "Alice"}')
+
+
+@pytest.mark.parametrize("fmt", ["csv", "tsv", "json"])
+def test_dump_parse_round_trip(fmt):
+    rows = [RosterRow("Alice, the \"Great\"", "лидер"), RosterRow("Боб", "солдат"), RosterRow("Carol", "участник")]
+    assert parse(dump(rows, fmt), fmt) == rows
@@ -0,0 +1,31 @@
+from datetime import datetime, timezone
+import pytest
+from scheduler import CronSchedule
+
+
+def at(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_next_after_is_strictly_later():
+    schedule = CronSchedule("*/15 * * * *")
+    assert schedule.next_after(at(2026, 1, 1, 10, 0)) == at(2026, 1, 1, 10, 15)
+    assert schedule.next_after(at(2026, 1, 1, 10, 59, 30)) == at(2026, 1, 1, 11, 0)
+
+
+def test_next_after_rolls_over_month_and_year():
+    assert CronSchedule("30 3 1 * *").next_after(at(2026, 1, 31, 12, 0)) == at(2026, 2, 1, 3, 30)
+    assert CronSchedule("0 0 1 1 *").next_after(at(2026, 6, 1)) == at(2027, 1, 1, 0, 0)
+
+
+def test_weekday_and_day_of_month_are_alternatives():
+    # 2026-01-04 - воскресенье
+    schedule = CronSchedule("0 12 15 * 0")
+    assert schedule.next_after(at(2026, 1, 1)) == at(2026, 1, 4, 12, 0)
+    assert CronSchedule("0 12 * * 1-5").next_after(at(2026, 1, 3)) == at(2026, 1, 5, 12, 0)
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "*/0 * * * *", "0 0 30 2 *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression).next_after(at(2026, 1, 1))
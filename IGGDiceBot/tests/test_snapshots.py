@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from snapshots import RosterSnapshot, SnapshotEntry, diff, expired
+
+TAKEN_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def snapshot(users, fakes):
+    return RosterSnapshot.from_rows(
+        TAKEN_AT,
+        [{"tg_id": tg_id, "player_name": name, "role": role} for tg_id, name, role in users],
+        [{"id": fake_id, "player_name": name, "role": role} for fake_id, name, role in fakes],
+    )
+
+
+def test_from_rows_sorts_by_kind_and_id():
+    roster = snapshot([(30, "Carol", "лидер"), (10, "Alice", "участник")], [(2, "Bob", "солдат")])
+    assert [(entry.kind, entry.player_id) for entry in roster.entries] == [
+        ("fake", 2), ("telegram", 10), ("telegram", 30)]
+
+
+def test_encode_decode_round_trip():
+    roster = snapshot(
+        [(5_000_000_000, "Алиса", "лидер"), (7, "", "участник"), (123456789, "Bob 🎲", "солдат")],
+        [(1, "Fake One", "участник"), (900, "Fake Two", "")],
+    )
+    decoded = RosterSnapshot.decode(roster.encode(), TAKEN_AT, snapshot_id=42)
+    assert decoded.entries == roster.entries
+    assert decoded.taken_at == TAKEN_AT
+    assert decoded.id == 42
+
+
+def test_encode_decode_empty_snapshot():
+    assert RosterSnapshot.decode(snapshot([], []).encode(), TAKEN_AT).entries == []
+
+
+def test_decode_rejects_unknown_version():
+    import zlib
+    with pytest.raises(ValueError):
+        RosterSnapshot.decode(zlib.compress(bytes([99])), TAKEN_AT)
+
+
+def test_diff_groups_changes():
+    old = snapshot([(1, "Alice", "участник"), (2, "Bob", "солдат")], [(10, "Newbie", "участник"), (11, "Gone", "участник")])
+    new = snapshot([(1, "Alicia", "лидер"), (3, "newbie", "участник"), (4, "Dave", "участник")], [])
+    result = diff(old, new)
+    assert [entry.player_name for entry in result.joined] == ["Dave"]
+    assert [entry.player_name for entry in result.left] == ["Gone", "Bob"]
+    assert [(before.player_name, after.player_name) for before, after in result.renamed] == [("Alice", "Alicia")]
+    assert [(before.role, after.role) for before, after in result.role_changed] == [("участник", "лидер")]
+    assert result.registered == [(SnapshotEntry("fake", 10, "Newbie", "участник"),
+                                  SnapshotEntry("telegram", 3, "newbie", "участник"))]
+    assert result.changes == 6
+
+
+def test_expired_keeps_recent_and_weekly():
+    now = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    snapshots = [(day, now - timedelta(days=day)) for day in range(0, 60)]
+    removed = set(expired(snapshots, now, keep_daily=7, keep_weekly=4))
+    assert not removed & set(range(7))
+    assert all(day in removed for day in range(28, 60))
+    kept_older = [day for day in range(7, 28) if day not in removed]
+    # По одному снимку на каждую неделю между днем 7 и неделей 4
+    weeks = {(now - timedelta(days=day)).isocalendar()[:2] for day in kept_older}
+    assert len(weeks) == len(kept_older)
@@ -0,0 +1,92 @@
+import asyncio
+from supabase import create_client
+from database import Database
+from loadtest.standins import FAKE_SUPABASE_KEY, PostgrestStandIn
+import tenants
+from tenants import Tenant, TenantRegistry
+
+DEFAULT = Tenant(1, "", -1000, 100)
+SECOND = Tenant(2, "Second", -2000, 200)
+
+
+def make_registry() -> TenantRegistry:
+    result = TenantRegistry(DEFAULT)
+    result.set_alliances([SECOND])
+    result.allowed_chats = {-1001: 1, -2001: 2}
+    result.members = {1000: 1, 2000: 2}
+    return result
+
+
+def test_resolve_by_chat():
+    registry = make_registry()
+    assert registry.resolve(-2000, False, None) == SECOND
+    assert registry.resolve(-1001, False, 2000) == DEFAULT
+    # Чат альянса важнее игрока из другого альянса
+    assert registry.resolve(-2001, False, 1000) == SECOND
+
+
+def test_resolve_by_user():
+    registry = make_registry()
+    assert registry.resolve(2000, True, 2000) == SECOND
+    # Незнакомая группа (например, /add_chat) - по игроку
+    assert registry.resolve(-9999, False, 2000) == SECOND
+    assert registry.resolve(None, True, 2000) == SECOND
+
+
+def test_resolve_unknown_tenant():
+    registry = make_registry()
+    assert registry.resolve(3000, True, 3000, requested=2) == SECOND
+    assert registry.resolve(3000, True, 3000, requested=99) == DEFAULT
+    assert registry.resolve(3000, True, 3000) == DEFAULT
+    assert registry.resolve(-9999, False, None) == DEFAULT
+    # Выбрать альянс может только новый игрок
+    assert registry.resolve(1000, True, 1000, requested=2) == DEFAULT
+
+
+def test_scoped_adds_alliance_filter():
+    db = Database()
+    with tenants.scope(SECOND):
+        query = Database._scoped(db.client.table("users").select("*"))
+    assert query.params.get("alliance_id") == "eq.2"
+
+
+def test_database_keeps_alliances_apart():
+    async def scenario():
+        standin = PostgrestStandIn()
+        url = await standin.start()
+        try:
+            standin.seed(players=3, fake_players=2, admins=(500,), chats=(-1001,), first_tg_id=1000, alliance_id=1)
+            standin.seed(players=2, fake_players=1, chats=(-2001,), first_tg_id=2000, alliance_id=2)
+            standin.insert("alliances", {"id": 2, "name": "Second", "admin_chat_id": -2000, "owner_tg_id": 200})
+            db = Database()
+            db.client = create_client(url, FAKE_SUPABASE_KEY)
+
+            registry = await db.tenant_registry()
+            assert registry.loaded
+            second = registry.resolve(-2001, False, 1000)
+            assert second.alliance_id == 2
+            assert registry.resolve(None, True, 2001).alliance_id == 2
+            assert registry.resolve(None, True, 1001).alliance_id == 1
+
+            with tenants.scope(second):
+                assert {user["tg_id"] for user in await db.get_all_users()} == {2000, 2001}
+                assert [fake["alliance_id"] for fake in await db.get_all_fake_names()] == [2]
+                assert await db.get_user(1000) is None
+                assert not await db.is_admin(500)
+                assert await db.add_user(3000, "new", "@new")
+                # Игрок другого альянса во второй не добавляется
+                assert not await db.add_user(1000, "user1000", "@user1000")
+                assert await db.is_chat_allowed(-2001) and not await db.is_chat_allowed(-1001)
+
+            with tenants.scope(registry.get(1)):
+                users = await db.get_all_users()
+                assert {user["tg_id"] for user in users} == {1000, 1001, 1002, 500}
+                assert await db.is_admin(500)
+                assert await db.get_user(3000) is None
+
+            assert [row["alliance_id"] for row in standin.tables["users"] if row["tg_id"] == 3000] == [2]
+            assert registry.for_member(3000) == second
+        finally:
+            await standin.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+from aiogram.types import Chat, User
+from middlewares import ThrottlingMiddleware
+
+PLAYER = User(id=7, is_bot=False, first_name="Alice")
+
+
+class Route:
+    name = "view_table"
+
+
+def test_callbacks_are_throttled_by_route_before_next_middleware():
+    throttling = ThrottlingMiddleware()
+    warnings = []
+
+    async def warn(event, limit_key, wait):
+        warnings.append(limit_key)
+    throttling._warn = warn
+    calls = []
+
+    async def next_middleware(event, data):
+        calls.append(data["route"].name)
+
+    async def press():
+        # Во внешней позиции хендлера еще нет - стоимость берется по маршруту
+        await throttling(next_middleware, object(), {"event_from_user": PLAYER, "route": Route()})
+
+    async def scenario():
+        for _ in range(3):
+            await press()
+
+    asyncio.run(scenario())
+    # view_table стоит 10 токенов из 20
+    assert calls == ["view_table", "view_table"]
+    assert warnings == [("user", PLAYER.id)]
+
+
+def test_group_limit_refunds_user_tokens():
+    throttling = ThrottlingMiddleware()
+    throttling.chats.get(-100).tokens = 0
+
+    async def warn(event, limit_key, wait):
+        pass
+    throttling._warn = warn
+
+    async def next_middleware(event, data):
+        raise AssertionError("throttled action must not run")
+
+    data = {"event_from_user": PLAYER, "event_chat": Chat(id=-100, type="supergroup"), "route": Route()}
+    asyncio.run(throttling(next_middleware, object(), data))
+    assert throttling.users.get(PLAYER.id).tokens == throttling.users.capacity
+
+
+def test_updates_without_handler_or_route_pass():
+    throttling = ThrottlingMiddleware()
+
+    async def next_middleware(event, data):
+        return "handled"
+
+    assert asyncio.run(throttling(next_middleware, object(), {"event_from_user": PLAYER})) == "handled"
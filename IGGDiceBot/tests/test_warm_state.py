@@ -0,0 +1,70 @@
+import marshal
+import sys
+import time
+import zlib
+import warm_state
+from warm_state import HEADER, MAGIC, MAX_AGE, decode, encode
+
+STATE = {
+    "alliances": [[1, "", -1000, 100]],
+    "members": {1000: 1, 2000: 2},
+    "states": {1: {"names": [["telegram", 1000, "Alice"]], "roster_version": 3}},
+}
+
+
+def blob_with(version=warm_state.FORMAT_VERSION, python=sys.version_info[:2], saved_at=None, payload=None,
+              checksum=None) -> bytes:
+    payload = marshal.dumps(STATE) if payload is None else payload
+    header = HEADER.pack(version, python[0], python[1], time.time() if saved_at is None else saved_at,
+                         zlib.crc32(payload) if checksum is None else checksum)
+    return MAGIC + header + payload
+
+
+def test_round_trip():
+    now = time.time()
+    assert decode(encode(STATE, now), now) == STATE
+    assert decode(blob_with()) == STATE
+
+
+def test_rejects_corrupted_payload():
+    blob = bytearray(encode(STATE, time.time()))
+    blob[-1] ^= 0xFF
+    assert decode(bytes(blob)) is None
+    assert decode(blob_with(checksum=1)) is None
+
+
+def test_rejects_old_file():
+    now = time.time()
+    assert decode(encode(STATE, now - MAX_AGE - 1), now) is None
+    assert decode(encode(STATE, now - MAX_AGE + 60), now) == STATE
+
+
+def test_rejects_other_python_version():
+    major, minor = sys.version_info[:2]
+    assert decode(blob_with(python=(major, minor + 1))) is None
+    assert decode(blob_with(python=(major - 1, minor))) is None
+
+
+def test_rejects_other_format_and_garbage():
+    assert decode(blob_with(version=warm_state.FORMAT_VERSION + 1)) is None
+    assert decode(b"XXXX" + blob_with()[len(MAGIC):]) is None
+    assert decode(MAGIC) is None
+    assert decode(b"") is None
+
+
+def test_load_skips_missing_and_broken_files(tmp_path):
+    class Db:
+        restored = None
+
+        def restore_state(self, state):
+            self.restored = state
+
+    db = Db()
+    path = tmp_path / "warm_state.bin"
+    assert not warm_state.load(db, str(path))
+    path.write_bytes(blob_with(checksum=1))
+    assert not warm_state.load(db, str(path))
+    assert db.restored is None
+    path.write_bytes(encode(STATE, time.time()))
+    assert warm_state.load(db, str(path))
+    assert db.restored == STATE
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, List, Union
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from config import UPDATE_WORKERS, UPDATE_QUEUE_SIZE
+import startup
+from logs import get_logger
+
+log = get_logger("update_queue")
+
+# Окно, за которое считается скорость разбора очереди, секунды
+DRAIN_RATE_WINDOW = 60
+
+
+class UpdateQueue:
+    """Ограниченная очередь входящих апдейтов с пулом обработчиков.
+
+    Вебхук только кладет апдейт в очередь и сразу отвечает Telegram, а
+    `concurrency` воркеров передают апдейты в диспетчер. Переполненная очередь
+    отклоняет новые апдейты, чтобы Telegram доставил их позже.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, concurrency: int = UPDATE_WORKERS, maxsize: int = UPDATE_QUEUE_SIZE):
+        self.bot = bot
+        self.dp = dp
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks: List[asyncio.Task] = []
+        self._completed: deque = deque(maxlen=10000)
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout: float = 30.0):
+        """Дообработать очередь (не дольше `timeout`) и остановить воркеров"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Update queue not drained: %s updates left", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def full(self) -> bool:
+        return self.queue.full()
+
+    def offer(self, update: Union[Dict[str, Any], Update]) -> bool:
+        """Поставить апдейт в очередь без ожидания. False, если очередь заполнена"""
+        try:
+            self.queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def put(self, update: Union[Dict[str, Any], Update]):
+        """Поставить апдейт в очередь, дождавшись свободного места"""
+        await self.queue.put(update)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            self.in_flight += 1
+            try:
+                # Вебхук передает сырой JSON, polling - уже разобранный Update
+                if isinstance(update, Update):
+                    await self.dp.feed_update(self.bot, update)
+                else:
+                    await self.dp.feed_raw_update(self.bot, update)
+                self.processed += 1
+                startup.first_update_handled()
+            except Exception as e:
+                self.failed += 1
+                update_id = update.update_id if isinstance(update, Update) else update.get("update_id")
+                log.exception("Error processing update: %s", e, extra={"update_id": update_id})
+            finally:
+                self.in_flight -= 1
+                self._completed.append(time.monotonic())
+                self.queue.task_done()
+
+    def drain_rate(self) -> float:
+        """Сколько апдейтов в секунду обработано за последние DRAIN_RATE_WINDOW секунд"""
+        since = time.monotonic() - DRAIN_RATE_WINDOW
+        count = 0
+        for finished_at in reversed(self._completed):
+            if finished_at < since:
+                break
+            count += 1
+        return count / DRAIN_RATE_WINDOW
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "drain_rate": round(self.drain_rate(), 2)
+        }
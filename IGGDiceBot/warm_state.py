@@ -0,0 +1,118 @@
+import asyncio
+import marshal
+import os
+import struct
+import sys
+import time
+import zlib
+from typing import Any, Dict, Optional
+from database import Database
+from logs import get_logger
+from Patterns.PatternManager import PatternManager
+import tenants
+
+log = get_logger("warm_state")
+
+# Файл: MAGIC, заголовок HEADER, затем данные marshal
+MAGIC = b"IGGW"
+# Версия содержимого: увеличивается при изменении export_state
+FORMAT_VERSION = 1
+# Версия формата, версия Python (формат marshal от нее зависит), время сохранения, crc32 данных
+HEADER = struct.Struct(">HBBdI")
+# Состояние старше этого не загружается, секунды
+MAX_AGE = 7 * 24 * 3600
+
+
+def encode(state: Dict[str, Any], saved_at: float) -> bytes:
+    payload = marshal.dumps(state)
+    header = HEADER.pack(FORMAT_VERSION, sys.version_info.major, sys.version_info.minor, saved_at,
+                         zlib.crc32(payload))
+    return MAGIC + header + payload
+
+
+def decode(blob: bytes, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Состояние из файла; None, если файл другого формата, поврежден или устарел"""
+    start = len(MAGIC) + HEADER.size
+    if len(blob) < start or not blob.startswith(MAGIC):
+        return None
+    version, major, minor, saved_at, checksum = HEADER.unpack_from(blob, len(MAGIC))
+    if version != FORMAT_VERSION or (major, minor) != sys.version_info[:2]:
+        return None
+    if (now or time.time()) - saved_at > MAX_AGE:
+        return None
+    payload = memoryview(blob)[start:]
+    if zlib.crc32(payload) != checksum:
+        return None
+    return marshal.loads(payload)
+
+
+async def save(db: Database, path: str):
+    """Записать кэши в файл; снимок берется в цикле событий, запись идет в потоке"""
+    state = db.export_state()
+    blob = encode(state, time.time())
+    size = await asyncio.to_thread(_write, path, blob)
+    log.info("Warm state saved", extra={"bytes": size, "alliances": len(state["states"]), "sample": True})
+
+
+def _write(path: str, blob: bytes) -> int:
+    # Через временный файл, чтобы при падении не остался недописанный
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(blob)
+    os.replace(temporary, path)
+    return len(blob)
+
+
+def load(db: Database, path: str) -> bool:
+    """Заполнить кэши из файла, если он есть и подходит; вернуть, удалось ли"""
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as file:
+            blob = file.read()
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        log.warning("Warm state is not readable: %s", e)
+        return False
+    try:
+        state = decode(blob)
+    except (ValueError, EOFError, TypeError) as e:
+        log.warning("Warm state is corrupted: %s", e)
+        state = None
+    if state is None:
+        log.info("Warm state skipped: outdated or incompatible file")
+        return False
+    try:
+        db.restore_state(state)
+    except (KeyError, TypeError, ValueError) as e:
+        log.warning("Warm state does not match this version: %s", e)
+        return False
+    log.info("Warm state loaded", extra={"bytes": len(blob), "latency_ms": round((time.perf_counter() - started) * 1000, 1)})
+    return True
+
+
+async def validate(db: Database) -> bool:
+    """Сверить загруженные с диска кэши с базой; вернуть, было ли что-то устаревшим"""
+    before = db.export_state()
+    await db.refresh_state()
+    registry = db.tenants
+    for alliance_id in list(db._states):
+        with tenants.scope(registry.get(alliance_id)):
+            await PatternManager(db).get_active_pattern()
+    after = db.export_state()
+
+    stale = [part for part in ("alliances", "allowed_chats", "members") if before[part] != after[part]]
+    for alliance_id, state in after["states"].items():
+        saved = before["states"].get(alliance_id, {})
+        stale += [f"{alliance_id}.{part}" for part, value in state.items()
+                  if saved.get(part) is not None and _normalized(part, saved[part]) != _normalized(part, value)]
+    if stale:
+        log.warning("Warm state was stale, refreshed from database", extra={"stale": stale})
+    else:
+        log.info("Warm state validated")
+    return bool(stale)
+
+
+def _normalized(part: str, value: Any) -> Any:
+    # Порядок имен в индексе не важен
+    return sorted(value) if part == "names" and value is not None else value
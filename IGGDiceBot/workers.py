@@ -0,0 +1,167 @@
+import asyncio
+import fcntl
+import glob
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from config import RUNTIME_DIR
+from logs import get_logger
+
+log = get_logger("workers")
+
+# Как долго помнить обработанные update_id в общей таблице, секунды
+CLAIM_TTL = 3600
+
+# Разделитель темы и аргументов в сообщении Broadcast (не встречается в никах)
+SEPARATOR = "\0"
+
+
+class LeaderLock:
+    """Файловая блокировка: задачи «одна на деплой» выполняет только ее владелец.
+
+    Блокировка снимается ОС при завершении процесса, поэтому после падения
+    лидера ее может забрать другой воркер.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def acquired(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class _BroadcastProtocol(asyncio.DatagramProtocol):
+    def __init__(self, broadcast: "Broadcast"):
+        self.broadcast = broadcast
+
+    def datagram_received(self, data: bytes, addr):
+        self.broadcast._dispatch(data.decode())
+
+
+class Broadcast:
+    """Локальный канал сообщений между воркерами одной машины.
+
+    Каждый воркер слушает свой Unix datagram сокет в общей папке, `publish`
+    отправляет название темы и аргументы во все сокеты, кроме своего;
+    подписчик получает аргументы строками. Используется для сброса кэшей
+    после изменений, сделанных другим воркером.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self.subscribers: Dict[str, List[Callable[..., None]]] = {}
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._sender: Optional[socket.socket] = None
+
+    def subscribe(self, topic: str, callback: Callable[..., None]):
+        self.subscribers.setdefault(topic, []).append(callback)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _BroadcastProtocol(self), local_addr=self.path, family=socket.AF_UNIX
+        )
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+
+    def publish(self, topic: str, *args):
+        if self._sender is None:
+            return
+        message = SEPARATOR.join([topic, *map(str, args)]).encode()
+        for peer in glob.glob(os.path.join(self.directory, "*.sock")):
+            if peer == self.path:
+                continue
+            try:
+                self._sender.sendto(message, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Сокет остался от завершившегося воркера
+                try:
+                    os.remove(peer)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                log.warning("Broadcast to %s dropped: receiver is busy", peer)
+
+    def _dispatch(self, message: str):
+        topic, *args = message.split(SEPARATOR)
+        for callback in self.subscribers.get(topic, []):
+            try:
+                callback(*args)
+            except Exception as e:
+                log.exception("Broadcast handler error for %s: %s", topic, e)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+        if self._sender is not None:
+            self._sender.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UpdateClaims:
+    """Общая для воркеров таблица обработанных update_id.
+
+    Апдейт обрабатывает тот воркер, который первым его «застолбил», поэтому
+    повторная доставка в соседний воркер не выполняется второй раз.
+    Методы блокируются на SQLite и вызываются из потока (см. UpdateLedger).
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Потеря последних заявок при сбое питания допустима: апдейт обработается повторно
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS claims (update_id INTEGER PRIMARY KEY, claimed_at REAL NOT NULL)")
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    def claim(self, update_id: int) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO claims VALUES (?, ?)", (update_id, now))
+            if now - self._last_cleanup > CLAIM_TTL / 10:
+                self._last_cleanup = now
+                self.conn.execute("DELETE FROM claims WHERE claimed_at < ?", (now - CLAIM_TTL,))
+            return cursor.rowcount == 1
+
+    def release(self, update_id: int):
+        """Снять заявку апдейта, который не удалось принять в обработку"""
+        with self._lock:
+            self.conn.execute("DELETE FROM claims WHERE update_id = ?", (update_id,))
+
+    def close(self):
+        self.conn.close()
+
+
+os.makedirs(RUNTIME_DIR, exist_ok=True)
+leader_lock = LeaderLock(os.path.join(RUNTIME_DIR, "leader.lock"))
+broadcast = Broadcast(RUNTIME_DIR)
+update_claims = UpdateClaims(os.path.join(RUNTIME_DIR, "claims.sqlite3"))